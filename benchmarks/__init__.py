@@ -0,0 +1 @@
+"""Benchmark suite for the app with synthetic datasets (see ``benchmarks.run``)."""
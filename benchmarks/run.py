@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite: how the app scales with the number of marks.
+
+For every size (default 10, 1k and 100k marks; add 1000000 explicitly) and
+manifest backend, a synthetic data directory is generated once
+(``benchmarks.synth``) and a fresh subprocess measures, with
+``INPI_DATA_DIR`` pointing at it:
+
+- ``load_manifest``: opening the manifest and reading one record;
+- ``app_first_run``: the first script run (resources, sidebar, home page);
+- ``sidebar``: a warm rerun, i.e. sidebar construction + home page;
+- ``sidebar_search``: a search term in the sidebar (count + one page);
+- ``query_page``: selecting a query (heat layer, blend, 5 neighbor cards);
+- ``query_page_wide``: the same with 50 neighbors, of which the first page
+  (``NEIGHBOR_PAGE_SIZE``) is rendered; it should stay close to
+  ``query_page``, and the difference gives ``neighbor_card`` (cost of one
+  card on the page);
+- ``query_page_first``: the first query page of the process, i.e. what the
+  first user of a freshly started replica waits for;
+- ``warmup``, ``app_first_run_warm``, ``query_page_first_warm``: the same
+  first requests in another fresh subprocess, after ``inpi_heatmap.warmup``
+  has run (as ``warmup serve`` does in the container).
+
+``blend_images`` is timed separately at several resolutions, cold (decode
+and resize) and warm (cached buffers), next to ``zoom``: one viewport of the
+tile pyramid at full resolution (region + heat overlay), which should stay
+flat as the resolution grows. Each subprocess reports its peak RSS
+after every phase, so memory growth can be attributed.
+
+Results go to one JSON file; ``compare`` prints the ratio between two of
+them and exits non-zero when a timing regressed beyond ``--threshold``.
+
+    python -m benchmarks.run                          # -> benchmarks/results/<commit>.json
+    python -m benchmarks.run --sizes 10 1000 1000000 --backends sqlite
+    python -m benchmarks.run compare old.json new.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_SIZES = (10, 1_000, 100_000)
+DEFAULT_BACKENDS = ("json", "sqlite")
+BLEND_RESOLUTIONS = (256, 512, 1024, 2048, 4096)
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+CACHE_DIR = Path(tempfile.gettempdir()) / "inpi_bench"
+RESULT_PREFIX = "BENCH_RESULT "
+NEIGHBOR_PAGE_SIZE = 10  # streamlit_app.NEIGHBOR_PAGE_SIZE
+ZOOM_VIEW = (768, 512)  # streamlit_app.ZOOM_VIEW
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def summarize(runs: list) -> dict:
+    return {"median_ms": round(statistics.median(runs), 3), "min_ms": round(min(runs), 3), "runs_ms": [round(r, 3) for r in runs]}
+
+
+def timed(fn, repeat: int) -> dict:
+    runs = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        runs.append((time.perf_counter() - t0) * 1000)
+    return summarize(runs)
+
+
+# ---------------------------------------------------------------------------
+# Measurements (run inside the per-dataset subprocess)
+# ---------------------------------------------------------------------------
+
+
+def measure_app(n: int, repeat: int) -> dict:
+    """All app-level timings for the dataset ``INPI_DATA_DIR`` points at."""
+    from streamlit.testing.v1 import AppTest
+
+    from benchmarks.synth import N_NEIGHBORS, WIDE_KEY, WIDE_NEIGHBORS, key_of
+    from inpi_heatmap.config import APP_DIR, DATA_DIR
+    from inpi_heatmap.manifest_store import open_manifest_store
+
+    timings, rss = {}, {"start": peak_rss_mb()}
+
+    def load(i):
+        open_manifest_store(DATA_DIR).get(key_of(i % n))
+
+    timings["load_manifest"] = timed(load, repeat)
+    rss["load_manifest"] = peak_rss_mb()
+
+    at = AppTest.from_file(str(APP_DIR / "streamlit_app.py"), default_timeout=900)
+    timings["app_first_run"] = timed(lambda i: at.run(), 1)
+    rss["app_first_run"] = peak_rss_mb()
+    timings["sidebar"] = timed(lambda i: at.run(), repeat)
+
+    def search(i):
+        at.sidebar.text_input[0].set_value(key_of((i * 7919) % n)[:-1]).run()
+
+    timings["sidebar_search"] = timed(search, repeat)
+    rss["sidebar"] = peak_rss_mb()
+
+    def select(key):
+        at.sidebar.text_input[0].set_value(key).run()
+        t0 = time.perf_counter()
+        at.sidebar.radio[0].set_value(key).run()
+        assert not at.exception, at.exception
+        return (time.perf_counter() - t0) * 1000
+
+    timings["query_page"] = summarize([select(key_of((i * 104729) % n)) for i in range(repeat)])
+    timings["query_page_first"] = summarize(timings["query_page"]["runs_ms"][:1])
+    # One wide query only: later repeats of it run warm, like a user revisiting it.
+    timings["query_page_wide"] = summarize([select(WIDE_KEY) for _ in range(repeat)])
+    rss["query_page"] = peak_rss_mb()
+
+    extra = timings["query_page_wide"]["runs_ms"][0] - timings["query_page"]["runs_ms"][0]
+    extra_cards = min(WIDE_NEIGHBORS, NEIGHBOR_PAGE_SIZE) - N_NEIGHBORS
+    timings["neighbor_card"] = {"median_ms": round(max(extra, 0.0) / extra_cards, 3)}
+    return {"timings": timings, "peak_rss_mb": {k: round(v, 1) for k, v in rss.items()}}
+
+
+def measure_warm_start(n: int) -> dict:
+    """First script run and first query page of a fresh process, after the warm-up."""
+    from streamlit.testing.v1 import AppTest
+
+    from benchmarks.synth import key_of
+    from inpi_heatmap import warmup
+    from inpi_heatmap.config import APP_DIR
+
+    timings = {"warmup": timed(lambda i: warmup.warm(), 1)}
+    at = AppTest.from_file(str(APP_DIR / "streamlit_app.py"), default_timeout=900)
+    timings["app_first_run_warm"] = timed(lambda i: at.run(), 1)
+    # Same key as the cold query_page_first.
+    at.sidebar.text_input[0].set_value(key_of(0)).run()
+    timings["query_page_first_warm"] = timed(lambda i: at.sidebar.radio[0].set_value(key_of(0)).run(), 1)
+    assert not at.exception, at.exception
+    return {"timings": timings, "peak_rss_mb": {"warm_start": round(peak_rss_mb(), 1)}}
+
+
+def measure_blend(repeat: int, workdir: Path) -> dict:
+    from inpi_heatmap import pyramid
+    from inpi_heatmap.heat import overlay_on
+    from inpi_heatmap.image_cache import ImageCache, blend_images
+
+    rng = np.random.default_rng(0)
+    out = {}
+    for res in BLEND_RESOLUTIONS:
+        query, heat = workdir / f"query_{res}.png", workdir / f"heat_{res}.png"
+        if not query.exists():
+            Image.fromarray(rng.integers(0, 255, (res, res, 4), dtype=np.uint8), "RGBA").save(query)
+            # Half resolution, like a heatmap PNG that needs resizing to the query.
+            Image.fromarray(rng.integers(0, 255, (res // 2, res // 2, 3), dtype=np.uint8)).save(heat)
+        cache = ImageCache(max_bytes=1 << 31)
+        cold = timed(lambda i: blend_images(query, heat, 0.45, cache=ImageCache(max_bytes=1 << 31)), repeat)
+        blend_images(query, heat, 0.45, cache=cache)
+        warm = timed(lambda i: blend_images(query, heat, 0.2 + 0.1 * i, cache=cache), repeat)
+
+        pyr = pyramid.open_pyramid(workdir / f"pyramid_{res}")
+        if pyr is None:
+            pyramid.build(query, workdir / f"pyramid_{res}")
+            pyr = pyramid.open_pyramid(workdir / f"pyramid_{res}")
+        grid = rng.random((14, 14), dtype=np.float32)
+        box = pyr.viewport(0, (0.5, 0.5), ZOOM_VIEW)
+        zoom = timed(lambda i: overlay_on(pyr.region(0, box), grid, 85, 99, pyr.size(0), box), repeat)
+        out[str(res)] = {"cold": cold, "warm": warm, "zoom": zoom}
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+
+def _metadata() -> dict:
+    import PIL
+    import streamlit
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "versions": {"streamlit": streamlit.__version__, "numpy": np.__version__, "pillow": PIL.__version__},
+    }
+
+
+def run_dataset(n: int, backend: str, repeat: int, cache_dir: Path) -> dict:
+    from benchmarks.synth import generate
+
+    t0 = time.perf_counter()
+    data_dir = generate(cache_dir / f"{n}-{backend}", n, sqlite=backend == "sqlite")
+    print(f"[{n} {backend}] dados prontos em {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    env = dict(os.environ, INPI_DATA_DIR=str(data_dir))
+    result = {"size": n, "backend": backend, "timings": {}, "peak_rss_mb": {}}
+    for extra in ([], ["--warm"]):
+        cmd = [sys.executable, "-m", "benchmarks.run", "_worker", str(n), "--repeat", str(repeat), *extra]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True, cwd=Path(__file__).resolve().parent.parent)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith(RESULT_PREFIX)]
+        if proc.returncode != 0 or not lines:
+            return {"size": n, "backend": backend, "error": proc.stderr.strip().splitlines()[-5:]}
+        measured = json.loads(lines[-1][len(RESULT_PREFIX):])
+        result["timings"].update(measured["timings"])
+        result["peak_rss_mb"].update(measured["peak_rss_mb"])
+    return result
+
+
+def compare(old_path: Path, new_path: Path, threshold: float) -> int:
+    old, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in (old_path, new_path))
+    index = {(r["size"], r["backend"]): r for r in old["datasets"] if "timings" in r}
+    regressions = 0
+    print(f"{'dataset':<18}{'métrica':<20}{'antes':>12}{'depois':>12}{'razão':>8}")
+    for r in new["datasets"]:
+        before = index.get((r["size"], r["backend"]))
+        if before is None or "timings" not in r:
+            continue
+        for name, t in r["timings"].items():
+            b = before["timings"].get(name, {}).get("median_ms")
+            if not b:
+                continue
+            ratio = t["median_ms"] / b
+            flag = " !" if ratio > 1 + threshold else ""
+            regressions += bool(flag)
+            print(f"{r['size']:>9} {r['backend']:<8}{name:<20}{b:>12.1f}{t['median_ms']:>12.1f}{ratio:>8.2f}{flag}")
+    for res, t in new.get("blend_images", {}).items():
+        for kind in ("cold", "warm", "zoom"):
+            b = old.get("blend_images", {}).get(res, {}).get(kind, {}).get("median_ms")
+            if b:
+                ratio = t[kind]["median_ms"] / b
+                flag = " !" if ratio > 1 + threshold else ""
+                regressions += bool(flag)
+                print(f"{'blend ' + res:<18}{kind:<20}{b:>12.1f}{t[kind]['median_ms']:>12.1f}{ratio:>8.2f}{flag}")
+    print(f"{regressions} regressão(ões) acima de {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["_worker"]:
+        worker = argparse.ArgumentParser()
+        worker.add_argument("n", type=int)
+        worker.add_argument("--repeat", type=int, default=3)
+        worker.add_argument("--warm", action="store_true")
+        args = worker.parse_args(argv[1:])
+        result = measure_warm_start(args.n) if args.warm else measure_app(args.n, args.repeat)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+    if argv[:1] == ["compare"]:
+        cmp = argparse.ArgumentParser(prog="python -m benchmarks.run compare")
+        cmp.add_argument("old", type=Path)
+        cmp.add_argument("new", type=Path)
+        cmp.add_argument("--threshold", type=float, default=0.1, help="piora relativa tolerada (0.1 = 10%%)")
+        args = cmp.parse_args(argv[1:])
+        sys.exit(compare(args.old, args.new, args.threshold))
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--backends", nargs="+", choices=DEFAULT_BACKENDS, default=list(DEFAULT_BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR, help="onde os dados sintéticos são gerados")
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    meta = _metadata()
+    results = {"meta": meta, "datasets": []}
+    for n in args.sizes:
+        for backend in args.backends:
+            result = run_dataset(n, backend, args.repeat, args.cache_dir)
+            results["datasets"].append(result)
+            summary = {k: v.get("median_ms") for k, v in result.get("timings", {}).items()}
+            print(f"[{n} {backend}] {summary or result.get('error')}", file=sys.stderr)
+
+    args.cache_dir.mkdir(parents=True, exist_ok=True)
+    results["blend_images"] = measure_blend(args.repeat, args.cache_dir)
+
+    out = args.out or RESULTS_DIR / f"{meta['commit'] or 'local'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
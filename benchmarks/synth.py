@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data directories in the real ``manifest.json`` schema.
+
+Records carry ``neighbors``, ``params``, ``outputs`` (baked overlays and heat
+grids) and ``debug`` exactly like step4's output. Image files come from a
+small pool (``images/pool``, ``outputs/pool``) that all records point into,
+so 1M marks cost 1M manifest records but only ``pool`` images on disk.
+
+The manifest is streamed to disk record by record, and the SQLite variant is
+filled from the same generator, so generating 1M marks does not need the
+whole manifest in memory.
+
+    python -m benchmarks.synth /tmp/bench_1k 1000 [--sqlite]
+"""
+
+import argparse
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from inpi_heatmap.engine import DEFAULT_QUERY_PARAMS
+from inpi_heatmap.heat import save_heat_grid
+from inpi_heatmap.manifest_store import JSON_NAME, SCHEMA, SQLITE_NAME, default_display_name
+
+DEFAULT_POOL = 16
+IMAGE_SIZE = (1600, 900)
+N_NEIGHBORS = 5
+WIDE_KEY = "wide_0000000"
+WIDE_NEIGHBORS = 50
+
+
+def key_of(i: int) -> str:
+    return f"mark_{i:07d}"
+
+
+def _logo(rng: np.random.Generator, size: tuple) -> Image.Image:
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    w, h = size
+    for _ in range(int(rng.integers(3, 8))):
+        x0, y0 = int(rng.integers(0, w * 3 // 4)), int(rng.integers(0, h * 3 // 4))
+        x1, y1 = x0 + int(rng.integers(w // 8, w // 3)), y0 + int(rng.integers(h // 8, h // 3))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3)) + (255,)
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)((x0, y0, x1, y1), fill=color)
+    return image
+
+
+def _write_pool(data_dir: Path, pool: int, seed: int):
+    rng = np.random.default_rng(seed)
+    (data_dir / "images" / "pool").mkdir(parents=True, exist_ok=True)
+    for j in range(pool):
+        out = data_dir / "outputs" / "pool" / str(j)
+        out.mkdir(parents=True, exist_ok=True)
+        logo = _logo(rng, IMAGE_SIZE)
+        logo.save(data_dir / "images" / "pool" / f"{j}.png")
+
+        heat = rng.random((14, 14)).astype(np.float32)
+        mask = rng.random((14, 14)) < 0.4
+        save_heat_grid(out / "final_heat.npy", heat, mask)
+        save_heat_grid(out / "fg_heat.npy", heat[::-1], mask)
+        noise = Image.fromarray((heat * 255).astype(np.uint8)).resize(IMAGE_SIZE, Image.BILINEAR)
+        overlay = Image.merge("RGB", (noise, noise.point(lambda v: 255 - v), Image.new("L", IMAGE_SIZE, 64)))
+        base = Image.alpha_composite(Image.new("RGBA", IMAGE_SIZE, "white"), logo).convert("RGB")
+        Image.blend(base, overlay, 0.5).save(out / "final_overlay.png")
+        overlay.save(out / "fg_overlay.png")
+
+
+def records(n: int, pool: int, seed: int = 0):
+    """Yield ``(key, record)`` for ``n`` marks plus one wide query (``WIDE_KEY``)."""
+    rng = np.random.default_rng(seed + 1)
+    params = dict(DEFAULT_QUERY_PARAMS)
+    for i in range(n + 1):
+        key, k = (key_of(i), N_NEIGHBORS) if i < n else (WIDE_KEY, WIDE_NEIGHBORS)
+        j = i % pool
+        targets = rng.integers(0, max(n, 1), k)
+        sims = np.sort(rng.uniform(params["cls_threshold"], 0.95, k))[::-1]
+        neighbors = [
+            {
+                "rank": r,
+                "target": key_of(int(t)),
+                "cls_sim": round(float(s), 4),
+                "target_image": f"images/pool/{int(t) % pool}.png",
+            }
+            for r, (t, s) in enumerate(zip(targets, sims), 1)
+        ]
+        yield key, {
+            "image": f"images/pool/{j}.png",
+            "neighbors": neighbors,
+            "params": params,
+            "outputs": {
+                "fg_overlay": f"outputs/pool/{j}/fg_overlay.png",
+                "fg_heat_grid": f"outputs/pool/{j}/fg_heat.npy",
+                "fg_selected_patches": 30,
+                "final_overlay": f"outputs/pool/{j}/final_overlay.png",
+                "final_heat_grid": f"outputs/pool/{j}/final_heat.npy",
+                "final_scale": {"p_low": 85, "p_high": 99, "lo": 0.5, "hi": 0.8},
+            },
+            "debug": [
+                {
+                    "target": nb["target"],
+                    "cls_sim": nb["cls_sim"],
+                    "heat_mean_fg": round(nb["cls_sim"] * 0.9, 6),
+                    "heat_max_fg": round(min(1.0, nb["cls_sim"] * 1.1), 6),
+                }
+                for nb in neighbors
+            ],
+        }
+
+
+def generate(data_dir: Path, n: int, pool: int = DEFAULT_POOL, sqlite: bool = False, seed: int = 0) -> Path:
+    """Create (or reuse) a synthetic data directory with ``n`` marks."""
+    data_dir = Path(data_dir)
+    marker = data_dir / "synth.json"
+    spec = {"n": n, "pool": pool, "seed": seed, "sqlite": sqlite}
+    if marker.exists() and json.loads(marker.read_text()) == spec:
+        return data_dir
+    data_dir.mkdir(parents=True, exist_ok=True)
+    _write_pool(data_dir, pool, seed)
+
+    with open(data_dir / JSON_NAME, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        for idx, (key, record) in enumerate(records(n, pool, seed)):
+            f.write(("" if idx == 0 else ",\n") + json.dumps(key) + ": " + json.dumps(record, ensure_ascii=False))
+        f.write("\n}\n")
+
+    (data_dir / SQLITE_NAME).unlink(missing_ok=True)
+    if sqlite:
+        conn = sqlite3.connect(data_dir / SQLITE_NAME)
+        with conn:
+            conn.executescript(SCHEMA)
+            conn.executemany(
+                "INSERT INTO records VALUES (?, ?, ?, ?)",
+                (
+                    (k, default_display_name(k, r), len(r["neighbors"]), json.dumps(r, ensure_ascii=False))
+                    for k, r in records(n, pool, seed)
+                ),
+            )
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', '1')")
+        conn.close()
+    marker.write_text(json.dumps(spec))
+    return data_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.synth", description=__doc__.split("\n")[1])
+    parser.add_argument("data_dir", type=Path)
+    parser.add_argument("n", type=int)
+    parser.add_argument("--pool", type=int, default=DEFAULT_POOL)
+    parser.add_argument("--sqlite", action="store_true", help="também gera manifest.sqlite")
+    args = parser.parse_args(argv)
+    generate(args.data_dir, args.n, args.pool, args.sqlite)
+    print(args.data_dir)
+
+
+if __name__ == "__main__":
+    main()
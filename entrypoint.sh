@@ -1,18 +1,26 @@
 #!/bin/bash
 set -e
 
-# Start Streamlit in background
-streamlit run streamlit_app.py \
+START_NS=$(date +%s%N)
+export INPI_READY_FILE="${INPI_READY_FILE:-/tmp/inpi_ready.json}"
+rm -f "$INPI_READY_FILE"
+
+# Start Streamlit in background; the cache warm-up runs in the same process
+# (see inpi_heatmap/warmup.py) and writes $INPI_READY_FILE when done
+python -m inpi_heatmap.warmup serve \
     --server.port=8501 \
     --server.address=0.0.0.0 \
     --server.headless=true &
 
-# Wait for Streamlit to be ready
-echo "Aguardando Streamlit iniciar..."
-until curl -s http://localhost:8501/_stcore/health > /dev/null 2>&1; do
-    sleep 1
+# Read-only JSON/image API (see inpi_heatmap/api.py)
+python -m inpi_heatmap.api --port=8502 &
+
+# Ready = Streamlit answering and caches warm (same condition as the HEALTHCHECK)
+echo "Aguardando Streamlit iniciar e aquecer os caches..."
+until curl -s http://localhost:8501/_stcore/health > /dev/null 2>&1 && [ -f "$INPI_READY_FILE" ]; do
+    sleep 0.2
 done
-echo "Streamlit rodando em http://localhost:8501"
+echo "Streamlit pronto em http://localhost:8501 ($(( ($(date +%s%N) - START_NS) / 1000000 )) ms após o start)"
 
 # Start ngrok if authtoken is provided
 if [ -n "$NGROK_AUTHTOKEN" ]; then
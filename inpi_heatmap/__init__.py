@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+INPI - MVP: Mapa de Calor (helpers shared by the app and offline tools)
+"""
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+IVF (inverted file) index over CLS embeddings for approximate top-k search.
+
+Vectors are L2-normalized, so inner product is cosine similarity, the same
+``cls_sim`` step2 computes. A spherical k-means splits the registry into
+``nlist`` cells; vectors are stored sorted by cell, so probing a cell reads
+one contiguous slice of a memory-mapped array. A query scores the centroids,
+visits the ``nprobe`` best cells and ranks only their members.
+
+On disk the index is a directory of ``.npy`` files (opened with mmap, so
+loading is lazy) plus ``ids.json``. Marks added or removed after the build go
+to a small delta (``delta.json`` + ``delta_vectors.npy``) that is scanned
+exhaustively on every query until the next rebuild::
+
+    python -m inpi_heatmap.ann build data/embeddings.bin data/ann_index
+    python -m inpi_heatmap.ann recall data/embeddings.bin data/ann_index --nprobe 16
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-8)
+
+
+def _batched_assign(vectors, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        chunk = _normalize(vectors[start:start + batch])
+        out[start:start + batch] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vectors, nlist: int, iters: int = 10, sample: int = 256 * 1024, seed: int = 0) -> np.ndarray:
+    """Centroids (unit norm) trained on a random sample of ``vectors``."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    idx = np.sort(rng.choice(n, size=min(n, sample), replace=False))
+    train = _normalize(vectors[idx])
+    centroids = train[rng.choice(len(train), size=nlist, replace=False)]
+    for _ in range(iters):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        # Re-seed empty cells with random training points.
+        sums[empty] = train[rng.choice(len(train), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def exact_search(vectors, query: np.ndarray, k: int, block: int = 65536) -> tuple:
+    """Brute-force top-k by cosine; returns ``(slots, sims)``.
+
+    ``vectors`` is scanned in blocks, so only one block at a time is converted
+    to float32 (the store's CLS matrix is a float16 view over the mmap).
+    """
+    q = _normalize(query)
+    sims = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+        sims[start:start + block] = (chunk @ q) / np.maximum(np.linalg.norm(chunk, axis=1), 1e-8)
+    k = min(k, len(sims))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), sims[:0]
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return top, sims[top]
+
+
+class IVFIndex:
+    def __init__(self, centroids, offsets, vectors, slots, ids: list, nprobe: int = 8):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.slots = slots
+        self.ids = ids
+        self.nprobe = nprobe
+        # Slots of marks removed from the store before the build; never returned.
+        self.n_dead = sum(mark_id is None for mark_id in ids)
+        self._main_ids = frozenset(mark_id for mark_id in ids if mark_id is not None)
+        self.extra_ids = []
+        self.extra_vectors = np.zeros((0, centroids.shape[1]), dtype=np.float16)
+        self.removed = set()
+        self.path = None
+        self._delta_mtime = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # -- build / persistence -----------------------------------------------
+
+    @classmethod
+    def build(cls, ids: list, vectors, nlist: int = None, nprobe: int = 8, iters: int = 10) -> "IVFIndex":
+        n = len(ids)
+        nlist = nlist or max(1, min(int(4 * np.sqrt(n)), n))
+        centroids = spherical_kmeans(vectors, nlist, iters=iters)
+        assign = _batched_assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        sorted_vectors = np.empty((n, centroids.shape[1]), dtype=np.float16)
+        for start in range(0, n, 65536):
+            sorted_vectors[start:start + 65536] = _normalize(vectors[order[start:start + 65536]])
+        return cls(centroids, offsets, sorted_vectors, order, list(ids), nprobe)
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "centroids.npy", self.centroids.astype(np.float32))
+        np.save(path / "offsets.npy", self.offsets)
+        np.save(path / "vectors.npy", self.vectors)
+        np.save(path / "slots.npy", self.slots)
+        (path / "ids.json").write_text(
+            json.dumps({"ids": self.ids, "nprobe": self.nprobe}, ensure_ascii=False), encoding="utf-8"
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        path = Path(path)
+        meta = json.loads((path / "ids.json").read_text(encoding="utf-8"))
+        index = cls(
+            np.load(path / "centroids.npy"),
+            np.load(path / "offsets.npy"),
+            np.load(path / "vectors.npy", mmap_mode="r"),
+            np.load(path / "slots.npy", mmap_mode="r"),
+            meta["ids"],
+            meta.get("nprobe", 8),
+        )
+        index.path = path
+        index._load_delta()
+        return index
+
+    # -- delta -------------------------------------------------------------
+
+    def _load_delta(self):
+        delta_path = self.path / "delta.json"
+        self._delta_mtime = delta_path.stat().st_mtime_ns if delta_path.exists() else None
+        if self._delta_mtime is None:
+            return
+        delta = json.loads(delta_path.read_text(encoding="utf-8"))
+        self.extra_vectors = np.load(self.path / "delta_vectors.npy")
+        self.extra_ids = delta["ids"]
+        self.removed = set(delta["removed"])
+
+    def refresh(self) -> bool:
+        """Re-read the delta if another process saved a new one; True if it changed."""
+        if self.path is None:
+            return False
+        delta_path = self.path / "delta.json"
+        mtime = delta_path.stat().st_mtime_ns if delta_path.exists() else None
+        if mtime == self._delta_mtime:
+            return False
+        self._load_delta()
+        return True
+
+    def add(self, ids: list, vectors: np.ndarray):
+        """Index ``ids`` in the delta; an id already indexed is replaced, never listed twice.
+
+        An older delta entry is dropped, and a main-list entry is shadowed
+        (``search`` skips main entries whose id is in the delta).
+        """
+        new = set(ids)
+        keep = [i for i, mark_id in enumerate(self.extra_ids) if mark_id not in new]
+        self.extra_ids = [self.extra_ids[i] for i in keep] + list(ids)
+        self.extra_vectors = np.vstack([self.extra_vectors[keep], _normalize(vectors).astype(np.float16)])
+        self.removed -= new
+
+    def remove(self, ids):
+        self.removed |= set(ids)
+
+    def save_delta(self, path: Path):
+        # Vectors first, then the JSON that references them, each via rename.
+        path = Path(path)
+        tmp = path / "delta_vectors.tmp.npy"
+        np.save(tmp, self.extra_vectors)
+        tmp.replace(path / "delta_vectors.npy")
+        tmp = path / "delta.json.tmp"
+        tmp.write_text(
+            json.dumps({"ids": self.extra_ids, "removed": sorted(self.removed)}, ensure_ascii=False), encoding="utf-8"
+        )
+        tmp.replace(path / "delta.json")
+        if path == self.path:
+            self._delta_mtime = (path / "delta.json").stat().st_mtime_ns
+
+    # -- search ------------------------------------------------------------
+
+    def search(self, query: np.ndarray, k: int = 5, threshold: float = None, nprobe: int = None, exclude=()) -> list:
+        """Top-k ``(mark_id, cls_sim)`` pairs, best first, optionally cut at ``threshold``."""
+        q = _normalize(query)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        cells = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+
+        cand_pos, cand_sims = [], []
+        for c in cells:
+            lo, hi = self.offsets[c], self.offsets[c + 1]
+            if hi > lo:
+                cand_pos.append(np.arange(lo, hi))
+                cand_sims.append(np.asarray(self.vectors[lo:hi], dtype=np.float32) @ q)
+        n_main = len(self.vectors)
+        if self.extra_ids:
+            cand_pos.append(n_main + np.arange(len(self.extra_ids)))
+            cand_sims.append(self.extra_vectors.astype(np.float32) @ q)
+        if not cand_pos:
+            return []
+        pos = np.concatenate(cand_pos)
+        sims = np.concatenate(cand_sims)
+
+        exclude = set(exclude) | self.removed
+        extra = set(self.extra_ids)
+        shadowed = extra & self._main_ids
+        # Candidates that may take a top slot without being returned, each counted once.
+        hidden = self.n_dead + len(shadowed)
+        hidden += sum((mark_id in self._main_ids and mark_id not in shadowed) + (mark_id in extra) for mark_id in exclude)
+        want = min(k + hidden, len(sims))
+        top = np.argpartition(-sims, want - 1)[:want]
+        top = top[np.argsort(-sims[top])]
+
+        out = []
+        for i in top:
+            p = pos[i]
+            mark_id = self.ids[self.slots[p]] if p < n_main else self.extra_ids[p - n_main]
+            sim = float(sims[i])
+            if mark_id is None or mark_id in exclude or (p < n_main and mark_id in shadowed):
+                continue
+            if threshold is not None and sim < threshold:
+                break
+            out.append((mark_id, sim))
+            if len(out) == k:
+                break
+        return out
+
+    def recall(self, vectors, k: int = 5, n_queries: int = 200, nprobe: int = None, seed: int = 0) -> dict:
+        """Recall@k against exact search for a random sample of indexed vectors.
+
+        Removed marks (``None`` slots and the delta's ``removed``) are neither
+        sampled nor counted as true neighbors, as ``search`` never returns them.
+        """
+        live = [s for s, mark_id in enumerate(self.ids) if mark_id is not None and mark_id not in self.removed]
+        if not live:
+            raise ValueError("o índice não tem marcas ativas")
+        n_dead = len(self.ids) - len(live)
+        indexed = vectors[:len(self.ids)]
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(live, size=min(n_queries, len(live)), replace=False)
+        hits, ann_time, exact_time = 0, 0.0, 0.0
+        for slot in sample:
+            q = np.asarray(vectors[slot], dtype=np.float32)
+            t0 = time.perf_counter()
+            approx = {mark_id for mark_id, _ in self.search(q, k, nprobe=nprobe)}
+            t1 = time.perf_counter()
+            exact, _ = exact_search(indexed, q, k + n_dead)
+            t2 = time.perf_counter()
+            truth = [self.ids[s] for s in exact if self.ids[s] is not None and self.ids[s] not in self.removed][:k]
+            hits += len(approx & set(truth))
+            ann_time += t1 - t0
+            exact_time += t2 - t1
+        n = len(sample)
+        return {
+            "recall": hits / (n * min(k, len(live))),
+            "k": k,
+            "nprobe": nprobe or self.nprobe,
+            "queries": n,
+            "ann_ms": 1000 * ann_time / n,
+            "exact_ms": 1000 * exact_time / n,
+        }
+
+
+def main(argv=None):
+    from inpi_heatmap.embeddings import EmbeddingStore
+
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.ann", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    build = sub.add_parser("build", help="treina e salva o indice a partir do store de embeddings")
+    build.add_argument("store", type=Path)
+    build.add_argument("dest", type=Path)
+    build.add_argument("--nlist", type=int, default=None)
+    build.add_argument("--nprobe", type=int, default=8)
+    build.add_argument("--iters", type=int, default=10)
+    rec = sub.add_parser("recall", help="mede recall@k contra a busca exata")
+    rec.add_argument("store", type=Path)
+    rec.add_argument("dest", type=Path)
+    for p in (build, rec):
+        p.add_argument("-k", type=int, default=5)
+        p.add_argument("--queries", type=int, default=200)
+    rec.add_argument("--nprobe", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    store = EmbeddingStore(args.store)
+    vectors = store.cls_matrix()
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        index = IVFIndex.build(store.ids, vectors, nlist=args.nlist, nprobe=args.nprobe, iters=args.iters)
+        index.save(args.dest)
+        print(f"{len(index)} marcas, {index.nlist} listas, {time.perf_counter() - t0:.1f}s -> {args.dest}")
+        nprobe = None
+    else:
+        index = IVFIndex.load(args.dest)
+        nprobe = args.nprobe
+    print(json.dumps(index.recall(vectors, k=args.k, n_queries=args.queries, nprobe=nprobe)))
+
+
+if __name__ == "__main__":
+    main()
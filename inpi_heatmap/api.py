@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Read-only HTTP API over the manifest and its images.
+
+Runs next to the Streamlit app (``entrypoint.sh`` starts both) so other
+systems can fetch neighbors, scores and overlays without a websocket session
+and a full script rerun per request. Standard library only.
+
+    GET  /v1/queries?search=&offset=&limit=   keys (paginated search)
+    GET  /v1/queries/<id>                     record + asset links
+    GET  /v1/queries?ids=a,b,c                batch lookup
+    POST /v1/queries/batch  {"ids": [...]}    batch lookup (long lists)
+    GET  /v1/queries/<id>/overlay.png?alpha=  query blended with its heatmap
+    GET  /v1/assets/<path>                    any image under the data dir
+    GET  /healthz
+
+Every response carries a strong ETag derived from content hashes (record
+JSON, asset bytes, overlay inputs) and ``If-None-Match`` is answered with
+304. Asset links embed the asset hash (``?v=``); such versioned URLs are
+cached as immutable, everything else must be revalidated.
+
+    python -m inpi_heatmap.api --port 8502
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from inpi_heatmap import metrics
+from inpi_heatmap.config import DATA_DIR
+from inpi_heatmap.manifest_store import default_display_name, open_manifest_store
+from inpi_heatmap.render import DEFAULT_ALPHA, input_hash, render_blend
+
+MAX_BATCH = 500
+MAX_PAGE = 500
+MAX_BODY = 1 << 20
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class _LRU:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class Api:
+    """Request-independent logic; ``Handler`` only does HTTP plumbing."""
+
+    def __init__(self, manifest, data_dir: Path = DATA_DIR):
+        self.manifest = manifest
+        self.data_dir = Path(data_dir).resolve()
+        self._digests = _LRU(65536)
+        self._overlays = _LRU(64)
+
+    # -- hashing -----------------------------------------------------------
+
+    def file_digest(self, path: Path) -> bytes:
+        """sha256 of ``path``, cached per (path, size, mtime)."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return b"-"
+        key = (str(path), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = hashlib.sha256(Path(path).read_bytes()).digest()
+            self._digests.put(key, digest)
+        return digest
+
+    def asset_path(self, rel: str) -> Path:
+        path = (self.data_dir / unquote(rel)).resolve()
+        if self.data_dir not in path.parents or path.suffix.lower() not in CONTENT_TYPES:
+            raise ApiError(404, "asset inexistente")
+        if not path.is_file():
+            raise ApiError(404, "asset inexistente")
+        return path
+
+    def asset_url(self, rel: str) -> str:
+        if not rel:
+            return None
+        digest = self.file_digest(self.data_dir / rel)
+        if digest == b"-":
+            return None
+        return f"/v1/assets/{quote(rel)}?v={digest.hex()[:16]}"
+
+    # -- resources ---------------------------------------------------------
+
+    def record(self, key: str) -> dict:
+        record = self.manifest.get(key)
+        if record is None:
+            return None
+        outputs = record.get("outputs", {})
+        return {
+            "id": key,
+            "display_name": default_display_name(key, record),
+            "record": record,
+            "links": {
+                "image": self.asset_url(record.get("image")),
+                "overlay": f"/v1/queries/{quote(key)}/overlay.png",
+                "final_overlay": self.asset_url(outputs.get("final_overlay")),
+                "neighbors": {nb["target"]: self.asset_url(nb.get("target_image")) for nb in record.get("neighbors", [])},
+            },
+        }
+
+    def batch(self, ids: list) -> dict:
+        if len(ids) > MAX_BATCH:
+            raise ApiError(413, f"no máximo {MAX_BATCH} ids por requisição")
+        records, missing = {}, []
+        for key in dict.fromkeys(ids):
+            rec = self.record(key)
+            if rec is None:
+                missing.append(key)
+            else:
+                records[key] = rec
+        return {"records": records, "missing": missing}
+
+    def listing(self, search: str, offset: int, limit: int) -> dict:
+        limit = min(max(limit, 1), MAX_PAGE)
+        hits = self.manifest.search(search, offset=max(offset, 0), limit=limit)
+        return {
+            "total": self.manifest.count(search),
+            "offset": offset,
+            "limit": limit,
+            "items": [{"id": k, "display_name": name} for k, name in hits],
+        }
+
+    def overlay(self, key: str, alpha: float) -> tuple:
+        """``(etag, render)``; ``render()`` produces the PNG, so a 304 never renders."""
+        record = self.manifest.get(key)
+        if record is None:
+            raise ApiError(404, "query inexistente")
+        etag = input_hash(key, record, alpha, digest=self.file_digest, data_dir=self.data_dir)[:32]
+        return etag, lambda: self._render_overlay(etag, key, record, alpha)
+
+    def _render_overlay(self, etag: str, key: str, record: dict, alpha: float) -> bytes:
+        png = self._overlays.get(etag)
+        if png is None:
+            with metrics.timed("api_overlay_render"):
+                buf = io.BytesIO()
+                render_blend(key, record, alpha, data_dir=self.data_dir).save(buf, format="PNG")
+                png = buf.getvalue()
+            self._overlays.put(etag, png)
+        return png
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+
+def _json_etag(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def _matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/"x" matches "x".
+    return any(t.strip().removeprefix("W/").strip('"') == etag for t in header.split(","))
+
+
+class Handler(BaseHTTPRequestHandler):
+    api: Api = None
+    protocol_version = "HTTP/1.1"
+    server_version = "inpi-heatmap-api"
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.strip("/").split("/")]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            body = self._read_body()
+            self.api.manifest.refresh()
+            with metrics.timed("api_request"):
+                self._route(method, parts, query, body)
+        except ApiError as e:
+            self._send_json({"error": str(e)}, status=e.status, cache=REVALIDATE)
+        except (ValueError, KeyError) as e:
+            self._send_json({"error": f"requisição inválida: {e}"}, status=400, cache=REVALIDATE)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away; nothing left to answer
+        except Exception as e:  # answered, not dropped: the server thread keeps going
+            traceback.print_exc()
+            self._send_json({"error": f"erro interno: {type(e).__name__}"}, status=500, cache="no-store")
+
+    def _read_body(self) -> bytes:
+        """The request body, read before routing so even a 404 leaves the
+        keep-alive connection at the next request; one that cannot be read
+        closes the connection instead."""
+        if self.headers.get("Transfer-Encoding"):
+            self.close_connection = True
+            raise ApiError(411, "envie o corpo com Content-Length")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.close_connection = True
+            raise ApiError(400, "Content-Length inválido")
+        if length > MAX_BODY:
+            self.close_connection = True
+            raise ApiError(413, f"corpo maior que {MAX_BODY} bytes")
+        return self.rfile.read(length) if length > 0 else b""
+
+    def _route(self, method: str, parts: list, query: dict, body: bytes):
+        if parts == ["healthz"]:
+            return self._send_json({"ok": True, "records": len(self.api.manifest)}, cache="no-store")
+        if parts[:1] != ["v1"] or len(parts) < 2:
+            raise ApiError(404, "rota inexistente")
+
+        if parts[1] == "assets" and method != "POST":
+            path = self.api.asset_path("/".join(parts[2:]))
+            etag = self.api.file_digest(path).hex()[:32]
+            cache = IMMUTABLE if query.get("v") and etag.startswith(query["v"]) else REVALIDATE
+            return self._send(lambda: path.read_bytes(), CONTENT_TYPES[path.suffix.lower()], etag, cache)
+
+        if parts[1] != "queries":
+            raise ApiError(404, "rota inexistente")
+        if parts[2:] == ["batch"] and method == "POST":
+            body = json.loads(body or b"{}")
+            if not isinstance(body, dict):
+                raise ApiError(400, 'o corpo deve ser um objeto JSON {"ids": [...]}')
+            ids = body.get("ids", [])
+            if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                raise ApiError(400, '"ids" deve ser uma lista de strings')
+            return self._send_json(self.api.batch(ids))
+        if method == "POST":
+            raise ApiError(405, "método não suportado")
+        if len(parts) == 2:
+            if "ids" in query:
+                return self._send_json(self.api.batch([i for i in query["ids"].split(",") if i]))
+            return self._send_json(
+                self.api.listing(query.get("search", ""), int(query.get("offset", 0)), int(query.get("limit", 50)))
+            )
+        if len(parts) == 3:
+            record = self.api.record(parts[2])
+            if record is None:
+                raise ApiError(404, "query inexistente")
+            return self._send_json(record)
+        if len(parts) == 4 and parts[3] == "overlay.png":
+            alpha = min(max(float(query.get("alpha", DEFAULT_ALPHA)), 0.0), 1.0)
+            etag, render = self.api.overlay(parts[2], alpha)
+            return self._send(render, "image/png", etag, REVALIDATE)
+        raise ApiError(404, "rota inexistente")
+
+    # -- responses ---------------------------------------------------------
+
+    def _send_json(self, payload, status: int = 200, cache: str = REVALIDATE):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._send(lambda: body, "application/json; charset=utf-8", _json_etag(body), cache, status)
+
+    def _send(self, body_fn, content_type: str, etag: str, cache: str, status: int = 200):
+        """Send ``body_fn()``, or 304 without calling it when the client's copy is current."""
+        headers = {"ETag": f'"{etag}"', "Cache-Control": cache}
+        if status == 200 and _matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = body_fn()
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+def make_server(host: str = "0.0.0.0", port: int = 8502, data_dir: Path = DATA_DIR) -> ThreadingHTTPServer:
+    handler = type("BoundHandler", (Handler,), {"api": Api(open_manifest_store(data_dir), data_dir)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.api", description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("INPI_API_PORT", "8502")))
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port)
+    print(f"API em http://{args.host}:{args.port}/v1/queries")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
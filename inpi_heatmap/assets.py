@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Integrity index of every file the manifest references.
+
+``build`` walks all records once (query image, ``outputs`` paths, neighbor
+images) and writes ``asset_index.json`` next to the manifest: size, mtime,
+dimensions (pixels for images, array shape for ``.npy``) and sha256 of each
+existing file, plus the missing paths with the queries that reference them.
+Unchanged files (same size and mtime) are not re-read.
+
+The app loads the index once and answers "does this file exist?" from it
+instead of a stat per image per render, which adds up on network-mounted
+data volumes. Paths the index does not know (e.g. written after the build)
+fall back to a stat; ``python -m inpi_heatmap.incremental`` updates the
+entries of the records it rewrites.
+
+    python -m inpi_heatmap.assets build             # report missing references
+    python -m inpi_heatmap.assets build --strict    # ... and exit 1 if any
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap.config import ASSET_INDEX_PATH, DATA_DIR
+
+INDEX_VERSION = 1
+
+
+def referenced_paths(record: dict) -> list:
+    """Data-relative paths a manifest record points at."""
+    paths = [record.get("image")]
+    outputs = record.get("outputs", {})
+    paths += [v for k, v in outputs.items() if isinstance(v, str) and k != "pyramid"]
+    if outputs.get("pyramid"):
+        # A directory; its metadata is written last, so it stands for the whole pyramid.
+        paths.append(f"{outputs['pyramid']}/meta.json")
+    paths += [nb.get("target_image") for nb in record.get("neighbors", [])]
+    return [p for p in paths if p]
+
+
+def _describe(path: Path, st: os.stat_result) -> dict:
+    data = path.read_bytes()
+    entry = {"bytes": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": hashlib.sha256(data).hexdigest()}
+    try:
+        if path.suffix == ".npy":
+            entry["shape"] = list(np.load(io.BytesIO(data), allow_pickle=False).shape)
+        elif path.suffix == ".json":
+            json.loads(data)
+        else:
+            with Image.open(io.BytesIO(data)) as im:
+                entry["size"] = list(im.size)
+    except Exception as e:  # present but unreadable is a broken reference too
+        entry["error"] = f"{type(e).__name__}: {e}"
+    return entry
+
+
+def _check(data_dir: Path, rel: str, previous: dict, stats: dict):
+    """Entry for ``rel`` (None if missing), reusing ``previous`` when size and mtime match."""
+    try:
+        st = os.stat(data_dir / rel)
+    except OSError:
+        return None
+    prev = previous.get(rel)
+    if prev and prev["bytes"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+        stats["reused"] += 1
+        return prev
+    stats["hashed"] += 1
+    return _describe(data_dir / rel, st)
+
+
+def _load(index_path: Path) -> dict:
+    if not index_path.exists():
+        return {"version": INDEX_VERSION, "files": {}, "missing": {}}
+    return json.loads(index_path.read_text(encoding="utf-8"))
+
+
+def _write(index: dict, index_path: Path):
+    tmp = index_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, index_path)
+
+
+def build(manifest, data_dir: Path = DATA_DIR, index_path: Path = ASSET_INDEX_PATH) -> dict:
+    """Index every referenced file of ``manifest``; returns the index."""
+    data_dir = Path(data_dir)
+    previous = _load(index_path)["files"]
+    files, missing = {}, {}
+    stats = {"reused": 0, "hashed": 0}
+    for key, record in manifest.items():
+        for rel in referenced_paths(record):
+            if rel in files:
+                continue
+            if rel in missing:
+                missing[rel].append(key)
+                continue
+            entry = _check(data_dir, rel, previous, stats)
+            if entry is None:
+                missing[rel] = [key]
+            else:
+                files[rel] = entry
+    index = {"version": INDEX_VERSION, "files": files, "missing": missing, "stats": stats}
+    _write(index, index_path)
+    return index
+
+
+def update(records: dict, deleted=(), data_dir: Path = DATA_DIR, index_path: Path = ASSET_INDEX_PATH,
+           previous: dict = None):
+    """Re-check the paths of rewritten ``records`` in an existing index (no-op without one).
+
+    ``previous`` maps the rewritten and ``deleted`` keys to their records
+    before the write; paths only those used leave the index (an unknown path
+    falls back to a stat in ``AssetIndex``, so dropping one is always safe).
+    """
+    if not Path(index_path).exists():
+        return
+    index = _load(index_path)
+    files, missing = index["files"], index["missing"]
+    stats = {"reused": 0, "hashed": 0}
+    changed = set(records) | set(deleted)
+    for rel in list(missing):
+        missing[rel] = [k for k in missing[rel] if k not in changed]
+        if not missing[rel]:
+            del missing[rel]
+    current = {rel for record in records.values() for rel in referenced_paths(record)}
+    for record in (previous or {}).values():
+        for rel in referenced_paths(record or {}):
+            if rel not in current:
+                files.pop(rel, None)
+    for key, record in records.items():
+        for rel in referenced_paths(record):
+            entry = _check(Path(data_dir), rel, files, stats)
+            if entry is None:
+                files.pop(rel, None)
+                missing.setdefault(rel, []).append(key)
+            else:
+                files[rel] = entry
+    _write(index, index_path)
+
+
+def broken(index: dict) -> dict:
+    """Missing or unreadable paths -> referencing keys (or the read error)."""
+    out = {rel: keys for rel, keys in index["missing"].items()}
+    out.update({rel: e["error"] for rel, e in index["files"].items() if "error" in e})
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Lookup (app side)
+# ---------------------------------------------------------------------------
+
+
+class AssetIndex:
+    """Read side of ``asset_index.json``; stat-free existence checks."""
+
+    def __init__(self, index_path: Path = ASSET_INDEX_PATH, data_dir: Path = DATA_DIR):
+        self.index_path = Path(index_path)
+        self.data_dir = Path(data_dir)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._files = {}
+        self._missing = {}
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Re-read the index after a build or incremental update; True if it changed."""
+        try:
+            mtime = self.index_path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        index = _load(self.index_path)
+        with self._lock:
+            self._files, self._missing, self._mtime = index["files"], index["missing"], mtime
+        return True
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def entry(self, path: Path) -> dict:
+        try:
+            return self._files.get(Path(path).relative_to(self.data_dir).as_posix())
+        except ValueError:
+            return None
+
+    def exists(self, path: Path) -> bool:
+        """Whether ``path`` is a readable file; stats only paths the index does not cover."""
+        try:
+            rel = Path(path).relative_to(self.data_dir).as_posix()
+        except ValueError:
+            return Path(path).exists()
+        entry = self._files.get(rel)
+        if entry is not None:
+            return "error" not in entry
+        if rel in self._missing:
+            return False
+        return Path(path).exists()
+
+
+def main(argv=None):
+    from inpi_heatmap.manifest_store import open_manifest_store
+
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.assets", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="gera data/asset_index.json e lista referências quebradas")
+    b.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    b.add_argument("--strict", action="store_true", help="termina com erro se houver referências quebradas")
+    args = parser.parse_args(argv)
+
+    index = build(open_manifest_store(args.data_dir), args.data_dir, args.data_dir / ASSET_INDEX_PATH.name)
+    bad = broken(index)
+    for rel, info in sorted(bad.items()):
+        detail = info if isinstance(info, str) else ", ".join(info[:5]) + (f" (+{len(info) - 5})" if len(info) > 5 else "")
+        print(f"quebrado: {rel}  <- {detail}", file=sys.stderr)
+    print(json.dumps({"files": len(index["files"]), "broken": len(bad), **index["stats"]}))
+    if args.strict and bad:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
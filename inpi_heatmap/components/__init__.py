@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Custom Streamlit components.
+
+``heatmap_blend`` ships the query image and the heatmap layer to the browser
+once and blends them there with CSS opacity, so moving the intensity slider
+costs no rerun, no server-side blend and no new image over the wire.
+"""
+
+import base64
+import hashlib
+import io
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import streamlit.components.v1 as components
+from PIL import Image
+
+from inpi_heatmap import metrics
+from inpi_heatmap.image_cache import shared_cache
+
+# Images are downscaled to at most this width before being sent; the page's
+# block container is 1400px wide and the heatmap column takes 3/5 of it.
+DISPLAY_MAX_WIDTH = 1200
+
+_heatmap_blend = components.declare_component(
+    "heatmap_blend", path=str(Path(__file__).parent / "heatmap_blend")
+)
+
+
+@metrics.instrument("image_encode")
+def array_src(arr: np.ndarray, fmt: str = "PNG") -> str:
+    """Encode an RGB/RGBA array as a data URI."""
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format=fmt)
+    mime = "image/" + fmt.lower()
+    return f"data:{mime};base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def display_size(path: Path, max_width: int = DISPLAY_MAX_WIDTH) -> tuple:
+    h, w = shared_cache().rgba(path).shape[:2]
+    if w <= max_width:
+        return (w, h)
+    return (max_width, max(1, round(h * max_width / w)))
+
+
+@lru_cache(maxsize=128)
+def _encoded(path_str: str, mtime_ns: int, size: tuple, fmt: str) -> str:
+    arr = shared_cache().rgba(Path(path_str), size=size)
+    return array_src(np.ascontiguousarray(arr), fmt)
+
+
+def image_src(path: Path, size: tuple, fmt: str = "PNG") -> str:
+    """Data URI of ``path`` fitted to ``size`` (w, h); encoded once per file version."""
+    path = Path(path)
+    return _encoded(str(path), path.stat().st_mtime_ns, tuple(size), fmt)
+
+
+def heatmap_blend(
+    base_src: str,
+    layer_src: str,
+    opacity: float = 0.45,
+    label: str = "Intensidade do mapa de calor",
+    help: str = None,
+    caption: str = None,
+    show_slider: bool = True,
+    key: str = None,
+    version: str = None,
+):
+    """Render ``layer_src`` over ``base_src`` with a browser-side opacity slider.
+
+    Sources are data URIs or app-relative URLs (``app/static/...``). The
+    browser swaps the images only when ``version`` changes; by default it is
+    a hash of both sources.
+    """
+    if version is None:
+        version = hashlib.blake2b(f"{base_src}\0{layer_src}".encode(), digest_size=12).hexdigest()
+    return _heatmap_blend(
+        base_src=base_src,
+        layer_src=layer_src,
+        version=version,
+        opacity=opacity,
+        label=label,
+        help=help,
+        caption=caption,
+        show_slider=show_slider,
+        key=key,
+        default=None,
+    )
+
+
+def blend_paths(query_path: Path, heatmap_path: Path, opacity: float = 0.45, **kwargs):
+    """Convenience wrapper: the heatmap PNG is fitted to the query's display size."""
+    size = display_size(query_path)
+    return heatmap_blend(image_src(query_path, size), image_src(heatmap_path, size), opacity, **kwargs)
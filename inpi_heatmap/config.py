@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Data locations shared by the app and the offline tools.
+
+``INPI_DATA_DIR`` points everything at another data directory (a mounted
+volume, a synthetic benchmark dataset, ...).
+"""
+
+import os
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = Path(os.environ.get("INPI_DATA_DIR", APP_DIR / "data"))
+MANIFEST_PATH = DATA_DIR / "manifest.json"
+EMBEDDINGS_PATH = DATA_DIR / "embeddings.bin"
+ANN_INDEX_DIR = DATA_DIR / "ann_index"
+ASSET_INDEX_PATH = DATA_DIR / "asset_index.json"
+
+# Served by Streamlit at app/static/ (server.enableStaticServing).
+STATIC_DIR = APP_DIR / "static"
+DERIVED_DIR = STATIC_DIR / "derived"
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Deduplicated, content-addressed image derivatives for the app.
+
+Every PNG under ``data/images`` and ``data/outputs`` (except upload tile
+pyramids, which the page never shows whole) is flattened onto white
+(how the cards show them anyway) and hashed by pixels, so the per-query
+``rank<N>_<target>.png`` copies of one logo collapse to a single source. Each
+source gets WebP and PNG renditions in a few widths, named
+``<hash>_<width>.<fmt>`` under ``static/derived/``, which Streamlit serves as
+plain files (``server.enableStaticServing``). The app then emits ``<img
+srcset>`` tags with ``loading="lazy"``, so the browser downloads only the
+width that fits the column, only when it scrolls into view, and caches it
+across pages: the same name always means the same pixels.
+
+``index.json`` maps each data path (relative to ``DATA_DIR``) to its hash;
+entries whose source changed size/mtime are ignored, and the app falls back
+to the original file. Given the ``AssetIndex``, freshness is checked against
+its size/mtime instead of a stat per image; paths it does not cover are
+stat'ed.
+
+    python -m inpi_heatmap.derivatives build      # incremental
+    python -m inpi_heatmap.derivatives dedupe     # hard-link identical rank copies
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from inpi_heatmap.config import DATA_DIR, DERIVED_DIR
+from inpi_heatmap.pyramid import DIR_NAME as PYRAMID_DIR
+
+WIDTHS = (160, 320, 640, 960, 1280)
+FORMATS = ("webp", "png")
+URL_PREFIX = "app/static/derived/"
+INDEX_NAME = "index.json"
+SOURCE_DIRS = ("images", "outputs")
+
+
+def _flatten(path: Path) -> Image.Image:
+    with Image.open(path) as im:
+        rgba = im.convert("RGBA")
+    return Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba).convert("RGB")
+
+
+def pixel_hash(image: Image.Image) -> str:
+    h = hashlib.sha256(f"{image.mode}{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()[:20]
+
+
+def widths_for(width: int) -> list:
+    """Standard widths below ``width``, plus one rendition at (capped) full width."""
+    return [w for w in WIDTHS if w < width] + [min(width, WIDTHS[-1])]
+
+
+def _save(image: Image.Image, dest: Path, fmt: str):
+    tmp = dest.with_name(dest.name + ".tmp")
+    if fmt == "webp":
+        image.save(tmp, format="WEBP", quality=80, method=4)
+    else:
+        image.save(tmp, format="PNG", optimize=True)
+    os.replace(tmp, dest)
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+
+def _sources(data_dir: Path):
+    for sub in SOURCE_DIRS:
+        found = []
+        for root, dirs, files in os.walk(data_dir / sub):
+            # Pyramid tiles are read by the zoom viewer straight from disk; don't even list them.
+            dirs[:] = [d for d in dirs if d != PYRAMID_DIR]
+            found += [Path(root, f) for f in files if Path(f).suffix.lower() in (".png", ".jpg", ".jpeg")]
+        yield from sorted(found)
+
+
+def build(data_dir: Path = DATA_DIR, out_dir: Path = DERIVED_DIR, verbose: bool = True) -> dict:
+    """(Re)build derivatives for new or changed sources; returns build stats."""
+    data_dir, out_dir = Path(data_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    index_path = out_dir / INDEX_NAME
+    old = json.loads(index_path.read_text(encoding="utf-8"))["entries"] if index_path.exists() else {}
+
+    entries, written, reused = {}, 0, 0
+    for path in _sources(data_dir):
+        key = path.relative_to(data_dir).as_posix()
+        st = path.stat()
+        prev = old.get(key)
+        if prev and prev["bytes"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+            entries[key] = prev
+            continue
+        image = _flatten(path)
+        digest = pixel_hash(image)
+        widths = widths_for(image.width)
+        for w in widths:
+            resized = None
+            for fmt in FORMATS:
+                dest = out_dir / f"{digest}_{w}.{fmt}"
+                if dest.exists():
+                    reused += 1
+                    continue
+                if resized is None:
+                    h = max(1, round(image.height * w / image.width))
+                    resized = image if w == image.width else image.resize((w, h), Image.LANCZOS)
+                _save(resized, dest, fmt)
+                written += 1
+        entries[key] = {
+            "hash": digest,
+            "size": list(image.size),
+            "widths": widths,
+            "bytes": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if verbose:
+            print(f"{key} -> {digest}")
+
+    # Renditions no entry points at any more (removed or changed sources).
+    live = {f"{e['hash']}_{w}.{fmt}" for e in entries.values() for w in e["widths"] for fmt in FORMATS}
+    removed = 0
+    for f in out_dir.iterdir():
+        if f.name != INDEX_NAME and f.name not in live:
+            f.unlink()
+            removed += 1
+
+    tmp = index_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps({"widths": list(WIDTHS), "entries": entries}, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, index_path)
+
+    unique = {e["hash"] for e in entries.values()}
+    disk = sum(f.stat().st_size for f in out_dir.iterdir() if f.name != INDEX_NAME)
+    return {
+        "sources": len(entries),
+        "unique": len(unique),
+        "written": written,
+        "reused": reused,
+        "removed": removed,
+        "derived_bytes": disk,
+    }
+
+
+def dedupe(data_dir: Path = DATA_DIR) -> int:
+    """Hard-link byte-identical ``rank<N>_<target>.png`` copies; returns bytes reclaimed.
+
+    Only rank images: they are never rewritten in place (see
+    ``records.write_rank_images``), so sharing an inode is safe. Run before
+    ``build``, since relinking changes the files' mtimes, and on the source
+    tree or data volume, never in a Docker layer above the one that copied
+    the files in (the links would be copied up, not shared).
+    """
+    first, saved = {}, 0
+    for path in sorted(Path(data_dir, "outputs").rglob("rank*_*.png")):
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        original = first.setdefault(digest, path)
+        if original == path or os.path.samefile(original, path):
+            continue
+        tmp = path.with_name(path.name + ".link")
+        os.link(original, tmp)
+        os.replace(tmp, path)
+        saved += path.stat().st_size
+    return saved
+
+
+# ---------------------------------------------------------------------------
+# Lookup (app side)
+# ---------------------------------------------------------------------------
+
+
+class DerivativeIndex:
+    """Read side of ``index.json``: maps a data file to its derivative URLs."""
+
+    def __init__(self, out_dir: Path = DERIVED_DIR, data_dir: Path = DATA_DIR, assets=None):
+        self.out_dir = Path(out_dir)
+        self.data_dir = Path(data_dir)
+        self.assets = assets
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._entries = {}
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Re-read the index after a new build; True if it changed."""
+        path = self.out_dir / INDEX_NAME
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        entries = json.loads(path.read_text(encoding="utf-8"))["entries"] if mtime else {}
+        with self._lock:
+            self._entries, self._mtime = entries, mtime
+        return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def entry(self, path: Path) -> dict:
+        """Index entry for ``path`` if its derivatives are current, else None."""
+        try:
+            key = Path(path).relative_to(self.data_dir).as_posix()
+            e = self._entries.get(key)
+            if e is None:
+                return None
+            known = self.assets.entry(path) if self.assets is not None else None
+            if known is not None:
+                size, mtime = known["bytes"], known["mtime_ns"]
+            else:
+                st = os.stat(path)
+                size, mtime = st.st_size, st.st_mtime_ns
+        except (ValueError, OSError):
+            return None
+        if e["bytes"] != size or e["mtime_ns"] != mtime:
+            return None
+        return e
+
+    @staticmethod
+    def _url(e: dict, width: int, fmt: str) -> str:
+        return f"{URL_PREFIX}{e['hash']}_{width}.{fmt}"
+
+    def url(self, path: Path, width: int, fmt: str = "webp") -> str:
+        """Smallest rendition at least ``width`` px wide (or the largest one)."""
+        e = self.entry(path)
+        if e is None:
+            return None
+        w = next((w for w in e["widths"] if w >= width), e["widths"][-1])
+        return self._url(e, w, fmt)
+
+    def img_html(self, path: Path, sizes: str = "100vw", alt: str = "") -> str:
+        """Responsive, lazily loaded ``<picture>`` for ``path``, or None if not built."""
+        e = self.entry(path)
+        if e is None:
+            return None
+        w, h = e["size"]
+        scale = e["widths"][-1] / w
+        srcset = {fmt: ", ".join(f"{self._url(e, x, fmt)} {x}w" for x in e["widths"]) for fmt in FORMATS}
+        return (
+            f'<picture><source type="image/webp" srcset="{srcset["webp"]}" sizes="{sizes}">'
+            f'<img src="{self._url(e, e["widths"][0], "png")}" srcset="{srcset["png"]}" sizes="{sizes}" '
+            f'width="{round(w * scale)}" height="{round(h * scale)}" alt="{alt}" loading="lazy" decoding="async" '
+            f'style="width:100%;height:auto;display:block"></picture>'
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.derivatives", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="gera as variantes WebP/PNG em static/derived/")
+    b.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    b.add_argument("--out", type=Path, default=DERIVED_DIR)
+    b.add_argument("-q", "--quiet", action="store_true")
+    d = sub.add_parser("dedupe", help="substitui cópias idênticas de rank*.png por hard links")
+    d.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        print(json.dumps(build(args.data_dir, args.out, verbose=not args.quiet)))
+    else:
+        print(f"{dedupe(args.data_dir) / 1024:.0f} KB recuperados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Single-file, memory-mapped store for DINOv3 CLS + patch tokens.
+
+Layout (little endian)::
+
+    header   64 bytes   magic, version, dtype, dim, tokens, count,
+                        index offset, index length
+    records  count * record_size, one fixed-size record per mark:
+             tokens x dim values (token 0 is CLS, then the patches),
+             followed, for int8 stores, by one float32 scale per token
+    index    JSON list of mark ids in record order
+
+Records have a fixed size, so a mark's tokens are found with one dict lookup
+(id -> slot) and one multiplication, and are returned as NumPy views over the
+mmap: token data is only read when it is touched, so its resident memory does
+not grow with the number of marks.
+
+The id index does. Opening the store parses the whole JSON list and builds
+the id -> slot dict, roughly 130 bytes per mark (about 130 MB and close to a
+second of parsing at a million marks), and every ``extend``/``remove`` rewrites
+the full index with five to seven fsyncs. Writes therefore cost O(N) each:
+batch them through ``extend`` (as ``import`` does) rather than appending
+marks one at a time, and expect ``refresh`` in the app to pay the parse again
+after every write.
+
+Appends are ordered so that the file is consistent after a crash at any
+point: the new index is written past the new records first, the header is
+pointed at it (with the old count), the records are written over the old
+index, and only then is the count bumped. Once the header is committed the
+index is moved down next to the records when that does not overwrite it, and
+the file is truncated after it, so repeated writes do not grow the file.
+
+    python -m inpi_heatmap.embeddings import <dir com .npz> data/embeddings.bin [--int8]
+    python -m inpi_heatmap.embeddings info data/embeddings.bin
+"""
+
+import argparse
+import json
+import os
+import struct
+import threading
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"INPIEMB1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIQQQ")  # magic, version, dtype, dim, tokens, count, index off, index len
+HEADER_SIZE = 64
+ALIGN = 64
+
+DTYPES = {0: np.float16, 1: np.int8}
+DTYPE_CODES = {"float16": 0, "int8": 1}
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def quantize(tokens: np.ndarray) -> tuple:
+    """Symmetric per-token int8 quantization; returns ``(q, scales)``."""
+    tokens = np.asarray(tokens, dtype=np.float32)
+    scales = np.abs(tokens).max(axis=-1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(tokens / scales[..., None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+class EmbeddingStore:
+    """Read (and append) access to an embedding store file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._load()
+
+    # -- creation ----------------------------------------------------------
+
+    @classmethod
+    def create(cls, path: Path, dim: int = 1280, n_patches: int = 196, dtype: str = "float16") -> "EmbeddingStore":
+        if dtype not in DTYPE_CODES:
+            raise ValueError(f"dtype must be one of {sorted(DTYPE_CODES)}, got {dtype!r}")
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        index = b"[]"
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, DTYPE_CODES[dtype], dim, n_patches + 1, 0, HEADER_SIZE, len(index)))
+            f.write(b"\0" * (HEADER_SIZE - HEADER.size))
+            f.write(index)
+        return cls(path)
+
+    # -- loading -----------------------------------------------------------
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            magic, version, dtype, dim, tokens, count, index_off, index_len = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{self.path} is not an embedding store (v{VERSION})")
+            f.seek(index_off)
+            ids = json.loads(f.read(index_len))[:count]
+
+        self.dtype = DTYPES[dtype]
+        self.quantized = self.dtype is np.int8
+        self.dim = dim
+        self.tokens = tokens
+        self.count = count
+        self.ids = ids  # removed marks are None (their record stays until a rebuild)
+        self.slots = {mark_id: i for i, mark_id in enumerate(ids) if mark_id is not None}
+        self._index_end = index_off + index_len
+        itemsize = np.dtype(self.dtype).itemsize
+        self._values_size = tokens * dim * itemsize
+        self.record_size = _align(self._values_size + (tokens * 4 if self.quantized else 0))
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+        if count:
+            self._mm = np.memmap(self.path, dtype=np.uint8, mode="r", offset=0, shape=(HEADER_SIZE + count * self.record_size,))
+            self._values = np.ndarray(
+                (count, tokens, dim),
+                dtype=self.dtype,
+                buffer=self._mm,
+                offset=HEADER_SIZE,
+                strides=(self.record_size, dim * itemsize, itemsize),
+            )
+            self._scales = None
+            if self.quantized:
+                self._scales = np.ndarray(
+                    (count, tokens),
+                    dtype=np.float32,
+                    buffer=self._mm,
+                    offset=HEADER_SIZE + self._values_size,
+                    strides=(self.record_size, 4),
+                )
+        else:
+            self._mm = None
+            self._values = np.zeros((0, tokens, dim), dtype=self.dtype)
+            self._scales = np.zeros((0, tokens), dtype=np.float32) if self.quantized else None
+
+    def version(self) -> int:
+        """Changes with every write to the file (its mtime when last loaded)."""
+        return self._mtime
+
+    def refresh(self) -> bool:
+        """Re-open the file if another process appended to it; True if it changed."""
+        if os.stat(self.path).st_mtime_ns == self._mtime:
+            return False
+        with self._lock:
+            self._load()
+        return True
+
+    # -- reads -------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, mark_id: str) -> bool:
+        return mark_id in self.slots
+
+    def raw(self, mark_id: str) -> tuple:
+        """Zero-copy ``(tokens, scales)`` views; ``scales`` is None for float16."""
+        slot = self.slots[mark_id]
+        return self._values[slot], (self._scales[slot] if self.quantized else None)
+
+    def get(self, mark_id: str) -> np.ndarray:
+        """All tokens of a mark, shape ``(tokens, dim)``.
+
+        A view for float16 stores; int8 stores are dequantized to float32.
+        """
+        values, scales = self.raw(mark_id)
+        if scales is None:
+            return values
+        return values.astype(np.float32) * scales[:, None]
+
+    def cls(self, mark_id: str) -> np.ndarray:
+        return self.get(mark_id)[0]
+
+    def patches(self, mark_id: str) -> np.ndarray:
+        return self.get(mark_id)[1:]
+
+    def cls_matrix(self) -> np.ndarray:
+        """CLS tokens of every record in slot order, shape ``(count, dim)``.
+
+        A strided view for float16 stores (no copy). Rows of removed marks are
+        still present; their ``ids`` entry is None.
+        """
+        if not self.quantized:
+            return self._values[:, 0, :]
+        return self._values[:, 0, :].astype(np.float32) * self._scales[:, :1]
+
+    # -- writes ------------------------------------------------------------
+
+    def append(self, mark_id: str, tokens: np.ndarray):
+        self.extend([mark_id], np.asarray(tokens)[None])
+
+    def extend(self, ids: list, tokens: np.ndarray):
+        """Append marks; ``tokens`` has shape ``(len(ids), tokens, dim)`` (CLS first)."""
+        tokens = np.asarray(tokens)
+        if tokens.shape != (len(ids), self.tokens, self.dim):
+            raise ValueError(f"expected tokens of shape {(len(ids), self.tokens, self.dim)}, got {tokens.shape}")
+        if len(set(ids)) != len(ids):
+            raise ValueError("duplicate mark ids in batch")
+
+        with self._lock:
+            self.refresh()
+            dup = [i for i in ids if i in self.slots]
+            if dup:
+                raise ValueError(f"mark ids already in store: {dup[:5]}")
+            buf = bytearray(len(ids) * self.record_size)
+            if self.quantized:
+                q, scales = quantize(tokens)
+            else:
+                q, scales = tokens.astype(np.float16), None
+            for i in range(len(ids)):
+                start = i * self.record_size
+                buf[start:start + self._values_size] = q[i].tobytes()
+                if scales is not None:
+                    buf[start + self._values_size:start + self._values_size + self.tokens * 4] = scales[i].tobytes()
+
+            all_ids = self.ids + list(ids)
+            index = json.dumps(all_ids, ensure_ascii=False).encode("utf-8")
+            data_end = HEADER_SIZE + self.count * self.record_size
+            # Never write over the index the header currently points to.
+            index_off = max(data_end + len(buf), self._index_end)
+            with open(self.path, "r+b") as f:
+                f.seek(index_off)
+                self._sync(f, index)
+                self._write_header(f, self.count, index_off, len(index))
+                f.seek(data_end)
+                self._sync(f, bytes(buf))
+                self._write_header(f, len(all_ids), index_off, len(index))
+                self._compact(f, len(all_ids), index_off, index)
+            self._load()
+
+    def remove(self, mark_id: str):
+        """Drop ``mark_id`` from the index; its record is reclaimed by the next rebuild."""
+        with self._lock:
+            self.refresh()
+            if mark_id not in self.slots:
+                raise KeyError(mark_id)
+            ids = list(self.ids)
+            ids[self.slots[mark_id]] = None
+            index = json.dumps(ids, ensure_ascii=False).encode("utf-8")
+            with open(self.path, "r+b") as f:
+                f.seek(self._index_end)
+                self._sync(f, index)
+                self._write_header(f, self.count, self._index_end, len(index))
+                self._compact(f, self.count, self._index_end, index)
+            self._load()
+
+    def _compact(self, f, count: int, index_off: int, index: bytes):
+        """Move the committed ``index`` (at ``index_off``) down to the end of the records and truncate after it."""
+        data_end = HEADER_SIZE + count * self.record_size
+        # The copy must not overlap the index the header points to until it is repointed.
+        if index_off - data_end >= len(index):
+            f.seek(data_end)
+            self._sync(f, index)
+            self._write_header(f, count, data_end, len(index))
+            index_off = data_end
+        f.truncate(index_off + len(index))
+        f.flush()
+        os.fsync(f.fileno())
+
+    @staticmethod
+    def _sync(f, data: bytes):
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _write_header(self, f, count: int, index_off: int, index_len: int):
+        code = 1 if self.quantized else 0
+        f.seek(0)
+        self._sync(f, HEADER.pack(MAGIC, VERSION, code, self.dim, self.tokens, count, index_off, index_len))
+
+
+def _import_dir(src: Path, dest: Path, dtype: str, batch: int = 256):
+    """Build a store from per-mark ``<id>.npz`` files with ``cls`` and ``patches``."""
+    files = sorted(Path(src).glob("*.npz"))
+    if not files:
+        raise SystemExit(f"nenhum .npz em {src}")
+    with np.load(files[0]) as first:
+        dim = first["cls"].shape[-1]
+        n_patches = first["patches"].shape[0]
+    store = EmbeddingStore(dest) if Path(dest).exists() else EmbeddingStore.create(dest, dim, n_patches, dtype)
+    for start in range(0, len(files), batch):
+        chunk = [f for f in files[start:start + batch] if f.stem not in store]
+        if not chunk:
+            continue
+        tokens = np.empty((len(chunk), store.tokens, store.dim), dtype=np.float32)
+        for i, f in enumerate(chunk):
+            with np.load(f) as z:
+                tokens[i, 0] = z["cls"].reshape(-1)
+                tokens[i, 1:] = z["patches"].reshape(n_patches, dim)
+        store.extend([f.stem for f in chunk], tokens)
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.embeddings", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="cria/estende o store a partir de arquivos <id>.npz (cls, patches)")
+    imp.add_argument("src", type=Path)
+    imp.add_argument("dest", type=Path)
+    imp.add_argument("--int8", action="store_true", help="quantiza em int8 (escala por token)")
+    info = sub.add_parser("info", help="resumo do store")
+    info.add_argument("path", type=Path)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "import":
+        store = _import_dir(args.src, args.dest, "int8" if args.int8 else "float16")
+    else:
+        store = EmbeddingStore(args.path)
+    print(
+        f"{store.path}: {len(store)} marcas, {store.tokens} tokens x {store.dim}, "
+        f"{np.dtype(store.dtype).name}, {store.record_size} bytes/marca"
+    )
+
+
+if __name__ == "__main__":
+    main()
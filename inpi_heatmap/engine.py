@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy re-implementation of the step3_alt2 heatmap from stored embeddings.
+
+1. Foreground mask: cosine similarity between the query CLS and each query
+   patch, box-smoothed on the patch grid (``fg_smooth_k``), thresholded at
+   ``fg_base_percentile`` and clamped to ``fg_min_patches``..``fg_max_patches``.
+2. Softmax pooling: every foreground query patch is compared with every patch
+   of every neighbor in a single matrix product; the ``cross_topk`` best
+   matches per neighbor are pooled with a softmax at ``softmax_temp``.
+3. Aggregation: per-neighbor heats are averaged, weighted by ``cls_sim`` when
+   ``weight_by_cls`` is set.
+
+Results are cached per (query, neighbors, params), so moving back to a
+previous parameter combination is free.
+
+``patch_matches`` gives the explicit version of step 2: for every foreground
+query patch its best patch in each neighbor, and the ``k`` strongest of those
+pairs per neighbor. All neighbors go through one matrix product, and
+selection uses argmax/argpartition. ``HeatmapEngine.matches`` caches the
+result per (query, neighbor) pair.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from inpi_heatmap import metrics
+
+DEFAULT_PARAMS = {
+    "fg_base_percentile": 85,
+    "fg_min_patches": 12,
+    "fg_max_patches": 70,
+    "fg_smooth_k": 3,
+    "cross_topk": 50,
+    "softmax_temp": 0.07,
+    "weight_by_cls": True,
+    "vis_p_low": 85,
+    "vis_p_high": 99,
+}
+
+# Full params block of a manifest entry (step2 cut + step3/vis params).
+DEFAULT_QUERY_PARAMS = {"top_k": 5, "cls_threshold": 0.25, **DEFAULT_PARAMS}
+
+# Params that change the foreground mask.
+FG_PARAMS = ("fg_base_percentile", "fg_min_patches", "fg_max_patches", "fg_smooth_k")
+
+# Params that change the heat values (the vis_* ones only change the window).
+HEAT_PARAMS = (
+    "fg_base_percentile",
+    "fg_min_patches",
+    "fg_max_patches",
+    "fg_smooth_k",
+    "cross_topk",
+    "softmax_temp",
+    "weight_by_cls",
+)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-8)
+
+
+def _box_smooth(grid: np.ndarray, k: int) -> np.ndarray:
+    if k <= 1:
+        return grid
+    pad = k // 2
+    padded = np.pad(grid, pad, mode="edge")
+    h, w = grid.shape
+    out = np.zeros_like(grid)
+    for dy in range(k):
+        for dx in range(k):
+            out += padded[dy:dy + h, dx:dx + w]
+    return out / (k * k)
+
+
+def grid_shape(n_patches: int) -> tuple:
+    side = int(round(np.sqrt(n_patches)))
+    if side * side != n_patches:
+        raise ValueError(f"{n_patches} patches do not form a square grid")
+    return (side, side)
+
+
+def foreground_mask(q_cls: np.ndarray, q_patches: np.ndarray, params: dict) -> tuple:
+    """Returns ``(mask, fg_heat)`` on the patch grid; ``fg_heat`` is NaN outside the mask."""
+    shape = grid_shape(len(q_patches))
+    sim = (_normalize(q_patches) @ _normalize(q_cls)).reshape(shape)
+    smooth = _box_smooth(sim, int(params["fg_smooth_k"]))
+
+    flat = smooth.ravel()
+    n = int((flat >= np.percentile(flat, params["fg_base_percentile"])).sum())
+    n = min(max(n, int(params["fg_min_patches"])), int(params["fg_max_patches"]), flat.size)
+    selected = np.argpartition(flat, flat.size - n)[flat.size - n:]
+
+    mask = np.zeros(flat.size, dtype=bool)
+    mask[selected] = True
+    mask = mask.reshape(shape)
+    return mask, np.where(mask, sim, np.nan)
+
+
+def neighbor_heats(q_fg: np.ndarray, targets: np.ndarray, topk: int, temp: float) -> np.ndarray:
+    """Softmax-pooled similarity of each foreground patch to each neighbor.
+
+    ``q_fg`` is ``(F, D)``, ``targets`` is ``(T, P, D)``; returns ``(T, F)``.
+    """
+    t, p, d = targets.shape
+    sims = (_normalize(targets).reshape(t * p, d) @ _normalize(q_fg).T).reshape(t, p, -1)
+    sims = np.swapaxes(sims, 1, 2)  # (T, F, P)
+    k = min(max(int(topk), 1), p)
+    top = np.partition(sims, p - k, axis=-1)[..., p - k:]
+    logits = top / temp
+    w = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    w /= w.sum(axis=-1, keepdims=True)
+    return (w * top).sum(axis=-1)
+
+
+def patch_matches(q_idx: np.ndarray, q_fg: np.ndarray, targets: np.ndarray, k: int) -> tuple:
+    """Top-``k`` patch correspondences between the query and each neighbor.
+
+    ``q_fg`` is ``(F, D)`` with grid indices ``q_idx``, ``targets`` is
+    ``(T, P, D)``. Returns ``(query_patch, target_patch, sim)``, each
+    ``(T, k)``, strongest match first.
+    """
+    t, p, d = targets.shape
+    f = len(q_fg)
+    flat = np.asarray(targets, dtype=np.float32).reshape(t * p, d)
+    # Cheaper to scale the (T*P, F) product than to normalize the (T*P, D) targets.
+    norms = np.sqrt(np.einsum("ij,ij->i", flat, flat))
+    sims = ((flat @ _normalize(q_fg).T) / np.maximum(norms, 1e-8)[:, None]).reshape(t, p, f)
+    best_target = sims.argmax(axis=1)  # (T, F)
+    best = np.take_along_axis(sims, best_target[:, None, :], axis=1)[:, 0, :]
+    k = min(max(int(k), 1), f)
+    top = np.argpartition(best, f - k, axis=1)[:, f - k:]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(best, top, axis=1), axis=1), axis=1)
+    return (
+        np.asarray(q_idx)[top],
+        np.take_along_axis(best_target, top, axis=1),
+        np.take_along_axis(best, top, axis=1),
+    )
+
+
+def compute_heatmap(store, query_id: str, neighbors: list, params: dict) -> dict:
+    """Rebuild step3_alt2 outputs for ``query_id`` from an ``EmbeddingStore``.
+
+    ``neighbors`` uses the manifest format (``target``, ``cls_sim``).
+    """
+    return heatmap_from_tokens(store.get(query_id), store, neighbors, params)
+
+
+def heatmap_from_tokens(q: np.ndarray, store, neighbors: list, params: dict) -> dict:
+    """Same as ``compute_heatmap`` for a query that is not in the store (CLS + patch tokens)."""
+    params = {**DEFAULT_PARAMS, **params}
+    mask, fg_heat = foreground_mask(q[0], q[1:], params)
+
+    final = np.full(mask.shape, np.nan, dtype=np.float32)
+    out = {"fg_mask": mask, "fg_heat": fg_heat, "fg_selected_patches": int(mask.sum())}
+    if not neighbors:
+        out.update(final_heat=final, neighbor_heat=np.zeros((0,) + mask.shape, np.float32), final_scale=None, debug=[])
+        return out
+
+    targets = np.stack([store.patches(nb["target"]) for nb in neighbors])
+    heats = neighbor_heats(q[1:][mask.ravel()], targets, params["cross_topk"], params["softmax_temp"])
+
+    sims = np.array([nb["cls_sim"] for nb in neighbors], dtype=np.float32)
+    weights = np.clip(sims, 0.0, None) if params["weight_by_cls"] else np.ones_like(sims)
+    if weights.sum() <= 0:
+        weights = np.ones_like(sims)
+    final[mask] = (weights[:, None] * heats).sum(axis=0) / weights.sum()
+
+    per_neighbor = np.full((len(neighbors),) + mask.shape, np.nan, dtype=np.float32)
+    per_neighbor[:, mask] = heats
+
+    fg_values = final[mask]
+    lo, hi = np.percentile(fg_values, [params["vis_p_low"], params["vis_p_high"]])
+    out.update(
+        final_heat=final,
+        neighbor_heat=per_neighbor,
+        final_scale={"p_low": params["vis_p_low"], "p_high": params["vis_p_high"], "lo": float(lo), "hi": float(hi)},
+        debug=[
+            {
+                "target": nb["target"],
+                "cls_sim": nb["cls_sim"],
+                "heat_mean_fg": float(h.mean()),
+                "heat_max_fg": float(h.max()),
+            }
+            for nb, h in zip(neighbors, heats)
+        ],
+    )
+    return out
+
+
+class HeatmapEngine:
+    """``compute_heatmap`` with an LRU of results keyed by query, neighbors and params.
+
+    Keys also carry ``version()``, so results computed before an incremental
+    add/remove (new tokens under a reused id, a rewritten manifest) are never
+    served afterwards.
+    """
+
+    def __init__(self, store, max_entries: int = 256, manifest=None):
+        self.store = store
+        self.manifest = manifest
+        self.max_entries = max_entries
+        self._results: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._matches: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self) -> tuple:
+        return self.store.version(), self.manifest.version() if self.manifest is not None else None
+
+    def can_compute(self, query_id: str, neighbors: list) -> bool:
+        return query_id in self.store and all(nb["target"] in self.store for nb in neighbors)
+
+    def compute(self, query_id: str, neighbors: list, params: dict) -> dict:
+        params = {**DEFAULT_PARAMS, **params}
+        key = (
+            self.version(),
+            query_id,
+            tuple((nb["target"], float(nb["cls_sim"])) for nb in neighbors),
+            tuple(params[p] for p in HEAT_PARAMS + ("vis_p_low", "vis_p_high")),
+        )
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                metrics.incr("heatmap_cache_hit")
+                return result
+            self.misses += 1
+        metrics.incr("heatmap_cache_miss")
+
+        with metrics.timed("heatmap_compute"):
+            result = compute_heatmap(self.store, query_id, neighbors, params)
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+    def matches(self, query_id: str, neighbors: list, k: int, params: dict) -> dict:
+        """``target -> (query_patch, target_patch, sim)`` for ``neighbors`` (see ``patch_matches``).
+
+        Cached per pair; the pairs not cached yet are computed in one batch.
+        """
+        params = {**DEFAULT_PARAMS, **params}
+        base = (self.version(), query_id, int(k), tuple(params[p] for p in FG_PARAMS))
+        out, missing = {}, []
+        with self._lock:
+            for nb in neighbors:
+                hit = self._matches.get(base + (nb["target"],))
+                if hit is None:
+                    missing.append(nb["target"])
+                else:
+                    self._matches.move_to_end(base + (nb["target"],))
+                    out[nb["target"]] = hit
+        if not missing:
+            return out
+
+        with metrics.timed("patch_matches"):
+            q = self.store.get(query_id)
+            mask, _ = foreground_mask(q[0], q[1:], params)
+            q_idx = np.flatnonzero(mask.ravel())
+            targets = np.stack([self.store.patches(t) for t in missing], dtype=np.float32)
+            qp, tp, sim = patch_matches(q_idx, q[1:][q_idx], targets, k)
+        with self._lock:
+            for i, target in enumerate(missing):
+                out[target] = self._matches[base + (target,)] = (qp[i], tp[i], sim[i])
+            while len(self._matches) > self.max_entries * 16:
+                self._matches.popitem(last=False)
+        return out
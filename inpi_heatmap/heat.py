@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Raw heat grids and render-time colorization.
+
+step3 produces one similarity value per ViT patch (a 14x14 grid for a
+224x224 input). Storing that grid, instead of a pre-colored PNG, lets the app
+re-apply the percentile window (``vis_p_low``/``vis_p_high``) and the ``jet``
+colormap on every render: the grid is a few hundred bytes and colorizing it
+at display size is a resize plus a 256-entry lookup table.
+
+Grids are saved as float16 ``.npy`` files; patches outside the foreground
+mask are stored as NaN. The per-neighbor heats of a query are one stacked
+``(T, H, W)`` file in the same format (~400 bytes per neighbor), so any
+subset of neighbors can be re-aggregated and colorized at render time.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap import metrics
+from inpi_heatmap.image_cache import shared_cache
+
+# Opacity of the jet layer inside the foreground, as in the baked overlays.
+OVERLAY_ALPHA = 0.5
+
+
+def _jet_lut(n: int = 256) -> np.ndarray:
+    # Same control points as matplotlib's "jet".
+    x = np.linspace(0.0, 1.0, n)
+    r = np.interp(x, [0.0, 0.35, 0.66, 0.89, 1.0], [0.0, 0.0, 1.0, 1.0, 0.5])
+    g = np.interp(x, [0.0, 0.125, 0.375, 0.64, 0.91, 1.0], [0.0, 0.0, 1.0, 1.0, 0.0, 0.0])
+    b = np.interp(x, [0.0, 0.11, 0.34, 0.65, 1.0], [0.5, 1.0, 1.0, 0.0, 0.0])
+    return np.round(np.stack([r, g, b], axis=1) * 255).astype(np.uint8)
+
+
+JET_LUT = _jet_lut()
+
+
+def save_heat_grid(path: Path, heat: np.ndarray, mask: np.ndarray = None):
+    grid = np.asarray(heat, dtype=np.float32).copy()
+    if mask is not None:
+        grid[~np.asarray(mask, dtype=bool)] = np.nan
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, grid.astype(np.float16))
+
+
+@lru_cache(maxsize=256)
+@metrics.instrument("heat_grid_load")
+def _load(path_str: str, mtime_ns: int) -> np.ndarray:
+    grid = np.load(path_str).astype(np.float32)
+    grid.flags.writeable = False
+    return grid
+
+
+def load_heat_grid(path: Path) -> np.ndarray:
+    path = Path(path)
+    return _load(str(path), path.stat().st_mtime_ns)
+
+
+def combine_layers(stack: np.ndarray, weights) -> np.ndarray:
+    """Weighted mean of ``(T, H, W)`` heat layers; NaN (background) is ignored."""
+    w = np.asarray(weights, dtype=np.float32).reshape(-1, 1, 1)
+    finite = np.isfinite(stack)
+    num = (np.where(finite, stack, 0.0) * w).sum(axis=0)
+    den = (finite * w).sum(axis=0)
+    return np.where(den > 0, num / np.maximum(den, 1e-12), np.nan).astype(np.float32)
+
+
+def window(grid: np.ndarray, p_low: float, p_high: float) -> tuple:
+    """Percentile window over the foreground values of ``grid``.
+
+    Returns ``(norm, lo, hi)`` where ``norm`` is ``grid`` clipped to
+    ``[lo, hi]`` and rescaled to ``[0, 1]`` (NaN stays NaN).
+    """
+    valid = grid[np.isfinite(grid)]
+    if valid.size == 0:
+        return np.full_like(grid, np.nan), 0.0, 0.0
+    lo, hi = np.percentile(valid, [p_low, p_high])
+    span = hi - lo if hi > lo else 1.0
+    return np.clip((grid - lo) / span, 0.0, 1.0), float(lo), float(hi)
+
+
+def _cubic(x: np.ndarray, a: float = -0.5) -> np.ndarray:
+    # Same expression as PIL's bicubic_filter, so the weights round the same way.
+    x = np.abs(x)
+    return np.where(x < 1, ((a + 2) * x - (a + 3)) * x * x + 1, np.where(x < 2, (((x - 5) * x + 8) * x - 4) * a, 0.0))
+
+
+def _resample_taps(n_in: int, n_out: int, start: int, stop: int) -> tuple:
+    """PIL's bicubic coefficients for outputs ``start:stop``: ``(first input, weights)``.
+
+    ``weights`` has one row per output and one column per tap; taps past an
+    output's window are zero.
+    """
+    scale = n_in / n_out
+    filterscale = max(scale, 1.0)
+    support = 2.0 * filterscale
+    center = (np.arange(start, stop) + 0.5) * scale
+    # astype(int) truncates toward zero, like the C casts.
+    lo = np.maximum((center - support + 0.5).astype(int), 0)
+    n = np.minimum((center + support + 0.5).astype(int), n_in) - lo
+    x = np.arange(n.max())
+    w = np.where(x < n[:, None], _cubic((x + lo[:, None] - center[:, None] + 0.5) / filterscale), 0.0)
+    total = np.zeros(len(center))
+    for j in range(w.shape[1]):  # summed tap by tap, in PIL's order
+        total += w[:, j]
+    return lo, w / total[:, None]
+
+
+def _nearest_index(n_in: int, n_out: int, start: int, stop: int) -> np.ndarray:
+    """Source index of outputs ``start:stop`` in PIL's nearest resize.
+
+    PIL steps the coordinate by repeated addition, so it is accumulated the
+    same way (``cumsum`` is sequential) rather than multiplied out.
+    """
+    step = n_in / n_out
+    coords = np.cumsum(np.r_[step * 0.5, np.full(stop - 1, step)])[start:stop]
+    return np.minimum(coords.astype(int), n_in - 1)
+
+
+def _resize_box(values: np.ndarray, size: tuple, box: tuple) -> np.ndarray:
+    """The ``box`` crop of ``Image.fromarray(values, "F").resize(size, BICUBIC)``, bit for bit.
+
+    Like PIL: a horizontal pass then a vertical one, each accumulated in
+    double precision tap by tap and stored as float32.
+    """
+    (gh, gw), (x0, y0, x1, y1) = values.shape, box
+    lo, w = _resample_taps(gw, size[0], x0, x1)
+    rows = np.zeros((gh, x1 - x0))
+    src = values.astype(np.float64)
+    for j in range(w.shape[1]):
+        rows += src[:, np.minimum(lo + j, gw - 1)] * w[:, j]
+    src = rows.astype(np.float32).astype(np.float64)
+    lo, w = _resample_taps(gh, size[1], y0, y1)
+    out, tap = np.zeros((y1 - y0, x1 - x0)), np.empty((y1 - y0, x1 - x0))
+    for j in range(w.shape[1]):
+        np.take(src, np.minimum(lo + j, gh - 1), axis=0, out=tap)
+        tap *= w[:, j, None]
+        out += tap
+    return out.astype(np.float32)
+
+
+def colorize(norm: np.ndarray, size: tuple, box: tuple = None) -> tuple:
+    """Upsample a normalized grid to ``size`` (w, h) and apply the jet LUT.
+
+    Returns ``(rgb, mask)`` as PIL images; the value field is interpolated
+    bicubically while the foreground mask keeps its patch-aligned edges.
+    With ``box`` (x0, y0, x1, y1) only that crop of the ``size`` image is
+    produced, with the same pixels the full resize would have there; a tile
+    of a print-resolution image never needs the whole upsampled field.
+    """
+    finite = np.isfinite(norm)
+    values = np.where(finite, norm, 0.0).astype(np.float32)
+    if box is None:
+        values = np.asarray(Image.fromarray(values, "F").resize(size, Image.BICUBIC))
+        mask = Image.fromarray(finite.astype(np.uint8) * 255, "L").resize(size, Image.NEAREST)
+    else:
+        (gh, gw), (x0, y0, x1, y1) = norm.shape, box
+        values = _resize_box(values, size, box)
+        rows = _nearest_index(gh, size[1], y0, y1)
+        cols = _nearest_index(gw, size[0], x0, x1)
+        mask = Image.fromarray(finite[rows][:, cols].astype(np.uint8) * 255, "L")
+    idx = np.clip(values * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(JET_LUT[idx], "RGB"), mask
+
+
+@metrics.instrument("overlay_layer")
+def overlay_layer(query_path: Path, grid: np.ndarray, size: tuple, p_low: float, p_high: float) -> np.ndarray:
+    """RGB overlay equivalent to ``final_overlay.png`` for the given window."""
+    query = Image.fromarray(shared_cache().rgba(query_path, size=size), "RGBA")
+    # Flatten transparent logos onto white, like the baked overlays.
+    base = Image.alpha_composite(Image.new("RGBA", size, "white"), query).convert("RGB")
+    return overlay_on(np.asarray(base), grid, p_low, p_high)
+
+
+def overlay_on(base: np.ndarray, grid: np.ndarray, p_low: float, p_high: float, size: tuple = None,
+               box: tuple = None) -> np.ndarray:
+    """``overlay_layer`` over an RGB ``base`` already at display size.
+
+    ``base`` may be the ``box`` crop of an image of ``size`` (a pyramid
+    region); the percentile window still comes from the whole grid.
+    """
+    norm, _, _ = window(grid, p_low, p_high)
+    base = Image.fromarray(base, "RGB")
+    rgb, mask = colorize(norm, size or base.size, box)
+    return np.asarray(Image.composite(Image.blend(base, rgb, OVERLAY_ALPHA), base, mask))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of decoded RGBA image buffers.
+
+Every Streamlit session runs in the same server process, so a module-level
+cache is shared by all examiners: a PNG is decoded (and the heatmap resized to
+the query size) once per file version, and every later slider move only pays
+for the blend itself.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap import metrics
+
+DEFAULT_MAX_BYTES = int(os.environ.get("INPI_IMAGE_CACHE_MB", "256")) * 1024 * 1024
+
+
+class ImageCache:
+    """LRU cache of read-only RGBA arrays keyed by path, mtime and size."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def rgba(self, path: Path, size: tuple = None) -> np.ndarray:
+        """Return ``path`` decoded as an RGBA array, resized to ``size`` (w, h) if given."""
+        path = Path(path)
+        key = (str(path), path.stat().st_mtime_ns, tuple(size) if size else None)
+
+        with self._lock:
+            arr = self._entries.get(key)
+            if arr is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return arr
+            self.misses += 1
+
+        # Decode outside the lock so a slow PNG does not block other sessions.
+        with metrics.timed("image_decode"):
+            img = Image.open(path).convert("RGBA")
+        if size and img.size != tuple(size):
+            with metrics.timed("image_resize"):
+                img = img.resize(tuple(size), Image.LANCZOS)
+        arr = np.asarray(img)
+        arr.flags.writeable = False
+
+        with self._lock:
+            if key not in self._entries and arr.nbytes <= self.max_bytes:
+                self._entries[key] = arr
+                self._bytes += arr.nbytes
+                self._evict()
+        return arr
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_shared = ImageCache()
+metrics.register_gauge("inpi_image_cache_bytes", lambda: _shared._bytes, "Decoded image bytes held by the shared cache.")
+metrics.register_gauge("inpi_image_cache_hits", lambda: _shared.hits, "Shared image cache hits since start.")
+metrics.register_gauge("inpi_image_cache_misses", lambda: _shared.misses, "Shared image cache misses since start.")
+
+
+def shared_cache() -> ImageCache:
+    return _shared
+
+
+def blend_arrays(base: np.ndarray, layer: np.ndarray, alpha: float) -> np.ndarray:
+    """Same result as ``Image.blend`` on two uint8 arrays of equal shape.
+
+    Mirrors PIL's C loop: ``base + alpha * (layer - base)`` in float32,
+    truncated (not rounded) back to uint8, with ``alpha`` 0 and 1 returning
+    the inputs unchanged.
+    """
+    alpha = min(max(alpha, 0.0), 1.0)
+    if alpha in (0.0, 1.0):
+        return np.array(layer if alpha else base, dtype=np.uint8)
+    out = layer.astype(np.float32)
+    out -= base
+    out *= np.float32(alpha)
+    out += base
+    return out.astype(np.uint8)
+
+
+@metrics.instrument("blend_images")
+def blend_images(query_path: Path, heatmap_path: Path, alpha: float, cache: ImageCache = None) -> Image.Image:
+    cache = cache or _shared
+    query = cache.rgba(query_path)
+    heat = cache.rgba(heatmap_path, size=(query.shape[1], query.shape[0]))
+    return Image.fromarray(blend_arrays(query, heat, alpha), "RGBA")
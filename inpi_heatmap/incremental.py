@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental manifest/neighbor updates when a mark is added or removed.
+
+Adding a mark computes its CLS similarity to every stored mark once (one
+blockwise pass over the memory-mapped CLS matrix). That vector gives both the
+new mark's own neighbor list and, by symmetry, the queries whose
+``top_k``/``cls_threshold`` cut it now passes. Only those queries get their
+neighbor list, heatmap and ``rank<N>_*.png`` assets regenerated; everything
+else is left untouched. Removing a mark is the mirror image: only the queries
+that list it are revisited, the mark is dropped and, where the list was full,
+the freed last slot is backfilled with the best mark not already listed.
+
+All manifest changes of one operation are written with a single atomic
+``put_many``; the running app notices the new manifest version on its next
+rerun, no restart needed. New assets go to fresh directories and the old ones
+are deleted only after that swap (``records.retire``), so the app never
+reads a manifest whose files are gone.
+
+    python -m inpi_heatmap.incremental add <mark_id> <imagem.png> [--embedder stub]
+    python -m inpi_heatmap.incremental remove <mark_id>
+    python -m inpi_heatmap.incremental rebuild [<query> ...]
+
+``rebuild`` recomputes the heat grids (including the per-neighbor layers) of
+existing queries with their current neighbor lists, e.g. to backfill
+``neighbor_heat.npy`` for a manifest produced before it existed.
+"""
+
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap import assets
+from inpi_heatmap.config import ANN_INDEX_DIR, ASSET_INDEX_PATH, DATA_DIR, EMBEDDINGS_PATH
+from inpi_heatmap.engine import DEFAULT_QUERY_PARAMS, compute_heatmap
+from inpi_heatmap.records import fresh_dir, mark_image, retire, write_query_assets, write_rank_images
+
+
+def similarities(store, query: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Cosine similarity of ``query`` to every record (NaN for removed marks)."""
+    q = np.asarray(query, dtype=np.float32)
+    q = q / max(np.linalg.norm(q), 1e-8)
+    cls = store.cls_matrix()
+    out = np.empty(len(cls), dtype=np.float32)
+    for start in range(0, len(cls), block):
+        chunk = np.asarray(cls[start:start + block], dtype=np.float32)
+        out[start:start + block] = (chunk @ q) / np.maximum(np.linalg.norm(chunk, axis=1), 1e-8)
+    for slot, mark_id in enumerate(store.ids):
+        if mark_id is None:
+            out[slot] = np.nan
+    return out
+
+
+def top_neighbors(store, sims: np.ndarray, k: int, threshold: float, exclude=()) -> list:
+    valid = np.where(np.isfinite(sims), sims, -np.inf)
+    for mark_id in exclude:
+        if mark_id in store:
+            valid[store.slots[mark_id]] = -np.inf
+    want = min(k, len(valid))
+    if want <= 0:
+        return []
+    top = np.argpartition(-valid, want - 1)[:want]
+    top = top[np.argsort(-valid[top])]
+    return [
+        {"target": store.ids[s], "cls_sim": round(float(valid[s]), 4)}
+        for s in top
+        if valid[s] >= threshold
+    ]
+
+
+def _output_dir(key: str, record: dict) -> Path:
+    overlay = record.get("outputs", {}).get("final_overlay")
+    return (DATA_DIR / overlay).parent if overlay else DATA_DIR / "outputs" / key
+
+
+def _update_asset_index(updates: dict, previous: dict, deleted=()):
+    assets.update(updates, deleted, DATA_DIR, DATA_DIR / ASSET_INDEX_PATH.name, previous)
+
+
+def refresh_query(store, key: str, record: dict, neighbors: list) -> dict:
+    """Record for ``key`` with a new neighbor list; heat is recomputed when the
+    query and all its neighbors have embeddings, otherwise only the neighbor
+    list and rank images change."""
+    params = {**DEFAULT_QUERY_PARAMS, **record.get("params", {})}
+    out_dir = fresh_dir(_output_dir(key, record))
+    previous = record.get("neighbors", [])
+    if key in store and all(nb["target"] in store for nb in neighbors):
+        result = compute_heatmap(store, key, neighbors, params)
+        updated = write_query_assets(out_dir, DATA_DIR / record["image"], result, neighbors, params, previous=previous)
+        return {**record, **updated, "outputs": {**record.get("outputs", {}), **updated["outputs"]}}
+    return {**record, "neighbors": write_rank_images(out_dir, neighbors, previous)}
+
+
+def add_mark(mark_id: str, image_path: Path, embedder, store, manifest, index=None, params: dict = None, min_threshold: float = None) -> dict:
+    """Insert ``mark_id`` and update only the queries it now ranks for.
+
+    ``min_threshold`` (default: the new mark's ``cls_threshold``) prefilters
+    which existing queries are even loaded; queries with a lower
+    ``cls_threshold`` in their own params need it set accordingly.
+    """
+    t0 = time.perf_counter()
+    params = {**DEFAULT_QUERY_PARAMS, **(params or {})}
+    dest = mark_image(mark_id)
+    image = Image.open(image_path)
+    if Path(image_path).resolve() != dest.resolve():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        image.save(dest)
+
+    tokens = embedder.embed(image)
+    if mark_id not in store:
+        store.append(mark_id, tokens)
+    sims = similarities(store, tokens[0])
+
+    own = top_neighbors(store, sims, int(params["top_k"]), params["cls_threshold"], exclude=(mark_id,))
+    result = compute_heatmap(store, mark_id, own, params)
+    previous = {mark_id: manifest.get(mark_id)} if mark_id in manifest else {}
+    out_dir = fresh_dir(DATA_DIR / "outputs" / mark_id)
+    old_neighbors = (previous.get(mark_id) or {}).get("neighbors", [])
+    updates = {mark_id: write_query_assets(out_dir, dest, result, own, params, previous=old_neighbors)}
+
+    cut = params["cls_threshold"] if min_threshold is None else min_threshold
+    for key in manifest.keys():
+        if key == mark_id or key not in store or not sims[store.slots[key]] >= cut:
+            continue
+        record = manifest.get(key)
+        q_params = {**DEFAULT_QUERY_PARAMS, **record.get("params", {})}
+        sim = round(float(sims[store.slots[key]]), 4)
+        current = [{"target": nb["target"], "cls_sim": nb["cls_sim"]} for nb in record.get("neighbors", [])]
+        current = [nb for nb in current if nb["target"] != mark_id]
+        if sim < q_params["cls_threshold"]:
+            continue
+        if len(current) >= int(q_params["top_k"]) and sim <= min(nb["cls_sim"] for nb in current):
+            continue
+        current.append({"target": mark_id, "cls_sim": sim})
+        current = sorted(current, key=lambda nb: -nb["cls_sim"])[: int(q_params["top_k"])]
+        previous[key] = record
+        updates[key] = refresh_query(store, key, record, current)
+
+    manifest.put_many(updates)
+    retire(previous, updates)
+    _update_asset_index(updates, previous)
+    if index is not None:
+        index.add([mark_id], tokens[:1])
+        index.save_delta(ANN_INDEX_DIR)
+    return {"added": mark_id, "updated": sorted(k for k in updates if k != mark_id), "seconds": time.perf_counter() - t0}
+
+
+def remove_mark(mark_id: str, store, manifest, index=None) -> dict:
+    """Remove ``mark_id`` from the neighbor lists that contain it.
+
+    The other neighbors keep their rank order and scores; a list that was at
+    ``top_k`` gets its freed last slot backfilled with the best remaining
+    mark (one similarity pass, queries without embeddings are only trimmed).
+    """
+    t0 = time.perf_counter()
+    if mark_id in store:
+        store.remove(mark_id)
+    updates, previous = {}, {}
+    for key in manifest.referencing(mark_id):
+        if key == mark_id:
+            continue
+        record = manifest.get(key)
+        q_params = {**DEFAULT_QUERY_PARAMS, **record.get("params", {})}
+        listed = [{"target": nb["target"], "cls_sim": nb["cls_sim"]} for nb in record.get("neighbors", [])]
+        neighbors = [nb for nb in listed if nb["target"] != mark_id]
+        if key in store and len(listed) >= int(q_params["top_k"]):
+            sims = similarities(store, store.cls(key))
+            exclude = (key, *(nb["target"] for nb in neighbors))
+            neighbors += top_neighbors(store, sims, 1, q_params["cls_threshold"], exclude=exclude)
+        previous[key] = record
+        updates[key] = refresh_query(store, key, record, neighbors)
+
+    delete = [mark_id] if mark_id in manifest else []
+    if delete:
+        previous[mark_id] = manifest.get(mark_id)
+    manifest.put_many(updates, delete=delete)
+    retire(previous, updates)
+    own_dir = DATA_DIR / "outputs" / mark_id
+    if delete and own_dir.is_dir():
+        shutil.rmtree(own_dir)
+    _update_asset_index(updates, previous, delete)
+    if index is not None:
+        index.remove([mark_id])
+        index.save_delta(ANN_INDEX_DIR)
+    return {"removed": mark_id, "updated": sorted(updates), "seconds": time.perf_counter() - t0}
+
+
+def rebuild(keys, store, manifest) -> dict:
+    """Recompute the heat assets of ``keys`` (all queries if empty) with their current neighbors."""
+    t0 = time.perf_counter()
+    updates, previous, skipped = {}, {}, []
+    for key in keys or manifest.keys():
+        record = manifest.get(key)
+        neighbors = [{"target": nb["target"], "cls_sim": nb["cls_sim"]} for nb in (record or {}).get("neighbors", [])]
+        if record is None or key not in store or not all(nb["target"] in store for nb in neighbors):
+            skipped.append(key)
+            continue
+        previous[key] = record
+        updates[key] = refresh_query(store, key, record, neighbors)
+    manifest.put_many(updates)
+    retire(previous, updates)
+    _update_asset_index(updates, previous)
+    return {"rebuilt": sorted(updates), "skipped": skipped, "seconds": time.perf_counter() - t0}
+
+
+def main(argv=None):
+    from inpi_heatmap.ann import IVFIndex
+    from inpi_heatmap.embeddings import EmbeddingStore
+    from inpi_heatmap.jobs import make_embedder
+    from inpi_heatmap.manifest_store import open_manifest_store
+
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.incremental", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    add = sub.add_parser("add", help="adiciona uma marca e atualiza as queries afetadas")
+    add.add_argument("mark_id")
+    add.add_argument("image", type=Path)
+    add.add_argument("--embedder", default=None, help="dinov3 (padrão) ou stub")
+    rm = sub.add_parser("remove", help="remove uma marca das listas de vizinhos")
+    rm.add_argument("mark_id")
+    rb = sub.add_parser("rebuild", help="recalcula mapas de calor e camadas por vizinho das queries")
+    rb.add_argument("keys", nargs="*", help="queries (padrão: todas)")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "add":
+        # Before touching anything: without the model this must stop, not write stub tokens to the store.
+        try:
+            embedder = make_embedder(args.embedder)
+        except (RuntimeError, OSError) as e:
+            parser.error(f"embedder indisponível ({e}); use --embedder stub só em dados de teste")
+    store = EmbeddingStore(EMBEDDINGS_PATH)
+    manifest = open_manifest_store(DATA_DIR)
+    index = IVFIndex.load(ANN_INDEX_DIR) if (ANN_INDEX_DIR / "ids.json").exists() else None
+    if args.cmd == "add":
+        summary = add_mark(args.mark_id, args.image, embedder, store, manifest, index)
+    elif args.cmd == "rebuild":
+        summary = rebuild(args.keys, store, manifest)
+    else:
+        summary = remove_mark(args.mark_id, store, manifest, index)
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
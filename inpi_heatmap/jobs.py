@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Background analysis of uploaded trademark images.
+
+A submitted image becomes a ``Job`` in a bounded queue; a small pool of
+worker threads runs embedding -> neighbor search -> heatmap and writes the
+result as a manifest record (same schema as ``manifest.json``) under
+``outputs/uploads/<job id>/``. The Streamlit page only polls job state, so
+it stays responsive while inference runs.
+
+Backpressure: ``submit`` raises ``QueueFullError`` when ``max_pending`` jobs
+are already waiting, or when the same owner (session) already has
+``max_per_owner`` unfinished jobs. Worker threads run at a lower OS priority
+so a burst of uploads does not starve interactive page renders.
+"""
+
+import io
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap import pyramid
+from inpi_heatmap.ann import exact_search
+from inpi_heatmap.config import DATA_DIR
+from inpi_heatmap.engine import DEFAULT_QUERY_PARAMS, heatmap_from_tokens
+from inpi_heatmap.records import write_query_assets
+
+# ---------------------------------------------------------------------------
+# Embedders
+# ---------------------------------------------------------------------------
+
+
+class StubEmbedder:
+    """Deterministic stand-in for DINOv3: a fixed random projection of pixel patches.
+
+    Similar images get similar tokens, which is enough to exercise the whole
+    pipeline in tests and demos without the model.
+    """
+
+    # Why the model could not be loaded, when this stub stands in for it.
+    fallback: str = None
+
+    def __init__(self, dim: int = 1280, grid: int = 14, patch: int = 16, seed: int = 0):
+        self.dim = dim
+        self.grid = grid
+        self.patch = patch
+        rng = np.random.default_rng(seed)
+        self._proj = rng.standard_normal((patch * patch * 3, dim)).astype(np.float32) / np.sqrt(patch * patch * 3)
+
+    def embed(self, image: Image.Image) -> np.ndarray:
+        side = self.grid * self.patch
+        rgb = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image.convert("RGBA")).convert("RGB")
+        px = np.asarray(rgb.resize((side, side), Image.BILINEAR), dtype=np.float32) / 255.0 - 0.5
+        patches = px.reshape(self.grid, self.patch, self.grid, self.patch, 3).transpose(0, 2, 1, 3, 4)
+        patches = patches.reshape(self.grid * self.grid, -1) @ self._proj
+        return np.vstack([patches.mean(axis=0, keepdims=True), patches])
+
+
+class Dinov3Embedder:
+    """DINOv3 ViT-H/16+ through ``transformers`` (optional dependency)."""
+
+    MODEL_ID = "facebook/dinov3-vith16plus-pretrain-lvd1689m"
+    N_REGISTERS = 4
+
+    def __init__(self, model_id: str = MODEL_ID, device: str = None):
+        try:
+            import torch
+            from transformers import AutoImageProcessor, AutoModel
+        except ImportError as e:
+            raise RuntimeError("DINOv3 requer torch e transformers instalados") from e
+        self._torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.processor = AutoImageProcessor.from_pretrained(model_id)
+        self.model = AutoModel.from_pretrained(model_id).to(self.device).eval()
+        self.dim = self.model.config.hidden_size
+
+    def embed(self, image: Image.Image) -> np.ndarray:
+        inputs = self.processor(images=image.convert("RGB"), return_tensors="pt").to(self.device)
+        with self._torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state[0]
+        # [CLS, registers..., patches...] -> [CLS, patches...]
+        tokens = self._torch.cat([hidden[:1], hidden[1 + self.N_REGISTERS:]])
+        return tokens.float().cpu().numpy()
+
+
+def make_embedder(name: str = None, allow_fallback: bool = False):
+    """The embedder named by ``name`` or ``INPI_EMBEDDER`` (default: DINOv3).
+
+    With ``allow_fallback``, when neither names one and DINOv3 cannot load
+    (torch/transformers missing, weights unreachable), returns a
+    ``StubEmbedder`` with ``fallback`` set, so the upload page can say so
+    instead of failing. Anything that writes to the shared store (the
+    incremental CLI) must not pass it: stub tokens there would be permanent.
+    """
+    explicit = name or os.environ.get("INPI_EMBEDDER")
+    name = explicit or "dinov3"
+    if name == "stub":
+        return StubEmbedder()
+    if name == "dinov3":
+        try:
+            return Dinov3Embedder()
+        except (RuntimeError, OSError) as e:
+            if explicit or not allow_fallback:
+                raise
+            stub = StubEmbedder()
+            stub.fallback = str(e)
+            return stub
+    raise ValueError(f"embedder desconhecido: {name!r}")
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+
+class AnalysisPipeline:
+    """Embedding -> neighbors -> heatmap -> manifest record for one image."""
+
+    def __init__(self, embedder, store=None, index=None, params: dict = None, out_dir: Path = None):
+        self.embedder = embedder
+        self.store = store
+        self.index = index
+        self.params = {**DEFAULT_QUERY_PARAMS, **(params or {})}
+        self.out_dir = Path(out_dir or DATA_DIR / "outputs" / "uploads")
+
+    def neighbors(self, tokens: np.ndarray, exclude=()) -> list:
+        if self.store is None or not len(self.store):
+            return []
+        k, threshold = int(self.params["top_k"]), self.params["cls_threshold"]
+        if self.index is not None:
+            hits = self.index.search(tokens[0], k=k, threshold=threshold, exclude=exclude)
+        else:
+            slots, sims = exact_search(self.store.cls_matrix(), tokens[0], k + len(exclude))
+            hits = [(self.store.ids[s], float(v)) for s, v in zip(slots, sims) if v >= threshold and self.store.ids[s]]
+            hits = [h for h in hits if h[0] not in exclude][:k]
+        return [{"target": t, "cls_sim": round(sim, 4)} for t, sim in hits]
+
+    def __call__(self, job: "Job", data: bytes, progress) -> dict:
+        out = self.out_dir / job.id
+        out.mkdir(parents=True, exist_ok=True)
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        query_path = out / "query.png"
+        image.save(query_path)
+
+        progress(0.1, "Extraindo embeddings")
+        tokens = self.embedder.embed(image)
+
+        progress(0.4, "Buscando marcas similares")
+        neighbors = self.neighbors(tokens)
+
+        progress(0.6, "Gerando mapa de calor")
+        result = heatmap_from_tokens(tokens, self.store, neighbors, self.params)
+
+        progress(0.8, "Renderizando imagens")
+        # Built once per upload; the page and the zoom viewer never decode the original again.
+        pyramid.build(query_path, out / pyramid.DIR_NAME)
+        return write_query_assets(
+            out, query_path, result, neighbors, self.params, pyramid=pyramid.open_pyramid(out / pyramid.DIR_NAME)
+        )
+
+
+# ---------------------------------------------------------------------------
+# Queue
+# ---------------------------------------------------------------------------
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    name: str
+    owner: str = None
+    status: str = "queued"  # queued | running | done | error
+    progress: float = 0.0
+    stage: str = "Na fila"
+    result: dict = None
+    error: str = None
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+
+def _lower_thread_priority(niceness: int = 10):
+    # On Linux setpriority() with a thread id only affects that thread.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+class JobQueue:
+    def __init__(self, pipeline, workers: int = 1, max_pending: int = 8, max_per_owner: int = 2, history: int = 200):
+        self.pipeline = pipeline
+        self.max_per_owner = max_per_owner
+        self.history = history
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"inpi-job-{i}", daemon=True) for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, name: str, data: bytes, owner: str = None) -> Job:
+        job = Job(id=uuid.uuid4().hex[:12], name=name, owner=owner)
+        with self._lock:
+            if owner is not None and sum(j.active for j in self._jobs.values() if j.owner == owner) >= self.max_per_owner:
+                raise QueueFullError("Você já tem análises em andamento; aguarde a conclusão.")
+            try:
+                self._queue.put_nowait((job, data))
+            except queue.Full:
+                raise QueueFullError("Fila de análises cheia; tente novamente em instantes.") from None
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, owner: str) -> list:
+        with self._lock:
+            return [j for j in self._jobs.values() if j.owner == owner]
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _trim(self):
+        done = [k for k, j in self._jobs.items() if not j.active]
+        for k in done[: max(0, len(self._jobs) - self.history)]:
+            del self._jobs[k]
+
+    def _worker(self):
+        _lower_thread_priority()
+        while True:
+            job, data = self._queue.get()
+            job.status, job.started = "running", time.time()
+
+            def progress(fraction: float, stage: str):
+                job.progress, job.stage = fraction, stage
+
+            try:
+                job.result = self.pipeline(job, data, progress)
+                job.status, job.progress, job.stage = "done", 1.0, "Concluído"
+            except Exception as e:  # reported to the user, the worker keeps going
+                job.status, job.stage, job.error = "error", "Erro", f"{type(e).__name__}: {e}"
+                traceback.print_exc()
+            finally:
+                job.finished = time.time()
+                self._queue.task_done()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest backends with per-query record access.
+
+``manifest.json`` is one document: every server process parses every record
+(``debug`` arrays and ``params`` included) to show a single page. The SQLite
+backend stores one row per query with a small searchable index (key, display
+name, number of neighbors), so a page loads exactly one record, the sidebar
+lists one page of keys, and recently used records stay in a small LRU.
+Sidebar search matches key or display name prefixes, case-insensitively, so
+both backends answer it from an index range instead of a table scan.
+
+Both backends expose the same interface; ``open_manifest_store`` picks SQLite
+when ``manifest.sqlite`` exists and falls back to the JSON file otherwise.
+Writes (``put_many``) are atomic: the JSON file is replaced by rename, and the
+SQLite rows change in one transaction that also bumps a generation counter,
+which readers in other processes use to drop their cached records.
+
+    python -m inpi_heatmap.manifest_store convert data/manifest.json data/manifest.sqlite
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from inpi_heatmap import metrics
+from inpi_heatmap.config import DATA_DIR
+
+SQLITE_NAME = "manifest.sqlite"
+JSON_NAME = "manifest.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    key TEXT PRIMARY KEY,
+    display_name TEXT NOT NULL,
+    n_neighbors INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_display_name ON records (display_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS records_key_nocase ON records (key COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# Curated names of the demo marks, where title-casing the key is wrong.
+DISPLAY_NAMES = {
+    "input_image": "Bull",
+    "lamborghini": "Lamborghini",
+    "maestro": "Maestro",
+    "mastercard": "Mastercard",
+    "olimpiadas": "Olimp\u00edadas",
+    "saucony": "Saucony",
+    "audi": "Audi",
+    "redbull": "Red Bull",
+    "brooks": "Brooks",
+    "speedo": "Speedo",
+    "cirrus": "Cirrus",
+}
+
+
+def default_display_name(key: str, record: dict = None) -> str:
+    if record and record.get("display_name"):
+        return record["display_name"]
+    return DISPLAY_NAMES.get(key) or key.replace("_", " ").title()
+
+
+class JsonManifestStore:
+    """The whole ``manifest.json`` in memory; fine for the demo dataset."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._load()
+
+    def _load(self):
+        self._mtime = os.stat(self.path).st_mtime_ns
+        with metrics.timed("manifest_parse"), open(self.path, encoding="utf-8") as f:
+            self._records = json.load(f)
+
+    def refresh(self) -> bool:
+        """Re-read the file if another process replaced it; True if it changed."""
+        if os.stat(self.path).st_mtime_ns == self._mtime:
+            return False
+        self._load()
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, key: str, default=None) -> dict:
+        return self._records.get(key, default)
+
+    def search(self, term: str = "", offset: int = 0, limit: int = 50) -> list:
+        term = term.strip().lower()
+        hits = [
+            (k, default_display_name(k, r))
+            for k, r in self._records.items()
+            if not term or k.lower().startswith(term) or default_display_name(k, r).lower().startswith(term)
+        ]
+        return hits[offset:offset + limit]
+
+    def count(self, term: str = "") -> int:
+        return len(self.search(term, 0, len(self._records)))
+
+    def items(self):
+        return self._records.items()
+
+    def keys(self):
+        return list(self._records)
+
+    def referencing(self, target: str) -> list:
+        """Keys whose neighbor list contains ``target``."""
+        return [k for k, r in self._records.items() if any(nb["target"] == target for nb in r.get("neighbors", []))]
+
+    def put_many(self, records: dict, delete=()):
+        updated = {k: r for k, r in self._records.items() if k not in set(delete)}
+        updated.update(records)
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(updated, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._records = updated
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def version(self) -> int:
+        return self._mtime
+
+
+class SqliteManifestStore:
+    """One row per query; records are decoded on demand and kept in an LRU."""
+
+    def __init__(self, path: Path, cache_size: int = 512):
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._schema_ready = False
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between Streamlit's session threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            with self._lock:
+                # Once per store, not per thread: also adds indexes missing from older files.
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def create(cls, path: Path, records: dict) -> "SqliteManifestStore":
+        store = cls(path)
+        with store._conn as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                (
+                    (k, default_display_name(k, r), len(r.get("neighbors", [])), json.dumps(r, ensure_ascii=False))
+                    for k, r in records.items()
+                ),
+            )
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', '1')")
+        return store
+
+    def _check_generation(self) -> bool:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        generation = row[0] if row else None
+        if generation == self._generation:
+            return False
+        with self._lock:
+            self._cache.clear()
+            self._generation = generation
+        return True
+
+    def refresh(self) -> bool:
+        """Drop cached records if another process changed the database; True if it changed."""
+        return self._check_generation()
+
+    def __contains__(self, key: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM records WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def get(self, key: str, default=None) -> dict:
+        self._check_generation()
+        with self._lock:
+            record = self._cache.get(key)
+            if record is not None:
+                self._cache.move_to_end(key)
+                return record
+        with metrics.timed("manifest_get"):
+            row = self._conn.execute("SELECT record FROM records WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            record = json.loads(row[0])
+        with self._lock:
+            self._cache[key] = record
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return record
+
+    def _where(self, term: str) -> tuple:
+        term = term.strip()
+        if not term:
+            return "", ()
+        # A literal prefix (wildcards escaped) lets SQLite use the NOCASE indexes.
+        like = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return " WHERE key LIKE ? ESCAPE '\\' OR display_name LIKE ? ESCAPE '\\'", (like, like)
+
+    def search(self, term: str = "", offset: int = 0, limit: int = 50) -> list:
+        where, args = self._where(term)
+        rows = self._conn.execute(
+            f"SELECT key, display_name FROM records{where} ORDER BY display_name COLLATE NOCASE, key LIMIT ? OFFSET ?",
+            args + (limit, offset),
+        )
+        return rows.fetchall()
+
+    def count(self, term: str = "") -> int:
+        where, args = self._where(term)
+        return self._conn.execute(f"SELECT COUNT(*) FROM records{where}", args).fetchone()[0]
+
+    def items(self):
+        for key, record in self._conn.execute("SELECT key, record FROM records ORDER BY key"):
+            yield key, json.loads(record)
+
+    def keys(self):
+        return [row[0] for row in self._conn.execute("SELECT key FROM records ORDER BY key")]
+
+    def referencing(self, target: str) -> list:
+        """Keys whose neighbor list contains ``target``."""
+        pattern = "%" + json.dumps({"target": target}, ensure_ascii=False)[1:-1] + "%"
+        rows = self._conn.execute("SELECT key, record FROM records WHERE record LIKE ?", (pattern,))
+        return [k for k, r in rows if any(nb["target"] == target for nb in json.loads(r).get("neighbors", []))]
+
+    def put_many(self, records: dict, delete=()):
+        with self._conn as conn:
+            conn.executemany("DELETE FROM records WHERE key = ?", ((k,) for k in delete))
+            conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                (
+                    (k, default_display_name(k, r), len(r.get("neighbors", [])), json.dumps(r, ensure_ascii=False))
+                    for k, r in records.items()
+                ),
+            )
+            conn.execute(
+                "INSERT INTO meta VALUES ('generation', '1') "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+            )
+
+    def version(self) -> str:
+        self._check_generation()
+        return self._generation
+
+
+def open_manifest_store(data_dir: Path = DATA_DIR):
+    data_dir = Path(data_dir)
+    if (data_dir / SQLITE_NAME).exists():
+        return SqliteManifestStore(data_dir / SQLITE_NAME)
+    return JsonManifestStore(data_dir / JSON_NAME)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.manifest_store", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    conv = sub.add_parser("convert", help="converte manifest.json para SQLite")
+    conv.add_argument("src", type=Path)
+    conv.add_argument("dest", type=Path)
+    args = parser.parse_args(argv)
+
+    with open(args.src, encoding="utf-8") as f:
+        records = json.load(f)
+    args.dest.unlink(missing_ok=True)
+    store = SqliteManifestStore.create(args.dest, records)
+    print(f"{len(store)} registros -> {args.dest}")
+
+
+if __name__ == "__main__":
+    main()
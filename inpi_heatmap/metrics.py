@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Latency histograms, counters and per-run tracing for the hot paths.
+
+Off unless ``INPI_METRICS=1`` (or ``INPI_TRACE=1``): ``instrument`` then returns the function
+unchanged and ``timed`` a shared no-op context manager, so the disabled cost
+is one call per phase at most. When on, every phase (``load_manifest``,
+``resolve``, ``image_decode``, ``blend_images``, ``image_encode``, page
+renders, ...) feeds a histogram, and the numbers are served in Prometheus
+text format at ``http://<host>:$INPI_METRICS_PORT/metrics`` (default 9108).
+Streamlit has no hook to add a route next to ``/_stcore/health``, hence the
+separate port.
+
+Tracing: inside ``tracing()`` every timed phase is also recorded as a span of
+the current script run (nesting included). The app opens a trace for runs
+with ``?trace=1`` in the URL, or for every run with ``INPI_TRACE=1``, which
+also logs each trace as one JSON line on stderr.
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("INPI_METRICS", "") not in ("", "0") or os.environ.get("INPI_TRACE", "") not in ("", "0")
+TRACE_ALL = os.environ.get("INPI_TRACE", "") not in ("", "0")
+DEFAULT_PORT = int(os.environ.get("INPI_METRICS_PORT", "9108"))
+
+# Seconds; covers sub-millisecond dict lookups up to multi-second first loads.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NOOP = nullcontext()
+_trace: "contextvars.ContextVar[list]" = contextvars.ContextVar("inpi_trace", default=None)
+_depth: "contextvars.ContextVar[int]" = contextvars.ContextVar("inpi_trace_depth", default=0)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, phase: str, seconds: float):
+        with self._lock:
+            hist = self.histograms.get(phase)
+            if hist is None:
+                hist = self.histograms[phase] = Histogram()
+            hist.observe(seconds)
+
+    def incr(self, event: str, n: int = 1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + n
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = [
+            "# HELP inpi_phase_seconds Latency per instrumented phase.",
+            "# TYPE inpi_phase_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {k: (list(h.counts), h.total, h.count) for k, h in self.histograms.items()}
+            counters = dict(self.counters)
+        for phase, (counts, total, count) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, c in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += c
+                lines.append(f'inpi_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'inpi_phase_seconds_sum{{phase="{phase}"}} {total:.6f}')
+            lines.append(f'inpi_phase_seconds_count{{phase="{phase}"}} {count}')
+        lines += ["# HELP inpi_events_total Event counters.", "# TYPE inpi_events_total counter"]
+        lines += [f'inpi_events_total{{event="{e}"}} {n}' for e, n in sorted(counters.items())]
+        for name, (fn, help_text) in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception:  # a broken gauge must not break the scrape
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+
+@contextmanager
+def _timed(phase: str):
+    spans = _trace.get()
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        _depth.reset(token)
+        REGISTRY.observe(phase, elapsed)
+        if spans is not None:
+            spans.append({"phase": phase, "start_ms": (t0 - spans[0]) * 1000, "ms": elapsed * 1000, "depth": depth})
+
+
+def timed(phase: str):
+    """Context manager timing ``phase`` (no-op when metrics are disabled)."""
+    return _timed(phase) if ENABLED else _NOOP
+
+
+def instrument(phase: str):
+    """Decorator timing every call as ``phase``; returns ``fn`` itself when disabled."""
+
+    def wrap(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with _timed(phase):
+                return fn(*args, **kwargs)
+
+        return inner
+
+    return wrap
+
+
+def incr(event: str, n: int = 1):
+    if ENABLED:
+        REGISTRY.incr(event, n)
+
+
+def register_gauge(name: str, fn, help_text: str = ""):
+    """Export ``fn()`` as gauge ``name`` at scrape time."""
+    REGISTRY.gauges[name] = (fn, help_text or name)
+
+
+@contextmanager
+def tracing(name: str, enabled: bool = True):
+    """Collect the spans of the enclosed run; yields the span list (empty when off).
+
+    The first list item is the run's start time; spans follow in completion order.
+    """
+    if not ENABLED:
+        yield []
+        return
+    if not (enabled or TRACE_ALL):
+        with _timed(name):
+            yield []
+        return
+    spans = [time.perf_counter()]
+    token = _trace.set(spans)
+    try:
+        with _timed(name):
+            yield spans
+    finally:
+        _trace.reset(token)
+        if TRACE_ALL:
+            print(json.dumps({"trace": name, "spans": spans[1:]}), file=sys.stderr)
+
+
+# ---------------------------------------------------------------------------
+# Endpoint
+# ---------------------------------------------------------------------------
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port: int = DEFAULT_PORT, host: str = "0.0.0.0"):
+    """Serve ``/metrics`` from a daemon thread (once per process); None when disabled."""
+    global _server
+    if not ENABLED:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _Handler)
+            except OSError as e:
+                print(f"metrics: porta {port} indisponível ({e})", file=sys.stderr)
+                return None
+            threading.Thread(target=_server.serve_forever, name="inpi-metrics", daemon=True).start()
+    return _server
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution tile pyramid of a query image.
+
+Trademark filings arrive at print resolution. Blending a heat layer over the
+whole 6000x6000 frame costs hundreds of MB and seconds per slider move, so
+uploads are cut once into a pyramid: level 0 is the full image, level ``L``
+is ``2^-L`` of it (box-filtered from level ``L - 1``), up to the first level
+that fits in a single ``TILE``-square tile. Tiles are RGB PNGs, flattened on
+white like the overlays, under ``<dir>/L<level>/<col>_<row>.png``.
+``preview.png`` (at most ``PREVIEW_WIDTH`` wide) stands in for the original
+wherever the whole image is shown at page size.
+
+``Pyramid.region`` decodes only the tiles that intersect a window, and
+``heat.overlay_on`` colorizes the heat grid for that window alone, so the
+cost of a view depends on the viewport, not on the source resolution.
+``meta.json`` is written last; a pyramid without it is ignored.
+
+    python -m inpi_heatmap.pyramid build data/outputs/uploads/<id>/query.png
+"""
+
+import argparse
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap import metrics
+from inpi_heatmap.image_cache import shared_cache
+
+TILE = 512
+# Name of the pyramid directory next to an upload's query image.
+DIR_NAME = "pyramid"
+# Same as components.DISPLAY_MAX_WIDTH: the widest the page ever shows a query.
+PREVIEW_WIDTH = 1200
+META_NAME = "meta.json"
+PREVIEW_NAME = "preview.png"
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    rgba = image.convert("RGBA")
+    return Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba).convert("RGB")
+
+
+def n_levels(width: int, height: int) -> int:
+    """Number of levels; the last one fits in a single tile."""
+    level = 0
+    while max(-(-width // 2**level), -(-height // 2**level)) > TILE:
+        level += 1
+    return level + 1
+
+
+def _tile_path(root: Path, level: int, col: int, row: int) -> Path:
+    return Path(root) / f"L{level}" / f"{col}_{row}.png"
+
+
+@metrics.instrument("pyramid_build")
+def build(image_path: Path, out_dir: Path) -> dict:
+    """Cut ``image_path`` into ``out_dir``; returns the metadata."""
+    out_dir = Path(out_dir)
+    for old in [out_dir / META_NAME, out_dir / PREVIEW_NAME, *out_dir.glob("L*/*.png")]:
+        old.unlink(missing_ok=True)
+    with Image.open(image_path) as im:
+        image = _flatten(im)
+    width, height = image.size
+    levels = n_levels(width, height)
+
+    tiles, preview = 0, None
+    for level in range(levels):
+        if level:
+            # reduce() is a box filter on whole pixels: level L is exactly level L-1 halved.
+            image = image.reduce(2)
+        w, h = image.size
+        (out_dir / f"L{level}").mkdir(parents=True, exist_ok=True)
+        for col in range(-(-w // TILE)):
+            for row in range(-(-h // TILE)):
+                box = (col * TILE, row * TILE, min((col + 1) * TILE, w), min((row + 1) * TILE, h))
+                image.crop(box).save(_tile_path(out_dir, level, col, row), format="PNG", compress_level=1)
+                tiles += 1
+        # The preview comes from the first level at most twice its width, not from the original.
+        if preview is None and w <= 2 * PREVIEW_WIDTH:
+            preview = image if w <= PREVIEW_WIDTH else image.resize(
+                (PREVIEW_WIDTH, max(1, round(h * PREVIEW_WIDTH / w))), Image.LANCZOS
+            )
+            preview.save(out_dir / PREVIEW_NAME, format="PNG")
+
+    meta = {"width": width, "height": height, "tile": TILE, "levels": levels, "tiles": tiles}
+    tmp = out_dir / (META_NAME + ".tmp")
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, out_dir / META_NAME)
+    return meta
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+
+class Pyramid:
+    """Read side of a built pyramid; tiles go through the shared image cache."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        meta = json.loads((self.root / META_NAME).read_text(encoding="utf-8"))
+        self.width, self.height = meta["width"], meta["height"]
+        self.tile, self.levels = meta["tile"], meta["levels"]
+        self.preview = self.root / PREVIEW_NAME
+
+    def size(self, level: int) -> tuple:
+        return (-(-self.width // 2**level), -(-self.height // 2**level))
+
+    @metrics.instrument("pyramid_region")
+    def region(self, level: int, box: tuple) -> np.ndarray:
+        """RGB pixels of ``box`` (x0, y0, x1, y1) at ``level``, from the intersecting tiles only."""
+        x0, y0, x1, y1 = box
+        out = np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        t = self.tile
+        for col in range(x0 // t, -(-x1 // t)):
+            for row in range(y0 // t, -(-y1 // t)):
+                tile = shared_cache().rgba(_tile_path(self.root, level, col, row))
+                tx0, ty0 = col * t, row * t
+                sx0, sy0 = max(x0, tx0), max(y0, ty0)
+                sx1, sy1 = min(x1, tx0 + tile.shape[1]), min(y1, ty0 + tile.shape[0])
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = tile[sy0 - ty0:sy1 - ty0, sx0 - tx0:sx1 - tx0, :3]
+        return out
+
+    def viewport(self, level: int, center: tuple, size: tuple) -> tuple:
+        """Box of at most ``size`` (w, h) at ``level`` around ``center`` (fractions), kept inside the image."""
+        lw, lh = self.size(level)
+        w, h = min(size[0], lw), min(size[1], lh)
+        x0 = min(max(int(round(center[0] * lw - w / 2)), 0), lw - w)
+        y0 = min(max(int(round(center[1] * lh - h / 2)), 0), lh - h)
+        return (x0, y0, x0 + w, y0 + h)
+
+
+@lru_cache(maxsize=64)
+def _open(root: str, mtime_ns: int) -> Pyramid:
+    return Pyramid(Path(root))
+
+
+def open_pyramid(root: Path) -> Pyramid:
+    """The pyramid under ``root``, or None if it was not (fully) built."""
+    try:
+        mtime = (Path(root) / META_NAME).stat().st_mtime_ns
+    except OSError:
+        return None
+    return _open(str(root), mtime)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.pyramid", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="gera a pirâmide de tiles de uma imagem")
+    b.add_argument("image", type=Path)
+    b.add_argument("--out", type=Path, help=f"padrão: {DIR_NAME}/ ao lado da imagem")
+    args = parser.parse_args(argv)
+    print(json.dumps(build(args.image, args.out or args.image.parent / DIR_NAME)))
+
+
+if __name__ == "__main__":
+    main()
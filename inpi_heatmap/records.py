@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest records and the per-query assets they point to.
+
+Shared by the upload jobs and the incremental updater, so a record built in
+the app has exactly the layout step4 produces: ``outputs/<query>/`` holds the
+heat grids, ``final_overlay.png`` and one ``rank<N>_<target>.png`` per
+neighbor, plus ``neighbor_heat.npy`` with one heat layer per neighbor (rows in
+``outputs.neighbor_heat_targets`` order). Uploads also get a tile pyramid
+(``inpi_heatmap.pyramid``), recorded as ``outputs.pyramid``.
+
+Assets are only ever created, never renamed or overwritten: an update writes
+into a fresh ``outputs/<query>/rev-<n>/`` directory (``fresh_dir``), the
+manifest is swapped, and only then ``retire`` deletes the files the previous
+records pointed at. An app still holding the old manifest keeps finding
+every file it references until its next rerun.
+"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from inpi_heatmap.assets import referenced_paths
+from inpi_heatmap.config import DATA_DIR
+from inpi_heatmap.heat import overlay_layer, save_heat_grid
+
+REVISION_PREFIX = "rev-"
+
+
+def rel(path: Path) -> str:
+    """Manifest-style path (relative to ``DATA_DIR``, forward slashes)."""
+    return Path(os.path.relpath(path, DATA_DIR)).as_posix()
+
+
+def mark_image(mark_id: str) -> Path:
+    return DATA_DIR / "images" / f"{mark_id}.png"
+
+
+def fresh_dir(base: Path) -> Path:
+    """``base`` if nothing lives there yet, else a new ``rev-<n>`` directory under it."""
+    base = Path(base)
+    if base.name.startswith(REVISION_PREFIX):
+        base = base.parent
+    if not base.is_dir() or not any(base.iterdir()):
+        return base
+    return base / f"{REVISION_PREFIX}{time.time_ns():x}"
+
+
+def _link_or_copy(src: Path, dest: Path):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def write_rank_images(out_dir: Path, neighbors: list, previous: list = ()) -> list:
+    """Write ``rank<N>_<target>.png`` for ``neighbors`` into ``out_dir`` (see ``fresh_dir``).
+
+    A neighbor that is already in ``previous`` (the old manifest neighbor
+    list) gets a hard link to its old image instead of a re-encode. Returns
+    the neighbor list in manifest format (``rank``, ``target_image``).
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    known = {nb["target"]: DATA_DIR / nb["target_image"] for nb in previous if nb.get("target_image")}
+    records = []
+    for rank, nb in enumerate(neighbors, 1):
+        target_path = out_dir / f"rank{rank}_{nb['target']}.png"
+        src = mark_image(nb["target"])
+        old = known.get(nb["target"])
+        if target_path.exists():
+            pass
+        elif old is not None and old.exists():
+            _link_or_copy(old, target_path)
+        elif src.exists():
+            target = Image.open(src).convert("RGBA")
+            Image.alpha_composite(Image.new("RGBA", target.size, "white"), target).convert("RGB").save(target_path)
+        records.append({"rank": rank, "target": nb["target"], "cls_sim": nb["cls_sim"], "target_image": rel(target_path)})
+    return records
+
+
+def retire(previous: dict, current: dict) -> list:
+    """Delete the files ``previous`` records used that ``current`` ones no longer do.
+
+    Both map query keys to records (a key missing from ``current`` was
+    deleted). Call only after the manifest swap. Only generated files under
+    ``outputs/`` are touched, never the marks' source images. Returns the
+    removed paths, relative to ``DATA_DIR``; emptied ``rev-<n>`` directories
+    go too.
+    """
+    keep = {p for record in current.values() if record for p in referenced_paths(record)}
+    removed = []
+    for record in previous.values():
+        for path in referenced_paths(record or {}):
+            if path in keep or path in removed or not path.startswith("outputs/"):
+                continue
+            full = DATA_DIR / path
+            if full.name == "meta.json":  # a pyramid: the whole directory goes
+                shutil.rmtree(full.parent, ignore_errors=True)
+            elif full.is_file():
+                full.unlink()
+            else:
+                continue
+            removed.append(path)
+            if full.parent.name.startswith(REVISION_PREFIX):
+                try:
+                    full.parent.rmdir()
+                except OSError:
+                    pass  # not empty yet
+    return removed
+
+
+def write_query_assets(out_dir: Path, query_path: Path, result: dict, neighbors: list, params: dict,
+                       pyramid=None, previous: list = ()) -> dict:
+    """Persist an engine ``result`` for one query and return its manifest record.
+
+    ``out_dir`` must not hold files a live record points at (``fresh_dir``).
+    With a ``pyramid`` the overlay is baked over its preview instead of the
+    full-resolution original; ``previous`` is passed to ``write_rank_images``.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    save_heat_grid(out_dir / "fg_heat.npy", result["fg_heat"])
+    save_heat_grid(out_dir / "final_heat.npy", result["final_heat"])
+    save_heat_grid(out_dir / "neighbor_heat.npy", result["neighbor_heat"])
+
+    grid = result["final_heat"] if neighbors else result["fg_heat"]
+    base_path = pyramid.preview if pyramid is not None else query_path
+    with Image.open(base_path) as im:
+        size = im.size
+    overlay = overlay_layer(base_path, grid, size, params["vis_p_low"], params["vis_p_high"])
+    Image.fromarray(overlay).save(out_dir / "final_overlay.png")
+
+    record = {
+        "image": rel(query_path),
+        "neighbors": write_rank_images(out_dir, neighbors, previous),
+        "params": dict(params),
+        "outputs": {
+            "fg_heat_grid": rel(out_dir / "fg_heat.npy"),
+            "fg_selected_patches": result["fg_selected_patches"],
+            "final_overlay": rel(out_dir / "final_overlay.png"),
+            "final_heat_grid": rel(out_dir / "final_heat.npy"),
+            "neighbor_heat_grid": rel(out_dir / "neighbor_heat.npy"),
+            "neighbor_heat_targets": [nb["target"] for nb in neighbors],
+            "final_scale": result["final_scale"],
+        },
+        "debug": result["debug"],
+    }
+    if pyramid is not None:
+        record["outputs"]["pyramid"] = rel(pyramid.root)
+    return record
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of the per-query views, without a Streamlit session.
+
+For each manifest entry the renderer writes, under ``<out>/<query>/``:
+
+- ``blend.png``: the query with its heatmap blended at ``alpha`` (what the
+  page shows at that slider position);
+- ``neighbors.png``: a strip with the similar marks and their scores;
+- ``report.png``: title, blend and strip on one page, for examiners.
+
+Queries are spread over a process pool. Each output directory keeps a
+``stamp.json`` with a hash of everything the images depend on (the record,
+the rendering options and the bytes of every input file); a query whose hash
+did not change is skipped, so a nightly run only pays for what changed.
+
+    python -m inpi_heatmap.render                    # every entry
+    python -m inpi_heatmap.render mastercard maestro --alpha 0.6 --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from inpi_heatmap.config import DATA_DIR
+from inpi_heatmap import metrics
+from inpi_heatmap.heat import JET_LUT, load_heat_grid, overlay_layer
+from inpi_heatmap.image_cache import blend_arrays, shared_cache
+from inpi_heatmap.manifest_store import default_display_name
+
+# Bump when the rendered pixels change so existing stamps are invalidated.
+RENDER_VERSION = 3
+REPORT_WIDTH = 1200
+STRIP_HEIGHT = 220
+# Marks per strip row; longer neighbor lists wrap onto more rows.
+STRIP_COLUMNS = 5
+MATCH_HEIGHT = 280
+DEFAULT_ALPHA = 0.45
+
+# Queries whose page shows the foreground heat instead of the final one.
+USE_FG_AS_HEATMAP = {"olimpiadas"}
+
+TITLE_COLOR = (26, 35, 126)
+MUTED_COLOR = (117, 117, 117)
+
+
+def score_color(v: float) -> str:
+    if v >= 0.7:
+        return "#27ae60"
+    if v >= 0.4:
+        return "#f39c12"
+    return "#e74c3c"
+
+
+def score_label(v: float) -> str:
+    if v >= 0.7:
+        return "Alta"
+    if v >= 0.4:
+        return "Média"
+    return "Baixa"
+
+
+def _font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    rgba = image.convert("RGBA")
+    return Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba).convert("RGB")
+
+
+def _fit(size: tuple, max_width: int) -> tuple:
+    w, h = size
+    if w <= max_width:
+        return (w, h)
+    return (max_width, max(1, round(h * max_width / w)))
+
+
+# ---------------------------------------------------------------------------
+# Views
+# ---------------------------------------------------------------------------
+
+
+def shows_fg_heat(key: str, neighbors: list) -> bool:
+    """Whether ``key``'s page shows the foreground heat instead of the final one.
+
+    Besides the curated keys, that is every query without neighbors: its final
+    heat is empty, and its baked ``final_overlay`` is the foreground heat.
+    """
+    return key in USE_FG_AS_HEATMAP or not neighbors
+
+
+def heat_source(key: str, record: dict, data_dir: Path = DATA_DIR) -> tuple:
+    """``(grid_path, overlay_path)`` the page would use for ``key``; either may be None."""
+    outputs = record.get("outputs", {})
+    if shows_fg_heat(key, record.get("neighbors")):
+        grid = outputs.get("fg_heat_grid")
+        overlay = outputs.get("fg_overlay", outputs.get("final_overlay"))
+    else:
+        grid = outputs.get("final_heat_grid")
+        overlay = outputs.get("final_overlay")
+    grid_path = data_dir / grid if grid and (data_dir / grid).exists() else None
+    overlay_path = data_dir / overlay if overlay and (data_dir / overlay).exists() else None
+    return grid_path, overlay_path
+
+
+def render_blend(key: str, record: dict, alpha: float = DEFAULT_ALPHA, max_width: int = REPORT_WIDTH,
+                 data_dir: Path = DATA_DIR) -> Image.Image:
+    query_path = data_dir / record["image"]
+    with Image.open(query_path) as im:
+        size = _fit(im.size, max_width)
+        base = _flatten(im).resize(size, Image.LANCZOS)
+
+    grid_path, overlay_path = heat_source(key, record, data_dir)
+    if grid_path is not None:
+        params = record.get("params", {})
+        layer = overlay_layer(
+            query_path, load_heat_grid(grid_path), size, params.get("vis_p_low", 85), params.get("vis_p_high", 99)
+        )
+    elif overlay_path is not None:
+        with Image.open(overlay_path) as im:
+            layer = np.asarray(_flatten(im).resize(size, Image.LANCZOS))
+    else:
+        return base
+    return Image.fromarray(blend_arrays(np.asarray(base), layer, alpha), "RGB")
+
+
+def render_strip(neighbors: list, width: int = REPORT_WIDTH, height: int = STRIP_HEIGHT,
+                 columns: int = STRIP_COLUMNS) -> Image.Image:
+    """Similar marks side by side, each with its name, score and a score bar.
+
+    At most ``columns`` marks per row of ``height`` px; the strip grows by a
+    row for each further ``columns`` marks.
+    """
+    if not neighbors:
+        strip = Image.new("RGB", (width, height), "white")
+        ImageDraw.Draw(strip).text(
+            (16, height // 2), "Nenhuma marca similar encontrada.", fill=MUTED_COLOR, font=_font(18)
+        )
+        return strip
+
+    columns = min(columns, len(neighbors))
+    n_rows = -(-len(neighbors) // columns)
+    strip = Image.new("RGB", (width, height * n_rows), "white")
+    draw = ImageDraw.Draw(strip)
+    name_font, score_font = _font(16), _font(14)
+    pad = 12
+    cell = (width - pad) // columns
+    thumb_h = height - 70
+    for i, nb in enumerate(neighbors):
+        x, top = pad + (i % columns) * cell, (i // columns) * height
+        path = DATA_DIR / nb["target_image"] if nb.get("target_image") else None
+        if path is not None and path.exists():
+            with Image.open(path) as im:
+                thumb = _flatten(im)
+            thumb.thumbnail((cell - pad, thumb_h), Image.LANCZOS)
+            strip.paste(thumb, (x + (cell - pad - thumb.width) // 2, top + pad + (thumb_h - thumb.height) // 2))
+
+        sim = nb["cls_sim"]
+        color = score_color(sim)
+        y = top + thumb_h + pad + 4
+        draw.text((x, y), default_display_name(nb["target"]), fill=(33, 33, 33), font=name_font)
+        draw.text((x, y + 20), f"{int(sim * 100)}% · {score_label(sim)}", fill=color, font=score_font)
+        bar_w = cell - pad
+        draw.rectangle((x, y + 40, x + bar_w, y + 46), fill=(240, 241, 245))
+        draw.rectangle((x, y + 40, x + max(1, int(bar_w * min(max(sim, 0.0), 1.0))), y + 46), fill=color)
+    return strip
+
+
+def _flat_thumb(path: Path, height: int) -> Image.Image:
+    with Image.open(path) as im:
+        size = (max(1, round(im.width * height / im.height)), height)
+    return _flatten(Image.fromarray(shared_cache().rgba(path, size=size), "RGBA"))
+
+
+@metrics.instrument("render_matches")
+def render_matches(query_path: Path, target_path: Path, matches: tuple, grid: tuple = (14, 14),
+                   height: int = MATCH_HEIGHT) -> Image.Image:
+    """Query and neighbor side by side, with a line per patch correspondence.
+
+    ``matches`` is ``(query_patch, target_patch, sim)`` with flat indices on
+    ``grid`` (see ``engine.patch_matches``); lines are colored by ``sim``
+    (jet, relative to the pairs shown).
+    """
+    left, right = _flat_thumb(query_path, height), _flat_thumb(target_path, height)
+    gap = 24
+    canvas = Image.new("RGB", (left.width + gap + right.width, height), "white")
+    canvas.paste(left, (0, 0))
+    canvas.paste(right, (left.width + gap, 0))
+
+    rows, cols = grid
+    q_idx, t_idx, sims = (np.asarray(a) for a in matches)
+    lo, hi = float(sims.min()), float(sims.max())
+    norm = (sims - lo) / (hi - lo) if hi > lo else np.ones_like(sims)
+    draw = ImageDraw.Draw(canvas)
+    # Weakest first, so the strongest lines end up on top.
+    for qi, ti, v in sorted(zip(q_idx, t_idx, norm), key=lambda m: m[2]):
+        qx = (qi % cols + 0.5) * left.width / cols
+        qy = (qi // cols + 0.5) * height / rows
+        tx = left.width + gap + (ti % cols + 0.5) * right.width / cols
+        ty = (ti // cols + 0.5) * height / rows
+        color = tuple(int(c) for c in JET_LUT[int(round(v * 255))])
+        draw.line((qx, qy, tx, ty), fill=color, width=2)
+        for x, y in ((qx, qy), (tx, ty)):
+            draw.ellipse((x - 3, y - 3, x + 3, y + 3), fill=color, outline="white")
+    return canvas
+
+
+def render_report(key: str, record: dict, blend: Image.Image, strip: Image.Image) -> Image.Image:
+    title_h = 80
+    page = Image.new("RGB", (REPORT_WIDTH, title_h + blend.height + strip.height + 24), "white")
+    draw = ImageDraw.Draw(page)
+    n = len(record.get("neighbors", []))
+    draw.text((16, 12), f"Análise: {default_display_name(key, record)}", fill=TITLE_COLOR, font=_font(28))
+    draw.text((16, 50), f"{n} marca(s) similar(es) encontrada(s)", fill=MUTED_COLOR, font=_font(16))
+    page.paste(blend, ((REPORT_WIDTH - blend.width) // 2, title_h))
+    page.paste(strip, (0, title_h + blend.height + 24))
+    return page
+
+
+# ---------------------------------------------------------------------------
+# Batch
+# ---------------------------------------------------------------------------
+
+OUTPUT_NAMES = ("blend.png", "neighbors.png", "report.png")
+
+
+def file_digest(path: Path) -> bytes:
+    return hashlib.sha256(path.read_bytes()).digest() if path.exists() else b"-"
+
+
+def input_hash(key: str, record: dict, alpha: float, digest=file_digest, data_dir: Path = DATA_DIR) -> str:
+    """Hash of the record, the options and the bytes of every file the views read.
+
+    ``digest`` maps a path to its content hash; callers that hash the same
+    files repeatedly can pass a cached one.
+    """
+    h = hashlib.sha256(json.dumps([RENDER_VERSION, key, record, alpha], sort_keys=True).encode())
+    files = [data_dir / record["image"], *(p for p in heat_source(key, record, data_dir) if p is not None)]
+    files += [data_dir / nb["target_image"] for nb in record.get("neighbors", []) if nb.get("target_image")]
+    for path in files:
+        h.update(path.as_posix().encode())
+        h.update(digest(path))
+    return h.hexdigest()
+
+
+def render_query(key: str, record: dict, out_dir: Path, alpha: float = DEFAULT_ALPHA, force: bool = False) -> tuple:
+    """Render the three views for one query; returns ``(key, status, seconds)``."""
+    t0 = time.perf_counter()
+    dest = Path(out_dir) / key
+    stamp_path = dest / "stamp.json"
+    digest = input_hash(key, record, alpha)
+    if not force and stamp_path.exists() and all((dest / n).exists() for n in OUTPUT_NAMES):
+        if json.loads(stamp_path.read_text(encoding="utf-8")).get("hash") == digest:
+            return key, "skipped", time.perf_counter() - t0
+
+    dest.mkdir(parents=True, exist_ok=True)
+    blend = render_blend(key, record, alpha)
+    strip = render_strip(record.get("neighbors", []))
+    for name, image in zip(OUTPUT_NAMES, (blend, strip, render_report(key, record, blend, strip))):
+        tmp = dest / (name + ".tmp")
+        image.save(tmp, format="PNG")
+        os.replace(tmp, dest / name)
+    # Written last: an interrupted run leaves no stamp and is redone.
+    stamp_path.write_text(json.dumps({"hash": digest, "alpha": alpha}), encoding="utf-8")
+    return key, "rendered", time.perf_counter() - t0
+
+
+def _render_safe(args: tuple) -> tuple:
+    key = args[0]
+    try:
+        return render_query(*args)
+    except Exception as e:  # one broken entry must not stop the batch
+        return key, f"error: {type(e).__name__}: {e}", 0.0
+
+
+def render_all(manifest, keys=None, out_dir: Path = DATA_DIR / "reports", alpha: float = DEFAULT_ALPHA,
+               workers: int = None, force: bool = False, batch: int = 256):
+    """Yield ``(key, status, seconds)`` for ``keys`` (default: every entry) as they finish."""
+    keys = list(keys) if keys else manifest.keys()
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Records are read and shipped in batches so a huge manifest is never
+        # materialized in memory at once.
+        for start in range(0, len(keys), batch):
+            tasks = [(k, manifest.get(k), out_dir, alpha, force) for k in keys[start:start + batch]]
+            yield from pool.map(_render_safe, [t for t in tasks if t[1] is not None], chunksize=4)
+
+
+def main(argv=None):
+    from inpi_heatmap.manifest_store import open_manifest_store
+
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.render", description=__doc__.split("\n")[1])
+    parser.add_argument("keys", nargs="*", help="queries a renderizar (padrão: todas)")
+    parser.add_argument("--out", type=Path, default=DATA_DIR / "reports")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="intensidade do mapa de calor (0-1)")
+    parser.add_argument("--workers", type=int, default=None, help="processos (padrão: todos os núcleos)")
+    parser.add_argument("--force", action="store_true", help="ignora os carimbos e renderiza tudo")
+    args = parser.parse_args(argv)
+
+    manifest = open_manifest_store(DATA_DIR)
+    missing = [k for k in args.keys if k not in manifest]
+    if missing:
+        parser.error(f"queries inexistentes: {', '.join(missing)}")
+
+    t0 = time.perf_counter()
+    counts = {}
+    for key, status, seconds in render_all(manifest, args.keys, args.out, args.alpha, args.workers, args.force):
+        counts[status.split(":")[0]] = counts.get(status.split(":")[0], 0) + 1
+        print(f"{key}: {status} ({seconds:.2f}s)")
+    summary = ", ".join(f"{n} {s}" for s, n in sorted(counts.items()))
+    print(f"{summary} em {time.perf_counter() - t0:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled, multi-level all-pairs CLS similarity matrix of the whole registry.
+
+Rows and columns follow a clustering order: a spherical k-means (the one the
+ANN index trains) on the CLS vectors, clusters chained greedily by centroid
+similarity, and members sorted by similarity to their centroid. Groups of
+similar marks (the circle logos, the bulls, ...) then show up as bright
+blocks along the diagonal.
+
+Level ``L`` of the pyramid has one pixel per ``2^L x 2^L`` block of pairs,
+holding the block's mean cosine similarity. For unit vectors that mean is
+exactly the dot product of the two groups' mean vectors, so level ``L`` is
+the ``ceil(N / 2^L)``-square product of group means: no level ever needs the
+N^2 pair values, and the coarse levels are cheap. Levels from
+``FINE_LEVELS`` up are computed at build time, one ``TILE``-square tile at a
+time (only ``i <= j``; the matrix is symmetric). Finer tiles are computed on
+first view from at most ``TILE * 2^(FINE_LEVELS - 1)`` rows per side. Every
+tile is then kept as an 8-bit grayscale PNG (0 = no data) under
+``data/simmatrix/``.
+
+    python -m inpi_heatmap.simmatrix build
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from inpi_heatmap.ann import spherical_kmeans
+from inpi_heatmap.config import DATA_DIR, EMBEDDINGS_PATH
+
+TILE = 256
+FINE_LEVELS = 4
+CHUNK = 65536
+MATRIX_DIR = DATA_DIR / "simmatrix"
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-8)
+
+
+def quantize(sims: np.ndarray) -> np.ndarray:
+    """Cosine in [-1, 1] -> 1..255; NaN (no data) -> 0."""
+    q = np.round((np.clip(np.nan_to_num(sims, nan=-1.0), -1.0, 1.0) + 1.0) * 127.0) + 1
+    return np.where(np.isfinite(sims), q, 0).astype(np.uint8)
+
+
+def dequantize(tile: np.ndarray) -> np.ndarray:
+    return np.where(tile > 0, (tile.astype(np.float32) - 1) / 127.0 - 1.0, np.nan)
+
+
+def n_levels(n: int) -> int:
+    """Number of levels; the last one fits in a single tile."""
+    level = 0
+    while -(-n // 2**level) > TILE:
+        level += 1
+    return level + 1
+
+
+# ---------------------------------------------------------------------------
+# Ordering and group means
+# ---------------------------------------------------------------------------
+
+
+class _Rows:
+    """``vectors`` restricted to ``slots``, indexable like an array (for ``spherical_kmeans``)."""
+
+    def __init__(self, vectors, slots: np.ndarray):
+        self.vectors, self.slots = vectors, slots
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __getitem__(self, idx):
+        return self.vectors[self.slots[idx]]
+
+
+def cluster_order(vectors, slots: np.ndarray, n_clusters: int = None, seed: int = 0) -> tuple:
+    """``(ordered_slots, cluster_offsets)`` for the rows ``slots`` of ``vectors``."""
+    n = len(slots)
+    k = min(n_clusters or max(1, int(round(np.sqrt(n)))), n)
+    centroids = spherical_kmeans(_Rows(vectors, slots), k, seed=seed)
+    assign = np.empty(n, dtype=np.int32)
+    score = np.empty(n, dtype=np.float32)
+    for start in range(0, n, CHUNK):
+        sims = _normalize(vectors[slots[start:start + CHUNK]]) @ centroids.T
+        assign[start:start + CHUNK] = sims.argmax(axis=1)
+        score[start:start + CHUNK] = sims.max(axis=1)
+
+    # Chain clusters: start from the largest, then always the closest unvisited centroid.
+    sizes = np.bincount(assign, minlength=k)
+    live = [c for c in range(k) if sizes[c]]
+    chain = [max(live, key=lambda c: sizes[c])]
+    rest = set(live) - set(chain)
+    csim = centroids @ centroids.T
+    while rest:
+        nxt = max(rest, key=lambda c: csim[chain[-1], c])
+        chain.append(nxt)
+        rest.remove(nxt)
+
+    order, offsets = [], [0]
+    for c in chain:
+        members = np.flatnonzero(assign == c)
+        order.append(slots[members[np.argsort(-score[members], kind="stable")]])
+        offsets.append(offsets[-1] + len(members))
+    return np.concatenate(order), offsets
+
+
+def group_sums(vectors, rows: np.ndarray, size: int) -> tuple:
+    """Sum of the unit vectors and count per consecutive group of ``size`` rows.
+
+    ``rows`` are slots in matrix order; ``-1`` (a mark no longer in the store)
+    counts as absent.
+    """
+    sums, counts = [], []
+    step = max(size, CHUNK // size * size)
+    for start in range(0, len(rows), step):
+        chunk = rows[start:start + step]
+        valid = chunk >= 0
+        x = np.zeros((len(chunk), vectors.shape[1]), dtype=np.float32)
+        if valid.any():
+            x[valid] = _normalize(vectors[chunk[valid]])
+        starts = np.arange(0, len(chunk), size)
+        sums.append(np.add.reduceat(x, starts, axis=0))
+        counts.append(np.add.reduceat(valid.astype(np.int64), starts))
+    if not sums:
+        return np.zeros((0, vectors.shape[1]), np.float32), np.zeros(0, np.int64)
+    return np.concatenate(sums), np.concatenate(counts)
+
+
+def _halve(sums: np.ndarray, counts: np.ndarray) -> tuple:
+    starts = np.arange(0, len(sums), 2)
+    return np.add.reduceat(sums, starts, axis=0), np.add.reduceat(counts, starts)
+
+
+def _means(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts[:, None]
+
+
+def _tile_from_means(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return quantize(a @ b.T)
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+
+def _tile_path(out_dir: Path, level: int, i: int, j: int) -> Path:
+    return Path(out_dir) / f"L{level}" / f"{i}_{j}.png"
+
+
+def _save_tile(path: Path, tile: np.ndarray):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    Image.fromarray(tile, "L").save(tmp, format="PNG")
+    os.replace(tmp, path)
+
+
+def build(store, out_dir: Path = MATRIX_DIR, n_clusters: int = None, verbose: bool = True) -> dict:
+    """Order the registry and write the precomputed levels; returns the metadata."""
+    t0 = time.perf_counter()
+    out_dir = Path(out_dir)
+    vectors = store.cls_matrix()
+    slots = np.array(sorted(store.slots.values()), dtype=np.int64)
+    order, offsets = cluster_order(vectors, slots, n_clusters)
+    ids = [store.ids[s] for s in order]
+    levels = n_levels(len(ids))
+    first = min(FINE_LEVELS, levels - 1)
+
+    for old in out_dir.glob("L*/*.png"):
+        old.unlink()
+    sums, counts = group_sums(vectors, order, 2**first)
+    tiles = 0
+    for level in range(first, levels):
+        means = _means(sums, counts)
+        n_tiles = -(-len(means) // TILE)
+        for i in range(n_tiles):
+            a = means[i * TILE:(i + 1) * TILE]
+            for j in range(i, n_tiles):
+                _save_tile(_tile_path(out_dir, level, i, j), _tile_from_means(a, means[j * TILE:(j + 1) * TILE]))
+                tiles += 1
+        if verbose:
+            print(f"nível {level}: {len(means)} px, {n_tiles}x{n_tiles} tiles")
+        sums, counts = _halve(sums, counts)
+
+    meta = {
+        "n": len(ids),
+        "tile": TILE,
+        "levels": levels,
+        "precomputed_from": first,
+        "clusters": offsets,
+        "store_count": store.count,
+        "seconds": round(time.perf_counter() - t0, 2),
+        "tiles": tiles,
+    }
+    (out_dir / "order.json").write_text(json.dumps(ids, ensure_ascii=False), encoding="utf-8")
+    tmp = out_dir / "meta.json.tmp"
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, out_dir / "meta.json")
+    return meta
+
+
+# ---------------------------------------------------------------------------
+# Viewer (app side)
+# ---------------------------------------------------------------------------
+
+
+class SimMatrix:
+    """Tiles of a built matrix; fine levels are computed (and saved) on first view."""
+
+    def __init__(self, path: Path = MATRIX_DIR, store=None, max_tiles: int = 256):
+        self.path = Path(path)
+        self.store = store
+        self.max_tiles = max_tiles
+        self._lock = threading.Lock()
+        self._tiles: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._mtime = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Re-read after a rebuild; True if it changed.
+
+        A matrix that is already loaded survives its files going missing or
+        being mid-rewrite: the current one is kept and the next call retries.
+        """
+        meta_path = self.path / "meta.json"
+        try:
+            mtime = meta_path.stat().st_mtime_ns
+            if mtime == self._mtime:
+                return False
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            ids = json.loads((self.path / "order.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            if self._mtime is None:
+                raise
+            return False
+        with self._lock:
+            self.meta, self.ids, self._mtime = meta, ids, mtime
+            self.position = {mark_id: i for i, mark_id in enumerate(ids)}
+            self._rows = None
+            self._tiles.clear()
+        return True
+
+    @property
+    def levels(self) -> int:
+        return self.meta["levels"]
+
+    @property
+    def min_level(self) -> int:
+        """Finest level that can be shown (fine levels need the embedding store)."""
+        return 0 if self.store is not None else self.meta["precomputed_from"]
+
+    def size(self, level: int) -> int:
+        return -(-self.meta["n"] // 2**level)
+
+    def _slots(self) -> np.ndarray:
+        if self._rows is None:
+            slots = self.store.slots
+            self._rows = np.array([slots.get(mark_id, -1) for mark_id in self.ids], dtype=np.int64)
+        return self._rows
+
+    def tile(self, level: int, i: int, j: int) -> np.ndarray:
+        if i > j:
+            return self.tile(level, j, i).T
+        key = (level, i, j)
+        with self._lock:
+            hit = self._tiles.get(key)
+            if hit is not None:
+                self._tiles.move_to_end(key)
+                return hit
+        path = _tile_path(self.path, level, i, j)
+        if path.exists():
+            with Image.open(path) as im:
+                tile = np.asarray(im)
+        elif level < self.meta["precomputed_from"] and self.store is not None:
+            rows, span = self._slots(), TILE * 2**level
+            vectors = self.store.cls_matrix()
+            a = _means(*group_sums(vectors, rows[i * span:(i + 1) * span], 2**level))
+            b = a if i == j else _means(*group_sums(vectors, rows[j * span:(j + 1) * span], 2**level))
+            tile = _tile_from_means(a, b)
+            _save_tile(path, tile)
+        else:
+            raise KeyError(f"tile {key} indisponível")
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def view(self, level: int, row0: int, col0: int, rows: int, cols: int) -> np.ndarray:
+        """Quantized window ``[row0:row0+rows, col0:col0+cols]`` of ``level``; reads only the tiles it overlaps."""
+        n = self.size(level)
+        rows, cols = max(0, min(rows, n - row0)), max(0, min(cols, n - col0))
+        out = np.zeros((rows, cols), dtype=np.uint8)
+        for i in range(row0 // TILE, -(-(row0 + rows) // TILE)):
+            for j in range(col0 // TILE, -(-(col0 + cols) // TILE)):
+                tile = self.tile(level, i, j)
+                r0, c0 = max(row0, i * TILE), max(col0, j * TILE)
+                r1, c1 = min(row0 + rows, i * TILE + tile.shape[0]), min(col0 + cols, j * TILE + tile.shape[1])
+                out[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = tile[r0 - i * TILE:r1 - i * TILE, c0 - j * TILE:c1 - j * TILE]
+        return out
+
+
+def main(argv=None):
+    from inpi_heatmap.embeddings import EmbeddingStore
+
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.simmatrix", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="ordena as marcas por cluster e gera os tiles pré-calculados")
+    b.add_argument("--store", type=Path, default=EMBEDDINGS_PATH)
+    b.add_argument("--out", type=Path, default=MATRIX_DIR)
+    b.add_argument("--clusters", type=int, default=None, help="número de clusters (padrão: raiz de N)")
+    args = parser.parse_args(argv)
+    meta = build(EmbeddingStore(args.store), args.out, args.clusters)
+    print(json.dumps({**meta, "clusters": len(meta["clusters"]) - 1}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Warm start: caches baked into the image at build time and filled at start.
+
+``build`` runs during ``docker build`` and writes everything that can live on
+disk. That covers the WebP/PNG derivatives, the asset index and the package
+bytecode, so a new replica never re-derives images or compiles modules on its
+first request. It does not run ``derivatives.dedupe``: relinking files that
+an earlier ``COPY`` layer brought in copies each one up into the new layer
+(a bigger image, not a smaller one) and changes the mtimes the baked indexes
+record. Dedupe the data before it is copied in, or on the data volume.
+
+``serve`` starts Streamlit in this same process. ``warm`` runs next to it in a
+thread and fills the process-wide caches that the script runs share:
+
+- it imports the app's modules and opens the indexes;
+- it pages in the ANN vectors and the tokens of the warmed queries;
+- for the first ``INPI_WARM_QUERIES`` queries, it decodes the query image at
+  display size, loads the heat grids and encodes the data URIs the heatmap
+  panel sends.
+
+When ``warm`` finishes it writes ``INPI_READY_FILE`` with its timings. The
+container's health check requires that file in addition to Streamlit's
+``/_stcore/health``, so a replica only takes traffic once it is warm.
+
+    python -m inpi_heatmap.warmup build
+    python -m inpi_heatmap.warmup serve --server.port=8501 --server.headless=true
+    python -m inpi_heatmap.warmup warm          # warm-up alone, prints its timings
+"""
+
+import argparse
+import compileall
+import importlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from inpi_heatmap import metrics
+from inpi_heatmap.config import ANN_INDEX_DIR, APP_DIR, ASSET_INDEX_PATH, DATA_DIR, EMBEDDINGS_PATH
+
+READY_FILE = Path(os.environ.get("INPI_READY_FILE", Path(tempfile.gettempdir()) / "inpi_ready.json"))
+WARM_QUERIES = int(os.environ.get("INPI_WARM_QUERIES", "20"))
+# Imported by the first script run; importing them here overlaps it with server start.
+APP_MODULES = (
+    "numpy",
+    "PIL.Image",
+    "inpi_heatmap.ann",
+    "inpi_heatmap.components",
+    "inpi_heatmap.engine",
+    "inpi_heatmap.jobs",
+    "inpi_heatmap.render",
+    "inpi_heatmap.simmatrix",
+)
+PREFAULT_CHUNK = 8 * 1024 * 1024
+
+
+@contextmanager
+def _step(timings: dict, name: str):
+    t0 = time.perf_counter()
+    with metrics.timed(f"warmup_{name}"):
+        yield
+    timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+def _prefault(path: Path):
+    """Read ``path`` once so its mmap views start out in the page cache."""
+    with open(path, "rb", buffering=0) as f:
+        while f.read(PREFAULT_CHUNK):
+            pass
+
+
+# ---------------------------------------------------------------------------
+# Build time
+# ---------------------------------------------------------------------------
+
+
+def build(data_dir: Path = DATA_DIR) -> dict:
+    """On-disk caches for the image; returns the time of each step (ms)."""
+    from inpi_heatmap import assets, derivatives
+    from inpi_heatmap.manifest_store import open_manifest_store
+
+    data_dir, timings = Path(data_dir), {}
+    with _step(timings, "derivatives"):
+        derivatives.build(data_dir, verbose=False)
+    with _step(timings, "asset_index"):
+        index = assets.build(open_manifest_store(data_dir), data_dir, data_dir / ASSET_INDEX_PATH.name)
+    with _step(timings, "bytecode"):
+        compileall.compile_dir(APP_DIR / "inpi_heatmap", quiet=1)
+    return {"timings": timings, "broken_assets": len(assets.broken(index))}
+
+
+# ---------------------------------------------------------------------------
+# Start time
+# ---------------------------------------------------------------------------
+
+
+def _warm_query(key: str, record: dict, derived, store) -> None:
+    """What ``heatmap_panel`` decodes, loads and encodes for ``key``'s first view."""
+    from inpi_heatmap.components import display_size, image_src
+    from inpi_heatmap.heat import load_heat_grid
+    from inpi_heatmap.image_cache import shared_cache
+    from inpi_heatmap.pyramid import open_pyramid
+    from inpi_heatmap.render import heat_source
+
+    query = DATA_DIR / record["image"]
+    if not query.exists():
+        return
+    outputs = record.get("outputs", {})
+    pyramid = open_pyramid(DATA_DIR / outputs["pyramid"]) if outputs.get("pyramid") else None
+    display = pyramid.preview if pyramid is not None else query
+    size = display_size(display)
+
+    grid_path, overlay_path = heat_source(key, record)
+    if grid_path is not None:
+        load_heat_grid(grid_path)
+        shared_cache().rgba(display, size=size)
+        if derived.entry(query) is None:
+            image_src(display, size)
+    elif overlay_path is not None and (derived.entry(query) is None or derived.entry(overlay_path) is None):
+        image_src(display, size)
+        image_src(overlay_path, size)
+    if outputs.get("neighbor_heat_grid") and (DATA_DIR / outputs["neighbor_heat_grid"]).exists():
+        load_heat_grid(DATA_DIR / outputs["neighbor_heat_grid"])
+
+    # The engine recomputes from these tokens; touching them pages them in.
+    if store is not None and key in store:
+        store.get(key).sum()
+        for nb in record.get("neighbors", []):
+            if nb["target"] in store:
+                store.patches(nb["target"]).sum()
+
+
+def warm(n_queries: int = WARM_QUERIES, workers: int = None) -> dict:
+    """Fill the process-wide caches; returns the time of each step (ms)."""
+    timings = {}
+    with _step(timings, "imports"):
+        for name in APP_MODULES:
+            importlib.import_module(name)
+
+    from inpi_heatmap.assets import AssetIndex
+    from inpi_heatmap.derivatives import DerivativeIndex
+    from inpi_heatmap.embeddings import EmbeddingStore
+    from inpi_heatmap.manifest_store import open_manifest_store
+
+    with _step(timings, "indexes"):
+        manifest = open_manifest_store(DATA_DIR)
+        derived = DerivativeIndex(assets=AssetIndex())
+    store = None
+    with _step(timings, "embeddings"):
+        if EMBEDDINGS_PATH.exists():
+            store = EmbeddingStore(EMBEDDINGS_PATH)
+        for name in ("vectors.npy", "slots.npy"):
+            if (ANN_INDEX_DIR / name).exists():
+                _prefault(ANN_INDEX_DIR / name)
+
+    keys = [k for k, _ in manifest.search("", 0, n_queries)]
+    with _step(timings, "queries"):
+        with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+            # PIL decodes and resizes without the GIL, so the queries warm in parallel.
+            list(pool.map(lambda k: _warm_query(k, manifest.get(k), derived, store), keys))
+    return {"timings": timings, "queries": len(keys)}
+
+
+def write_ready(result: dict, path: Path = READY_FILE):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(result), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _warm_and_mark(t0: float):
+    try:
+        result = {"ready": True, **warm()}
+    except Exception as e:  # a failed warm-up must not keep the replica out of rotation forever
+        result = {"ready": True, "error": f"{type(e).__name__}: {e}"}
+    result["seconds"] = round(time.perf_counter() - t0, 2)
+    write_ready(result)
+    print(f"Aquecimento concluído: {json.dumps(result)}", file=sys.stderr)
+
+
+def serve(streamlit_args: list):
+    """``streamlit run streamlit_app.py`` in this process, with the warm-up running alongside."""
+    from streamlit.web import cli
+
+    READY_FILE.unlink(missing_ok=True)
+    threading.Thread(target=_warm_and_mark, args=(time.perf_counter(),), name="inpi-warmup", daemon=True).start()
+    sys.argv = ["streamlit", "run", str(APP_DIR / "streamlit_app.py"), *streamlit_args]
+    cli.main()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m inpi_heatmap.warmup", description=__doc__.split("\n")[1])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="gera derivados, índice de assets e bytecode (docker build)")
+    b.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    sub.add_parser("serve", help="inicia o Streamlit e aquece os caches em paralelo; demais opções vão ao Streamlit")
+    sub.add_parser("warm", help="só o aquecimento, com os tempos de cada etapa")
+    args, rest = parser.parse_known_args(argv)
+
+    if args.cmd == "serve":
+        serve(rest)
+    elif rest:
+        parser.error(f"argumentos não reconhecidos: {' '.join(rest)}")
+    elif args.cmd == "build":
+        print(json.dumps(build(args.data_dir)))
+    else:
+        t0 = time.perf_counter()
+        result = warm()
+        print(json.dumps({**result, "seconds": round(time.perf_counter() - t0, 2)}))
+
+
+if __name__ == "__main__":
+    main()
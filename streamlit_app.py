@@ -3,16 +3,26 @@
 INPI - MVP: Mapa de Calor
 """
 
-import json
+import html
+import uuid
+import numpy as np
 import streamlit as st
 from pathlib import Path
-from PIL import Image
 
-# ---------------------------------------------------------------------------
-# Paths
-# ---------------------------------------------------------------------------
-DATA_DIR = Path(__file__).parent / "data"
-MANIFEST_PATH = DATA_DIR / "manifest.json"
+from inpi_heatmap import metrics
+from inpi_heatmap.ann import IVFIndex
+from inpi_heatmap.assets import AssetIndex
+from inpi_heatmap.config import ANN_INDEX_DIR, DATA_DIR, EMBEDDINGS_PATH
+from inpi_heatmap.derivatives import DerivativeIndex
+from inpi_heatmap.embeddings import EmbeddingStore
+from inpi_heatmap.engine import DEFAULT_PARAMS, HeatmapEngine, grid_shape
+from inpi_heatmap.components import array_src, blend_paths, display_size, heatmap_blend, image_src
+from inpi_heatmap.heat import JET_LUT, combine_layers, load_heat_grid, overlay_layer, overlay_on
+from inpi_heatmap.jobs import AnalysisPipeline, JobQueue, QueueFullError, make_embedder
+from inpi_heatmap.manifest_store import default_display_name, open_manifest_store
+from inpi_heatmap.pyramid import PREVIEW_WIDTH, open_pyramid
+from inpi_heatmap.render import render_matches, score_color, score_label, shows_fg_heat
+from inpi_heatmap.simmatrix import MATRIX_DIR, SimMatrix, dequantize
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -26,21 +36,27 @@ QUERY_ORDER = [
     "saucony",
 ]
 
-DISPLAY_NAMES = {
-    "input_image": "Bull",
-    "lamborghini": "Lamborghini",
-    "maestro": "Maestro",
-    "mastercard": "Mastercard",
-    "olimpiadas": "Olimp\u00edadas",
-    "saucony": "Saucony",
-    "audi": "Audi",
-    "redbull": "Red Bull",
-    "brooks": "Brooks",
-    "speedo": "Speedo",
-    "cirrus": "Cirrus",
-}
+HOME_NAV = "In\u00edcio"
+UPLOAD_NAV = "Enviar marca"
+MATRIX_NAV = "Matriz de similaridade"
+NAV_PAGE_SIZE = 20
+NEIGHBOR_PAGE_SIZE = 10
 
-USE_FG_AS_HEATMAP = {"olimpiadas"}
+# Rendered widths (CSS px) of the two page columns inside the 1400px container.
+HEATMAP_COLUMN_SIZES = "(max-width: 640px) 100vw, 820px"
+CARD_COLUMN_SIZES = "(max-width: 640px) 100vw, 540px"
+CARD_WIDTH = 540
+HEATMAP_WIDTH = 960
+# Matrix viewport, in matrix pixels, and its on-screen width.
+MATRIX_VIEW = 256
+MATRIX_DISPLAY = 768
+# High-resolution zoom viewport, in pyramid-level pixels.
+ZOOM_VIEW = (768, 512)
+
+BLEND_HELP = (
+    "Mova para a esquerda para ver a imagem original. "
+    "Mova para a direita para destacar as regi\u00f5es similares."
+)
 
 LEGENDS = {
     "input_image": (
@@ -87,38 +103,153 @@ LEGENDS = {
 # ---------------------------------------------------------------------------
 
 
-@st.cache_data
+@st.cache_resource
 def load_manifest():
-    with open(MANIFEST_PATH, encoding="utf-8") as f:
-        return json.load(f)
+    with metrics.timed("load_manifest"):
+        return open_manifest_store(DATA_DIR)
+
+
+@st.cache_resource
+def start_metrics_server():
+    # /metrics on INPI_METRICS_PORT; None unless INPI_METRICS=1.
+    return metrics.start_server()
 
 
+@metrics.instrument("resolve")
 def resolve(path_str: str) -> Path:
     return DATA_DIR / path_str
 
 
-def blend_images(query_path: Path, heatmap_path: Path, alpha: float) -> Image.Image:
-    query = Image.open(query_path).convert("RGBA")
-    heat = Image.open(heatmap_path).convert("RGBA")
-    if heat.size != query.size:
-        heat = heat.resize(query.size, Image.LANCZOS)
-    return Image.blend(query, heat, alpha)
+@st.cache_resource
+def load_derivatives():
+    # Freshness from the asset index's size/mtime, so cards and the heatmap panel do not stat each image.
+    return DerivativeIndex(assets=load_assets())
+
+
+@st.cache_resource
+def load_assets():
+    # Existence checks from data/asset_index.json (``inpi_heatmap.assets``); stats only unindexed paths.
+    return AssetIndex()
+
+
+def exists(path: Path) -> bool:
+    return load_assets().exists(path)
+
+
+def show_image(path: Path, sizes: str = CARD_COLUMN_SIZES):
+    """Lazy, width-matched derivative when built (``inpi_heatmap.derivatives``), else the original."""
+    img = load_derivatives().img_html(path, sizes)
+    if img:
+        st.markdown(img, unsafe_allow_html=True)
+    else:
+        with metrics.timed("st_image"):
+            st.image(str(path), use_column_width=True)
+
+
+def thumbnail_html(path: Path) -> str:
+    """Card-width WebP ``<img>`` of ``path`` for when it has no derivatives; encoded once per file version."""
+    src = image_src(path, display_size(path, CARD_WIDTH), fmt="WEBP")
+    return (
+        f'<img src="{src}" alt="" loading="lazy" decoding="async" '
+        f'style="width:100%;height:auto;display:block;margin-bottom:16px">'
+    )
+
+
+def blend_from_files(query_path: Path, heatmap_path: Path, opacity: float, **kwargs):
+    derived = load_derivatives()
+    base, layer = derived.url(query_path, HEATMAP_WIDTH), derived.url(heatmap_path, HEATMAP_WIDTH)
+    if base and layer:
+        return heatmap_blend(base, layer, opacity, **kwargs)
+    return blend_paths(query_path, heatmap_path, opacity, **kwargs)
+
 
+@st.cache_resource
+def load_embedding_store():
+    if not EMBEDDINGS_PATH.exists():
+        return None
+    return EmbeddingStore(EMBEDDINGS_PATH)
 
-def score_color(v: float) -> str:
-    if v >= 0.7:
-        return "#27ae60"
-    if v >= 0.4:
-        return "#f39c12"
-    return "#e74c3c"
 
+@st.cache_resource
+def load_engine():
+    store = load_embedding_store()
+    return HeatmapEngine(store, manifest=load_manifest()) if store is not None else None
+
+
+@st.cache_resource
+def load_ann_index():
+    if not (ANN_INDEX_DIR / "ids.json").exists():
+        return None
+    return IVFIndex.load(ANN_INDEX_DIR)
+
+
+def find_neighbors(key: str, data: dict) -> list:
+    """Neighbors from the ANN index when available, else the manifest's frozen list."""
+    index = load_ann_index()
+    store = load_embedding_store()
+    if index is None or store is None or key not in store:
+        return data.get("neighbors", [])
+
+    params = data.get("params", {})
+    stored = {nb["target"]: nb for nb in data.get("neighbors", [])}
+    hits = index.search(
+        store.cls(key),
+        k=int(params.get("top_k", 5)),
+        threshold=params.get("cls_threshold", 0.25),
+        exclude=(key,),
+    )
+    return [
+        {
+            "rank": rank,
+            "target": target,
+            "cls_sim": round(sim, 4),
+            "target_image": stored[target]["target_image"] if target in stored else f"images/{target}.png",
+        }
+        for rank, (target, sim) in enumerate(hits, 1)
+    ]
 
-def score_label(v: float) -> str:
-    if v >= 0.7:
-        return "Alta"
-    if v >= 0.4:
-        return "M\u00e9dia"
-    return "Baixa"
+
+@st.cache_resource
+def load_sim_matrix():
+    if not (MATRIX_DIR / "meta.json").exists():
+        return None
+    return SimMatrix(MATRIX_DIR, store=load_embedding_store())
+
+
+@st.cache_resource
+def load_job_queue():
+    # Uploads are throwaway analyses, so they may run on the stub (with a warning) without the model.
+    pipeline = AnalysisPipeline(make_embedder(allow_fallback=True), store=load_embedding_store(), index=load_ann_index())
+    return JobQueue(pipeline, workers=1, max_pending=8, max_per_owner=2)
+
+
+def heat_param_controls(params: dict, key: str) -> dict:
+    params = {**DEFAULT_PARAMS, **params}
+    with st.expander("Par\u00e2metros do mapa de calor"):
+        c1, c2 = st.columns(2)
+        with c1:
+            params["softmax_temp"] = st.select_slider(
+                "Temperatura do softmax",
+                options=[0.01, 0.02, 0.03, 0.05, 0.07, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0],
+                value=params["softmax_temp"],
+                key=f"temp_{key}",
+            )
+            params["cross_topk"] = st.slider("Top-k de patches", 1, 196, int(params["cross_topk"]), key=f"topk_{key}")
+            params["weight_by_cls"] = st.checkbox(
+                "Ponderar pelo score CLS", value=bool(params["weight_by_cls"]), key=f"wcls_{key}"
+            )
+        with c2:
+            params["fg_base_percentile"] = st.slider(
+                "Percentil do foreground", 0, 100, int(params["fg_base_percentile"]), key=f"fgp_{key}"
+            )
+            params["fg_min_patches"], params["fg_max_patches"] = st.slider(
+                "Patches no foreground (m\u00edn / m\u00e1x)",
+                1,
+                196,
+                (int(params["fg_min_patches"]), int(params["fg_max_patches"])),
+                key=f"fgn_{key}",
+            )
+    return params
 
 
 # ---------------------------------------------------------------------------
@@ -163,6 +294,7 @@ st.markdown(
         box-shadow: 0 4px 12px rgba(0,0,0,0.1);
         transform: translateY(-1px);
     }
+    .neighbor-list picture { display: block; margin-bottom: 16px; }
 
     .score-badge {
         display: inline-flex; align-items: center; gap: 6px;
@@ -237,7 +369,13 @@ st.markdown(
 # ---------------------------------------------------------------------------
 # Load data
 # ---------------------------------------------------------------------------
+start_metrics_server()
 manifest = load_manifest()
+# Pick up marks added/removed by ``python -m inpi_heatmap.incremental`` without a restart.
+manifest.refresh()
+for resource in (load_embedding_store(), load_ann_index(), load_derivatives(), load_assets(), load_sim_matrix()):
+    if resource is not None:
+        resource.refresh()
 queries = [q for q in QUERY_ORDER if q in manifest]
 
 # ---------------------------------------------------------------------------
@@ -253,8 +391,26 @@ with st.sidebar:
         unsafe_allow_html=True,
     )
 
-    nav_options = ["In\u00edcio"] + [DISPLAY_NAMES.get(q, q) for q in queries]
-    selected_nav = st.radio("Menu", nav_options, label_visibility="collapsed")
+    search = st.text_input("Buscar marca", placeholder="Buscar marca", label_visibility="collapsed")
+    if search.strip():
+        n_hits = manifest.count(search)
+        n_pages = max(1, -(-n_hits // NAV_PAGE_SIZE))
+        page = 1
+        if n_pages > 1:
+            page = st.number_input(f"P\u00e1gina (de {n_pages})", min_value=1, max_value=n_pages, value=1)
+        hits = manifest.search(search, offset=(page - 1) * NAV_PAGE_SIZE, limit=NAV_PAGE_SIZE)
+        nav_labels = dict(hits)
+        st.caption(f"{n_hits} marca(s) encontrada(s)")
+    else:
+        nav_labels = {q: default_display_name(q) for q in queries}
+
+    nav_options = [HOME_NAV] + list(nav_labels) + [UPLOAD_NAV] + ([MATRIX_NAV] if load_sim_matrix() else [])
+    selected_nav = st.radio(
+        "Menu",
+        nav_options,
+        format_func=lambda k: nav_labels.get(k, k),
+        label_visibility="collapsed",
+    )
 
     st.markdown("---")
 
@@ -284,10 +440,425 @@ with st.sidebar:
         unsafe_allow_html=True,
     )
 
+# ---------------------------------------------------------------------------
+# QUERY PAGE
+# ---------------------------------------------------------------------------
+
+
+def neighbor_card_html(nb: dict) -> str:
+    target_name = default_display_name(nb["target"])
+    sim = nb["cls_sim"]
+    pct = int(sim * 100)
+    color = score_color(sim)
+    label = score_label(sim)
+    return (
+        f'<div class="result-card">'
+        f'<div style="display:flex;justify-content:space-between;'
+        f'align-items:center;margin-bottom:8px">'
+        f'<span style="font-size:16px;font-weight:600;color:#212121">'
+        f"{html.escape(target_name)}</span>"
+        f'<span class="score-badge" style="background:{color}18;'
+        f'color:{color}">{pct}% \u00b7 {label}</span>'
+        f"</div>"
+        f'<div style="background:#f0f1f5;border-radius:6px;height:8px;'
+        f'overflow:hidden">'
+        f'<div style="background:{color};height:100%;width:{pct}%;'
+        f'border-radius:6px"></div>'
+        f"</div>"
+        f"</div>"
+    )
+
+
+def neighbor_layer_controls(key: str, neighbors: list, params: dict, layers, layer_targets: list, heat_grid):
+    """Heat grid for the neighbors picked by the user (all of them: ``heat_grid`` unchanged)."""
+    sims = {nb["target"]: nb["cls_sim"] for nb in neighbors}
+    rows = {t: i for i, t in enumerate(layer_targets) if t in sims and i < len(layers)} if layers is not None else {}
+    if not rows:
+        return heat_grid
+    chosen = st.multiselect(
+        "Marcas similares no mapa de calor",
+        options=list(rows),
+        default=list(rows),
+        format_func=default_display_name,
+        help="Escolha uma marca para ver apenas as regi\u00f5es que correspondem a ela, ou v\u00e1rias para combin\u00e1-las.",
+        key=f"layers_{key}",
+    )
+    if not chosen or set(chosen) == set(rows):
+        return heat_grid
+    weights = [max(sims[t], 0.0) if params.get("weight_by_cls", True) else 1.0 for t in chosen]
+    if sum(weights) <= 0:
+        weights = [1.0] * len(chosen)
+    return combine_layers(layers[[rows[t] for t in chosen]], weights)
+
+
+@st.fragment
+def zoom_viewer(key: str, pyramid, heat_grid, p_low: int, p_high: int):
+    # Own fragment: zooming and panning decode and colorize only the tiles in view.
+    if not st.toggle(
+        "Ampliar em alta resolu\u00e7\u00e3o",
+        help="Mostra detalhes da imagem enviada na resolu\u00e7\u00e3o original.",
+        key=f"zoom_{key}",
+    ):
+        return
+    # Default: the first level that no longer fits in the viewport.
+    default = next((lv for lv in reversed(range(pyramid.levels)) if pyramid.size(lv)[0] > ZOOM_VIEW[0]), 0)
+    level = st.select_slider(
+        "Zoom",
+        options=list(range(pyramid.levels - 1, -1, -1)),
+        value=default,
+        format_func=lambda lv: f"{100 / 2**lv:g}%",
+        key=f"zoom_level_{key}",
+    )
+    c1, c2 = st.columns(2)
+    with c1:
+        cx = st.slider("Horizontal", 0, 100, 50, format="%d%%", key=f"zoom_x_{key}")
+    with c2:
+        cy = st.slider("Vertical", 0, 100, 50, format="%d%%", key=f"zoom_y_{key}")
+
+    size = pyramid.size(level)
+    x0, y0, x1, y1 = box = pyramid.viewport(level, (cx / 100, cy / 100), ZOOM_VIEW)
+    with metrics.timed("zoom_view"):
+        base = pyramid.region(level, box)
+        layer = overlay_on(base, heat_grid, p_low, p_high, size, box)
+    s = 2**level
+    heatmap_blend(
+        array_src(base),
+        array_src(layer, "JPEG"),
+        0.45,
+        help=BLEND_HELP,
+        caption=(
+            f"Pixels {x0 * s}\u2013{min(x1 * s, pyramid.width)} \u00d7 {y0 * s}\u2013{min(y1 * s, pyramid.height)} "
+            f"do original ({pyramid.width}\u00d7{pyramid.height})."
+        ),
+        key=f"zoom_blend_{key}",
+    )
+
+
+@st.fragment
+def heatmap_panel(selected_key: str, data: dict, display_name: str, neighbors: list):
+    # Own fragment: the window/parameter sliders rerun only this column.
+    outputs = data.get("outputs", {})
+    query_img_path = resolve(data["image"])
+
+    # The stored grids belong to the record's own neighbor list.
+    if shows_fg_heat(selected_key, data.get("neighbors")):
+        heatmap_path = resolve(outputs.get("fg_overlay", outputs.get("final_overlay", "")))
+        heat_grid = outputs.get("fg_heat_grid")
+    else:
+        heatmap_path = resolve(outputs.get("final_overlay", ""))
+        heat_grid = outputs.get("final_heat_grid")
+    heat_grid_path = resolve(heat_grid) if heat_grid else None
+    # Print-resolution uploads: the page uses the pyramid preview, never the original.
+    pyramid = open_pyramid(resolve(outputs["pyramid"])) if outputs.get("pyramid") else None
+    display_path = pyramid.preview if pyramid is not None else query_img_path
+
+    st.markdown(
+        '<div class="section-header">Mapa de Calor da Marca</div>',
+        unsafe_allow_html=True,
+    )
+    st.markdown('<div class="query-panel">', unsafe_allow_html=True)
+
+    params = data.get("params", {})
+    heat_grid = None
+    layers, layer_targets = None, []
+    engine = load_engine()
+    if engine is not None and engine.can_compute(selected_key, neighbors):
+        # Recomputed from the stored embeddings with the chosen parameters.
+        params = heat_param_controls(params, selected_key)
+        result = engine.compute(selected_key, neighbors, params)
+        heat_grid = result["fg_heat" if shows_fg_heat(selected_key, neighbors) else "final_heat"]
+        layers, layer_targets = result["neighbor_heat"], [nb["target"] for nb in neighbors]
+    else:
+        if heat_grid_path and exists(heat_grid_path):
+            heat_grid = load_heat_grid(heat_grid_path)
+        layers_path = resolve(outputs["neighbor_heat_grid"]) if outputs.get("neighbor_heat_grid") else None
+        if layers_path and exists(layers_path):
+            layers, layer_targets = load_heat_grid(layers_path), outputs.get("neighbor_heat_targets", [])
+
+    heat_grid = neighbor_layer_controls(selected_key, neighbors, params, layers, layer_targets, heat_grid)
+
+    if exists(query_img_path) and heat_grid is not None:
+        # Raw heat grid: the percentile window is applied at render time.
+        p_low, p_high = st.slider(
+            "Janela do mapa de calor (percentis)",
+            min_value=0,
+            max_value=100,
+            value=(int(params.get("vis_p_low", 85)), int(params.get("vis_p_high", 99))),
+            help="Percentis do score usados como azul (in\u00edcio) e vermelho (fim) do mapa de calor.",
+            key=f"window_{selected_key}",
+        )
+        size = display_size(display_path)
+        layer = overlay_layer(display_path, heat_grid, size, p_low, p_high)
+        # Blended in the browser: the opacity slider lives inside the component.
+        heatmap_blend(
+            load_derivatives().url(query_img_path, HEATMAP_WIDTH) or image_src(display_path, size),
+            array_src(layer, "JPEG"),
+            0.45,
+            help=BLEND_HELP,
+            key=f"blend_{selected_key}",
+        )
+        if pyramid is not None and max(pyramid.width, pyramid.height) > PREVIEW_WIDTH:
+            zoom_viewer(selected_key, pyramid, heat_grid, p_low, p_high)
+    elif exists(query_img_path) and exists(heatmap_path):
+        blend_from_files(display_path, heatmap_path, 0.45, help=BLEND_HELP, key=f"blend_{selected_key}")
+    else:
+        show_image(display_path, HEATMAP_COLUMN_SIZES)
+
+    st.markdown(
+        f'<p style="text-align:center;font-size:18px;font-weight:600;'
+        f'color:#1a237e;margin-top:8px">{html.escape(display_name)}</p>',
+        unsafe_allow_html=True,
+    )
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
+@st.fragment
+def neighbor_panel(selected_key: str, data: dict, neighbors: list):
+    # Own fragment: paging reruns only this column. One page of cards is sent
+    # as a single element; images are lazy <img> tags, of the derivatives when
+    # they exist and of a cached card-width thumbnail otherwise.
+    engine = load_engine()
+    matches = None
+    if engine is not None and engine.can_compute(selected_key, neighbors):
+        c1, c2 = st.columns([3, 2])
+        with c1:
+            show_matches = st.toggle(
+                "Correspond\u00eancias entre patches",
+                help="Liga cada regi\u00e3o da marca consultada \u00e0 regi\u00e3o mais parecida de cada marca similar.",
+                key=f"matches_{selected_key}",
+            )
+        if show_matches:
+            with c2:
+                k = st.slider("Linhas por marca", 3, 40, 12, key=f"matches_k_{selected_key}")
+            # All neighbors in one batch (cached per pair), so paging is free afterwards.
+            matches = engine.matches(selected_key, neighbors, k, data.get("params", {}))
+
+    n_pages = -(-len(neighbors) // NEIGHBOR_PAGE_SIZE)
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(
+            f"P\u00e1gina (de {n_pages})", min_value=1, max_value=n_pages, value=1, key=f"nb_page_{selected_key}"
+        )
+    first = (page - 1) * NEIGHBOR_PAGE_SIZE
+    shown = neighbors[first : first + NEIGHBOR_PAGE_SIZE]
+    if n_pages > 1:
+        st.caption(f"{first + 1}\u2013{first + len(shown)} de {len(neighbors)}")
+
+    def flush(cards: list):
+        if cards:
+            st.markdown('<div class="neighbor-list">' + "".join(cards) + "</div>", unsafe_allow_html=True)
+
+    with metrics.timed("neighbor_cards"):
+        cards = []
+        for nb in shown:
+            cards.append(neighbor_card_html(nb))
+            target_img = resolve(nb["target_image"])
+            if not exists(target_img):
+                continue
+            if matches is not None:
+                flush(cards)
+                cards = []
+                grid = grid_shape(engine.store.patches(nb["target"]).shape[0])
+                st.image(render_matches(resolve(data["image"]), target_img, matches[nb["target"]], grid), use_column_width=True)
+                continue
+            cards.append(load_derivatives().img_html(target_img, CARD_COLUMN_SIZES) or thumbnail_html(target_img))
+        flush(cards)
+
+
+def render_query_page(selected_key: str, data: dict, display_name: str):
+    neighbors = find_neighbors(selected_key, data)
+
+    # Header
+    st.markdown(
+        f'<h2 style="color:#1a237e;margin-bottom:2px">'
+        f"An\u00e1lise: {html.escape(display_name)}</h2>"
+        f'<p style="color:#757575;font-size:15px">'
+        f"{len(neighbors)} marca(s) similar(es) encontrada(s)</p>",
+        unsafe_allow_html=True,
+    )
+
+    legend_text = LEGENDS.get(selected_key, "")
+    if legend_text:
+        st.markdown(f'<div class="legend-box">{legend_text}</div>', unsafe_allow_html=True)
+
+    # Two-column layout
+    col_left, col_right = st.columns([3, 2], gap="large")
+
+    with col_left:
+        heatmap_panel(selected_key, data, display_name, neighbors)
+
+    with col_right:
+        st.markdown(
+            f'<div class="section-header">Marcas Similares ({len(neighbors)})</div>',
+            unsafe_allow_html=True,
+        )
+
+        if not neighbors:
+            st.info("Nenhuma marca similar encontrada acima do limite m\u00ednimo.")
+            return
+        neighbor_panel(selected_key, data, neighbors)
+
+
+# ---------------------------------------------------------------------------
+# UPLOAD PAGE
+# ---------------------------------------------------------------------------
+
+
+def upload_status(owner: str):
+    for job in reversed(load_job_queue().jobs_for(owner)):
+        if job.status == "error":
+            st.error(f"{job.name}: {job.error}")
+            continue
+        st.progress(job.progress, text=f"{job.name} \u2014 {job.stage}")
+        if job.status == "done" and st.button("Abrir an\u00e1lise", key=f"open_{job.id}"):
+            st.session_state["upload_view"] = job.id
+            st.rerun()
+
+
+@st.fragment(run_every=1.0)
+def upload_status_live(owner: str):
+    # Polls the job queue on its own, and only while this owner has jobs
+    # running: once they finish, a full rerun swaps in the static list.
+    upload_status(owner)
+    if not any(job.active for job in load_job_queue().jobs_for(owner)):
+        st.rerun()
+
+
+def render_upload_page():
+    st.markdown(
+        '<h2 style="color:#1a237e;margin-bottom:2px">Enviar nova marca</h2>'
+        '<p style="color:#757575;font-size:15px">A an\u00e1lise roda em segundo plano; '
+        "voc\u00ea pode continuar navegando enquanto ela \u00e9 processada.</p>",
+        unsafe_allow_html=True,
+    )
+    try:
+        job_queue = load_job_queue()
+    except (RuntimeError, ValueError) as e:
+        st.warning(f"An\u00e1lise de novas marcas indispon\u00edvel: {e}")
+        return
+    fallback = getattr(job_queue.pipeline.embedder, "fallback", None)
+    if fallback:
+        st.warning(
+            f"Modelo DINOv3 indispon\u00edvel ({fallback}). As an\u00e1lises usam o embedder de "
+            "demonstra\u00e7\u00e3o, e os resultados n\u00e3o refletem a similaridade real. "
+            "Defina INPI_EMBEDDER=dinov3 para exigir o modelo."
+        )
+
+    owner = st.session_state.setdefault("upload_owner", uuid.uuid4().hex)
+    with st.form("upload_form", clear_on_submit=True):
+        name = st.text_input("Nome da marca")
+        upload = st.file_uploader("Imagem da marca", type=["png", "jpg", "jpeg", "webp"])
+        submitted = st.form_submit_button("Analisar")
+    if submitted and upload is not None:
+        try:
+            job_queue.submit(name or Path(upload.name).stem, upload.getvalue(), owner=owner)
+        except QueueFullError as e:
+            st.error(str(e))
+
+    if any(job.active for job in job_queue.jobs_for(owner)):
+        upload_status_live(owner)
+    else:
+        upload_status(owner)
+
+    job = job_queue.get(st.session_state.get("upload_view", ""))
+    if job is not None and job.result is not None:
+        st.markdown("---")
+        render_query_page(f"upload_{job.id}", job.result, job.name)
+
+
+# ---------------------------------------------------------------------------
+# MATRIX PAGE
+# ---------------------------------------------------------------------------
+
+
+def colorize_matrix(tile: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    norm = np.clip((dequantize(tile) - lo) / max(hi - lo, 1e-6), 0.0, 1.0)
+    rgb = JET_LUT[np.nan_to_num(norm * 255, nan=0).astype(np.uint8)]
+    rgb[tile == 0] = 240
+    return rgb
+
+
+@st.fragment
+def matrix_explorer(matrix: SimMatrix):
+    # Own fragment: zooming and panning only redraw the visible tiles.
+    levels = list(range(matrix.levels - 1, matrix.min_level - 1, -1))
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        level = st.select_slider(
+            "Zoom",
+            options=levels,
+            value=levels[0],
+            format_func=lambda lv: f"1 px = {2**lv}\u00d7{2**lv} pares" if lv else "1 px = 1 par",
+        )
+    with c2:
+        lo, hi = st.slider("Faixa de similaridade", -1.0, 1.0, (0.0, 1.0), step=0.05)
+
+    n = matrix.size(level)
+    limit = max(0, n - MATRIX_VIEW)
+    center = st.text_input("Centralizar em uma marca", placeholder="ex.: mastercard")
+    start = 0
+    if center.strip():
+        pos = matrix.position.get(center.strip())
+        if pos is None:
+            st.caption("Marca n\u00e3o encontrada na matriz.")
+        else:
+            start = min(max(pos // 2**level - MATRIX_VIEW // 2, 0), limit)
+    row0 = col0 = start
+    if limit:
+        c1, c2 = st.columns(2)
+        with c1:
+            row0 = st.slider("Linhas", 0, limit, start, key=f"mx_row_{level}_{center}")
+        with c2:
+            col0 = st.slider("Colunas", 0, limit, start, key=f"mx_col_{level}_{center}")
+
+    with metrics.timed("matrix_view"):
+        tile = matrix.view(level, row0, col0, MATRIX_VIEW, MATRIX_VIEW)
+    scale = max(1, MATRIX_DISPLAY // max(tile.shape))
+    st.image(np.kron(colorize_matrix(tile, lo, hi), np.ones((scale, scale, 1), dtype=np.uint8)))
+    span = 2**level
+    st.caption(
+        f"Linhas {row0 * span + 1}\u2013{min((row0 + tile.shape[0]) * span, matrix.meta['n'])}, "
+        f"colunas {col0 * span + 1}\u2013{min((col0 + tile.shape[1]) * span, matrix.meta['n'])} "
+        f"de {matrix.meta['n']} marcas (ordem por cluster)."
+    )
+    if level == 0 and max(tile.shape) <= 40:
+        rows = matrix.ids[row0:row0 + tile.shape[0]]
+        cols = matrix.ids[col0:col0 + tile.shape[1]]
+        values = np.round(dequantize(tile), 2)
+        st.dataframe(
+            [
+                {"": default_display_name(r), **{default_display_name(c): float(values[a, b]) for b, c in enumerate(cols)}}
+                for a, r in enumerate(rows)
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def render_matrix_page():
+    matrix = load_sim_matrix()
+    meta = matrix.meta
+    st.markdown(
+        '<h2 style="color:#1a237e;margin-bottom:2px">Matriz de similaridade</h2>'
+        f'<p style="color:#757575;font-size:15px">Similaridade CLS entre todos os pares de {meta["n"]} marcas, '
+        f'agrupadas em {len(meta["clusters"]) - 1} clusters. Blocos claros na diagonal s\u00e3o grupos de marcas parecidas.</p>',
+        unsafe_allow_html=True,
+    )
+    store = load_embedding_store()
+    if store is not None and store.count != meta["store_count"]:
+        st.info(
+            "A base mudou desde que a matriz foi gerada. Marcas novas s\u00f3 aparecem depois de "
+            "`python -m inpi_heatmap.simmatrix build`."
+        )
+    matrix_explorer(matrix)
+
+
 # ---------------------------------------------------------------------------
 # HOME PAGE
 # ---------------------------------------------------------------------------
-if selected_nav == "In\u00edcio":
+
+
+def render_home_page():
     st.markdown(
         """
     <div class="home-hero">
@@ -395,9 +966,15 @@ if selected_nav == "In\u00edcio":
         with ex_col1:
             mc_query = resolve(mc_data["image"])
             mc_heat = resolve(mc_outputs["final_overlay"])
-            if mc_query.exists() and mc_heat.exists():
-                blended = blend_images(mc_query, mc_heat, 0.45)
-                st.image(blended, use_column_width=True, caption="Mastercard \u2014 Mapa de calor com intensidade 45%")
+            if exists(mc_query) and exists(mc_heat):
+                blend_from_files(
+                    mc_query,
+                    mc_heat,
+                    0.45,
+                    caption="Mastercard \u2014 Mapa de calor com intensidade 45%",
+                    show_slider=False,
+                    key="home_blend",
+                )
 
         with ex_col2:
             st.markdown(
@@ -407,26 +984,10 @@ if selected_nav == "In\u00edcio":
                 unsafe_allow_html=True,
             )
             for nb in mc_neighbors:
-                tname = DISPLAY_NAMES.get(nb["target"], nb["target"].replace("_", " ").title())
-                pct = int(nb["cls_sim"] * 100)
-                color = score_color(nb["cls_sim"])
-                lbl = score_label(nb["cls_sim"])
-                st.markdown(
-                    f'<div class="result-card">'
-                    f'<div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:8px">'
-                    f'<span style="font-size:16px;font-weight:600;color:#212121">{tname}</span>'
-                    f'<span class="score-badge" style="background:{color}18;color:{color}">'
-                    f"{pct}% \u00b7 {lbl}</span>"
-                    f"</div>"
-                    f'<div style="background:#f0f1f5;border-radius:6px;height:8px;overflow:hidden">'
-                    f'<div style="background:{color};height:100%;width:{pct}%;border-radius:6px"></div>'
-                    f"</div>"
-                    f"</div>",
-                    unsafe_allow_html=True,
-                )
+                st.markdown(neighbor_card_html(nb), unsafe_allow_html=True)
                 t_img = resolve(nb["target_image"])
-                if t_img.exists():
-                    st.image(str(t_img), use_column_width=True)
+                if exists(t_img):
+                    show_image(t_img)
 
     st.markdown("")
 
@@ -439,106 +1000,43 @@ if selected_nav == "In\u00edcio":
         unsafe_allow_html=True,
     )
 
-# ---------------------------------------------------------------------------
-# QUERY PAGE
-# ---------------------------------------------------------------------------
-else:
-    selected_key = queries[nav_options.index(selected_nav) - 1]
-    data = manifest[selected_key]
-    neighbors = data.get("neighbors", [])
-    outputs = data.get("outputs", {})
-    display_name = DISPLAY_NAMES.get(selected_key, selected_key)
-
-    query_img_path = resolve(data["image"])
-
-    if selected_key in USE_FG_AS_HEATMAP:
-        heatmap_path = resolve(outputs.get("fg_overlay", outputs.get("final_overlay", "")))
-    else:
-        heatmap_path = resolve(outputs.get("final_overlay", ""))
-
-    # Header
-    st.markdown(
-        f'<h2 style="color:#1a237e;margin-bottom:2px">'
-        f"An\u00e1lise: {display_name}</h2>"
-        f'<p style="color:#757575;font-size:15px">'
-        f"{len(neighbors)} marca(s) similar(es) encontrada(s)</p>",
-        unsafe_allow_html=True,
-    )
-
-    legend_text = LEGENDS.get(selected_key, "")
-    if legend_text:
-        st.markdown(f'<div class="legend-box">{legend_text}</div>', unsafe_allow_html=True)
-
-    # Two-column layout
-    col_left, col_right = st.columns([3, 2], gap="large")
 
-    with col_left:
-        st.markdown(
-            '<div class="section-header">Mapa de Calor da Marca</div>',
-            unsafe_allow_html=True,
-        )
-        st.markdown('<div class="query-panel">', unsafe_allow_html=True)
-
-        opacity = st.slider(
-            "Intensidade do mapa de calor",
-            min_value=0.0,
-            max_value=1.0,
-            value=0.45,
-            step=0.05,
-            help="Mova para a esquerda para ver a imagem original. "
-            "Mova para a direita para destacar as regi\u00f5es similares.",
+def show_trace(spans: list):
+    with st.expander(f"Trace ({spans[-1]['ms']:.0f} ms)", expanded=True):
+        st.dataframe(
+            [
+                {"fase": "\u00a0\u00a0" * sp["depth"] + sp["phase"], "in\u00edcio (ms)": round(sp["start_ms"], 1), "dura\u00e7\u00e3o (ms)": round(sp["ms"], 1)}
+                for sp in sorted(spans[1:], key=lambda sp: sp["start_ms"])
+            ],
+            use_container_width=True,
+            hide_index=True,
         )
 
-        if query_img_path.exists() and heatmap_path.exists():
-            blended = blend_images(query_img_path, heatmap_path, opacity)
-            st.image(blended, use_column_width=True)
-        else:
-            st.image(str(query_img_path), use_column_width=True)
 
-        st.markdown(
-            f'<p style="text-align:center;font-size:18px;font-weight:600;'
-            f'color:#1a237e;margin-top:8px">{display_name}</p>',
-            unsafe_allow_html=True,
-        )
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with col_right:
-        st.markdown(
-            f'<div class="section-header">Marcas Similares ({len(neighbors)})</div>',
-            unsafe_allow_html=True,
-        )
+# ---------------------------------------------------------------------------
+# Routing
+# ---------------------------------------------------------------------------
+if selected_nav == HOME_NAV:
+    page = "home"
+elif selected_nav == UPLOAD_NAV:
+    page = "upload"
+elif selected_nav == MATRIX_NAV:
+    page = "matrix"
+else:
+    selected_record = manifest.get(selected_nav)
+    # Removed by an incremental update since the sidebar was built: back to home.
+    page = "query" if selected_record is not None else "home"
 
-        if not neighbors:
-            st.info("Nenhuma marca similar encontrada acima do limite m\u00ednimo.")
-        else:
-            for nb in neighbors:
-                target_name = DISPLAY_NAMES.get(
-                    nb["target"],
-                    nb["target"].replace("_", " ").title(),
-                )
-                sim = nb["cls_sim"]
-                pct = int(sim * 100)
-                color = score_color(sim)
-                label = score_label(sim)
-
-                st.markdown(
-                    f'<div class="result-card">'
-                    f'<div style="display:flex;justify-content:space-between;'
-                    f'align-items:center;margin-bottom:8px">'
-                    f'<span style="font-size:16px;font-weight:600;color:#212121">'
-                    f"{target_name}</span>"
-                    f'<span class="score-badge" style="background:{color}18;'
-                    f'color:{color}">{pct}% \u00b7 {label}</span>'
-                    f"</div>"
-                    f'<div style="background:#f0f1f5;border-radius:6px;height:8px;'
-                    f'overflow:hidden">'
-                    f'<div style="background:{color};height:100%;width:{pct}%;'
-                    f'border-radius:6px"></div>'
-                    f"</div>"
-                    f"</div>",
-                    unsafe_allow_html=True,
-                )
+# ?trace=1 shows this run's phase timings (requires INPI_METRICS=1).
+with metrics.tracing(f"page_{page}", enabled=st.query_params.get("trace") == "1") as spans:
+    if page == "home":
+        render_home_page()
+    elif page == "upload":
+        render_upload_page()
+    elif page == "matrix":
+        render_matrix_page()
+    else:
+        render_query_page(selected_nav, selected_record, default_display_name(selected_nav))
 
-                target_img = resolve(nb["target_image"])
-                if target_img.exists():
-                    st.image(str(target_img), use_column_width=True)
+if len(spans) > 1 and st.query_params.get("trace") == "1":
+    show_trace(spans)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""IVF index against exact search."""
+
+import numpy as np
+
+from inpi_heatmap.ann import IVFIndex, exact_search
+
+
+def _vectors(n: int = 400, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float16)
+
+
+def test_exact_search_blocks_match_one_pass():
+    vectors, q = _vectors(), np.ones(16, dtype=np.float32)
+    unit = vectors.astype(np.float32) / np.linalg.norm(vectors.astype(np.float32), axis=1, keepdims=True)
+    expected = np.argsort(-(unit @ (q / np.linalg.norm(q))))[:7]
+    slots, sims = exact_search(vectors, q, 7, block=64)
+    assert list(slots) == list(expected)
+    assert np.all(np.diff(sims) <= 0)
+    assert len(exact_search(vectors[:0], q, 3)[0]) == 0
+
+
+def test_recall_skips_removed_marks():
+    vectors = _vectors()
+    ids = [f"m{i}" for i in range(len(vectors))]
+    ids[::3] = [None] * len(ids[::3])
+    index = IVFIndex.build(ids, vectors, nlist=4, nprobe=4)
+    index.remove(["m1", "m2"])
+    stats = index.recall(vectors, k=5, n_queries=50)
+    # Every cell is probed, so the index is exact once removed marks are left out.
+    assert stats["recall"] == 1.0
+    assert stats["queries"] == 50
+
+
+def test_add_replaces_instead_of_duplicating():
+    vectors = _vectors()
+    ids = [f"m{i}" for i in range(len(vectors))]
+    index = IVFIndex.build(ids, vectors, nlist=4, nprobe=4)
+    q = vectors[5].astype(np.float32)
+    index.remove(["m5"])
+    index.add(["m5"], -q[None])  # re-added with a new embedding
+    index.add(["m5"], q[None])
+    index.add(["late"], q[None] + 0.01)
+    assert index.extra_ids == ["m5", "late"]
+    hits = index.search(q, k=10)
+    assert [m for m, _ in hits].count("m5") == 1
+    assert {m for m, _ in hits[:2]} == {"m5", "late"}
+
+
+def test_search_fills_k_past_exclusions():
+    vectors = _vectors()
+    ids = [f"m{i}" for i in range(len(vectors))]
+    ids[::7] = [None] * len(ids[::7])
+    index = IVFIndex.build(ids, vectors, nlist=4, nprobe=4)
+    q = vectors[1].astype(np.float32)
+    exact, _ = exact_search(vectors, q, len(vectors))
+    ranked = [ids[s] for s in exact if ids[s] is not None]
+    index.remove(ranked[:10])
+    hits = index.search(q, k=8, exclude=ranked[10:15] + ranked[:3] + ["not-indexed"])
+    assert [m for m, _ in hits] == ranked[15:23]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Status codes of the read-only API on the demo data."""
+
+import http.client
+import json
+import shutil
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from inpi_heatmap.api import MAX_BODY, make_server
+from inpi_heatmap.config import APP_DIR
+
+
+@pytest.fixture
+def server():
+    server = make_server("127.0.0.1", 0, APP_DIR / "data")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, path: str, body: bytes):
+    req = urllib.request.Request(f"http://127.0.0.1:{server.server_port}{path}", data=body, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_batch(server):
+    status, payload = _post(server, "/v1/queries/batch", json.dumps({"ids": ["maestro", "nope"]}).encode())
+    assert status == 200
+    assert "maestro" in json.dumps(payload)
+
+
+@pytest.mark.parametrize("body", [b"[1]", b'"ids"', b"3", b'{"ids": [1]}', b'{"ids": "maestro"}', b"{"])
+def test_batch_rejects_malformed_bodies(server, body):
+    status, payload = _post(server, "/v1/queries/batch", body)
+    assert status == 400 and "error" in payload
+
+
+def test_unexpected_errors_are_answered(server, monkeypatch):
+    def boom(ids):
+        raise TypeError("boom")
+
+    monkeypatch.setattr(server.RequestHandlerClass.api, "batch", boom)
+    status, payload = _post(server, "/v1/queries/batch", b'{"ids": ["maestro"]}')
+    assert status == 500 and payload["error"] == "erro interno: TypeError"
+
+
+@pytest.mark.parametrize("path", ["/v1/nope", "/v1/queries/maestro"])
+def test_unread_bodies_keep_the_connection_in_sync(server, path):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+    try:
+        conn.request("POST", path, body=json.dumps({"ids": ["maestro"] * 200}).encode())
+        resp = conn.getresponse()
+        assert resp.status in (404, 405) and "error" in json.loads(resp.read())
+        conn.request("GET", "/healthz")
+        resp = conn.getresponse()
+        assert resp.status == 200 and json.loads(resp.read())["ok"]
+    finally:
+        conn.close()
+
+
+def test_oversized_body_closes_the_connection(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+    try:
+        conn.putrequest("POST", "/v1/queries/batch")
+        conn.putheader("Content-Length", str(MAX_BODY + 1))
+        conn.endheaders()
+        resp = conn.getresponse()
+        assert resp.status == 413 and resp.getheader("Connection") == "close"
+    finally:
+        conn.close()
+
+
+def test_overlay_reads_the_api_data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    shutil.copytree(APP_DIR / "data", data_dir)
+    manifest_path = data_dir / "manifest.json"
+    records = json.loads(manifest_path.read_text(encoding="utf-8"))
+    shutil.copy(data_dir / records["maestro"]["image"], data_dir / "images" / "only_here.png")
+    records["only_here"] = {**records["maestro"], "image": "images/only_here.png"}
+    manifest_path.write_text(json.dumps(records), encoding="utf-8")
+
+    server = make_server("127.0.0.1", 0, data_dir)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/v1/queries/only_here/overlay.png"
+        with urllib.request.urlopen(url, timeout=30) as resp:
+            assert resp.status == 200 and resp.read().startswith(b"\x89PNG")
+    finally:
+        server.shutdown()
+        server.server_close()
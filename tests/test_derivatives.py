@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Derivative sources and lookups."""
+
+from PIL import Image
+
+from inpi_heatmap import derivatives, pyramid
+
+
+def test_pyramid_tiles_are_not_sources(tmp_path):
+    upload = tmp_path / "outputs" / "uploads" / "abc"
+    upload.mkdir(parents=True)
+    Image.new("RGB", (1300, 700), "red").save(upload / "query.png")
+    pyramid.build(upload / "query.png", upload / pyramid.DIR_NAME)
+    assert any((upload / pyramid.DIR_NAME).glob("L*/*.png"))
+
+    sources = [p.relative_to(tmp_path).as_posix() for p in derivatives._sources(tmp_path)]
+    assert sources == ["outputs/uploads/abc/query.png"]
+
+
+def test_stale_entries_are_ignored(tmp_path):
+    data, out = tmp_path / "data", tmp_path / "derived"
+    (data / "images").mkdir(parents=True)
+    Image.new("RGB", (200, 100), "blue").save(data / "images" / "a.png")
+    derivatives.build(data, out, verbose=False)
+    index = derivatives.DerivativeIndex(out, data)
+    assert index.url(data / "images" / "a.png", 160).endswith("_160.webp")
+
+    Image.new("RGB", (300, 100), "green").save(data / "images" / "a.png")
+    assert index.entry(data / "images" / "a.png") is None
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""EmbeddingStore writes: contents survive, and the file does not grow with every index rewrite."""
+
+import numpy as np
+
+from inpi_heatmap.embeddings import HEADER_SIZE, EmbeddingStore
+
+
+def _tokens(n: int, seed: int, tokens: int = 5, dim: int = 8) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, tokens, dim)).astype(np.float32)
+
+
+def test_writes_keep_the_file_compact(tmp_path):
+    path = tmp_path / "embeddings.bin"
+    store = EmbeddingStore.create(path, dim=8, n_patches=4)
+    for i in range(20):
+        store.extend([f"mark_{i}"], _tokens(1, i))
+    for i in range(0, 20, 2):
+        store.remove(f"mark_{i}")
+    store.extend(["late"], _tokens(1, 99))
+
+    index_len = len(path.read_bytes()) - HEADER_SIZE - store.count * store.record_size
+    assert index_len < 2 * len(repr(store.ids))
+    reopened = EmbeddingStore(path)
+    assert reopened.ids == store.ids
+    assert len(reopened) == 11
+    np.testing.assert_allclose(reopened.get("mark_7"), _tokens(1, 7)[0], atol=1e-2)
+    np.testing.assert_allclose(reopened.get("late"), _tokens(1, 99)[0], atol=1e-2)
+
+
+def test_int8_store_roundtrip(tmp_path):
+    store = EmbeddingStore.create(tmp_path / "e.bin", dim=8, n_patches=4, dtype="int8")
+    tokens = _tokens(3, 1)
+    store.extend(["a", "b", "c"], tokens)
+    store.remove("b")
+    reopened = EmbeddingStore(tmp_path / "e.bin")
+    assert "b" not in reopened and reopened.ids == ["a", None, "c"]
+    np.testing.assert_allclose(reopened.get("c"), tokens[2], atol=0.05)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""HeatmapEngine caching across incremental store and manifest writes."""
+
+import numpy as np
+
+from inpi_heatmap.embeddings import EmbeddingStore
+from inpi_heatmap.engine import HeatmapEngine
+from inpi_heatmap.manifest_store import JsonManifestStore
+
+NEIGHBORS = [{"target": "b", "cls_sim": 0.5}, {"target": "c", "cls_sim": 0.4}]
+
+
+def _tokens(n: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, 1 + 196, 16)).astype(np.float32)
+
+
+def test_results_are_cached_until_the_data_changes(tmp_path):
+    store = EmbeddingStore.create(tmp_path / "embeddings.bin", dim=16, n_patches=196)
+    store.extend(["a", "b", "c"], _tokens(3, 0))
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text("{}", encoding="utf-8")
+    manifest = JsonManifestStore(manifest_path)
+    engine = HeatmapEngine(store, manifest=manifest)
+
+    first = engine.compute("a", NEIGHBORS, {})
+    assert engine.compute("a", NEIGHBORS, {}) is first and engine.hits == 1
+    first_matches = engine.matches("a", NEIGHBORS, 3, {})
+    assert engine.matches("a", NEIGHBORS, 3, {}) == first_matches
+
+    # "b" re-embedded under the same id: same key, neighbors and scores, new tokens.
+    store.remove("b")
+    store.append("b", _tokens(1, 1)[0])
+    second = engine.compute("a", NEIGHBORS, {})
+    assert second is not first
+    assert not np.allclose(second["final_heat"], first["final_heat"], equal_nan=True)
+    assert engine.matches("a", NEIGHBORS, 3, {})["b"][2].tolist() != first_matches["b"][2].tolist()
+
+    manifest.put_many({"a": {"neighbors": NEIGHBORS}})
+    assert engine.compute("a", NEIGHBORS, {}) is not second
+    assert engine.misses == 3
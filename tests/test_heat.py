@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Windowed colorization against the full-size resize."""
+
+import numpy as np
+import pytest
+
+from inpi_heatmap.heat import colorize, window
+
+SIZES = [(3000, 2000), (1200, 800), (777, 1333), (40, 40), (9, 7)]
+
+
+def _grid(seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    gh, gw = rng.integers(5, 30, size=2)
+    grid = rng.random((gh, gw)).astype(np.float32)
+    grid[rng.random(grid.shape) < 0.3] = np.nan
+    return grid
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("seed", range(3))
+def test_box_matches_full_resize(size, seed):
+    norm, _, _ = window(_grid(seed), 85, 99)
+    full_rgb, full_mask = (np.asarray(im) for im in colorize(norm, size))
+    w, h = size
+    for box in [(0, 0, min(w, 512), min(h, 512)), (w // 3, h // 5, w - w // 4, h - 1), (w - 5, h - 3, w, h)]:
+        x0, y0, x1, y1 = box
+        rgb, mask = (np.asarray(im) for im in colorize(norm, size, box))
+        np.testing.assert_array_equal(rgb, full_rgb[y0:y1, x0:x1])
+        np.testing.assert_array_equal(mask, full_mask[y0:y1, x0:x1])
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""ImageCache LRU bookkeeping, and blend_arrays against Image.blend."""
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from inpi_heatmap.image_cache import ImageCache, blend_arrays, blend_images
+
+
+def _png(path, seed: int, size=(32, 24)):
+    px = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(px).save(path)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+@pytest.mark.parametrize("alpha", [0.0, 0.01, 0.3, 0.45, 0.5, 0.7, 0.99, 1.0, 1.5])
+def test_blend_arrays_matches_pil(mode, alpha):
+    rng = np.random.default_rng(7)
+    shape = (40, 50, len(mode))
+    base, layer = (rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(2))
+    expected = np.asarray(Image.blend(Image.fromarray(base, mode), Image.fromarray(layer, mode), min(alpha, 1.0)))
+    np.testing.assert_array_equal(blend_arrays(base, layer, alpha), expected)
+
+
+def test_hits_misses_and_invalidation(tmp_path):
+    cache = ImageCache()
+    path = _png(tmp_path / "a.png", 0)
+    first = cache.rgba(path)
+    assert first.shape == (24, 32, 4) and not first.flags.writeable
+    assert cache.rgba(path) is first
+    assert cache.rgba(path, size=(16, 12)).shape == (12, 16, 4)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    st = os.stat(path)
+    _png(path, 1)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.rgba(path) is not first
+    assert cache.stats()["misses"] == 3 and cache.stats()["entries"] == 3
+
+
+def test_lru_eviction_by_bytes(tmp_path):
+    paths = [_png(tmp_path / f"{i}.png", i) for i in range(3)]
+    entry = 24 * 32 * 4
+    cache = ImageCache(max_bytes=2 * entry)
+    a = cache.rgba(paths[0])
+    cache.rgba(paths[1])
+    assert cache.rgba(paths[0]) is a  # a is now the most recent
+    cache.rgba(paths[2])  # evicts paths[1], the least recently used
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 2 * entry, 1)
+    assert cache.rgba(paths[0]) is a
+    misses = cache.misses
+    cache.rgba(paths[1])
+    assert cache.misses == misses + 1
+
+
+def test_oversized_images_are_not_kept(tmp_path):
+    cache = ImageCache(max_bytes=100)
+    path = _png(tmp_path / "big.png", 0)
+    cache.rgba(path)
+    cache.rgba(path)
+    assert cache.stats()["entries"] == 0 and cache.misses == 2
+    cache.clear()
+    assert cache.stats()["bytes"] == 0
+
+
+def test_blend_images_resizes_the_heatmap(tmp_path):
+    query = _png(tmp_path / "q.png", 0, size=(40, 30))
+    heat = _png(tmp_path / "h.png", 1, size=(20, 15))
+    cache = ImageCache()
+    out = blend_images(query, heat, 0.45, cache=cache)
+    assert out.mode == "RGBA" and out.size == (40, 30)
+    expected = Image.blend(
+        Image.open(query).convert("RGBA"), Image.open(heat).convert("RGBA").resize((40, 30), Image.LANCZOS), 0.45
+    )
+    np.testing.assert_array_equal(np.asarray(out), np.asarray(expected))
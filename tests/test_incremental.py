@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""add_mark / remove_mark round-trips with the stub embedder on a tmp data dir."""
+
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from inpi_heatmap import assets, incremental, records
+from inpi_heatmap.assets import referenced_paths
+from inpi_heatmap.embeddings import EmbeddingStore
+from inpi_heatmap.incremental import add_mark, remove_mark
+from inpi_heatmap.jobs import StubEmbedder
+from inpi_heatmap.manifest_store import JsonManifestStore
+
+PARAMS = {"cls_threshold": -1.0, "top_k": 3}
+MARKS = [f"m{i}" for i in range(7)]
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(records, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(incremental, "DATA_DIR", tmp_path)
+    rng = np.random.default_rng(0)
+    (tmp_path / "sources").mkdir()
+    for mark_id in MARKS + ["novo"]:
+        px = rng.integers(0, 256, (48, 48, 3), dtype=np.uint8)
+        Image.fromarray(px).save(tmp_path / "sources" / f"{mark_id}.png")
+    (tmp_path / "manifest.json").write_text("{}", encoding="utf-8")
+    return tmp_path
+
+
+@pytest.fixture
+def setup(data_dir):
+    embedder = StubEmbedder()
+    store = EmbeddingStore.create(data_dir / "embeddings.bin", dim=embedder.dim, n_patches=embedder.grid ** 2)
+    manifest = JsonManifestStore(data_dir / "manifest.json")
+    for mark_id in MARKS:
+        _add(mark_id, embedder, store, manifest)
+    return embedder, store, manifest
+
+
+def _add(mark_id, embedder, store, manifest):
+    source = records.DATA_DIR / "sources" / f"{mark_id}.png"
+    return add_mark(mark_id, source, embedder, store, manifest, params=PARAMS, min_threshold=-1.0)
+
+
+def _lists(manifest) -> dict:
+    return {k: [(nb["target"], nb["cls_sim"]) for nb in manifest.get(k)["neighbors"]] for k in manifest.keys()}
+
+
+def _check_files(data_dir, manifest):
+    live = {p for k in manifest.keys() for p in referenced_paths(manifest.get(k))}
+    assert all((data_dir / p).is_file() for p in live)
+    on_disk = {p.relative_to(data_dir).as_posix() for p in (data_dir / "outputs").rglob("*") if p.is_file()}
+    assert on_disk <= live, "files left behind after the swap"
+
+
+def test_neighbor_lists_are_exact_top_k(setup):
+    embedder, store, manifest = setup
+    for key in MARKS:
+        sims = incremental.similarities(store, store.cls(key))
+        expected = incremental.top_neighbors(store, sims, PARAMS["top_k"], PARAMS["cls_threshold"], exclude=(key,))
+        assert [nb["target"] for nb in manifest.get(key)["neighbors"]] == [nb["target"] for nb in expected]
+
+
+def test_add_then_remove_restores_lists(setup, data_dir):
+    embedder, store, manifest = setup
+    before = _lists(manifest)
+    added = _add("novo", embedder, store, manifest)
+    assert added["updated"] == sorted(manifest.referencing("novo"))
+    _check_files(data_dir, manifest)
+
+    removed = remove_mark("novo", store, manifest)
+    assert removed["updated"] == added["updated"]
+    assert "novo" not in manifest and "novo" not in store
+    assert _lists(manifest) == before
+    _check_files(data_dir, manifest)
+    assert not (data_dir / "outputs" / "novo").exists()
+
+
+def test_remove_then_add_restores_lists(setup, data_dir):
+    embedder, store, manifest = setup
+    before = _lists(manifest)
+    referencing = sorted(manifest.referencing("m3"))
+    removed = remove_mark("m3", store, manifest)
+    assert removed["updated"] == referencing
+    assert all(len(neighbors) == PARAMS["top_k"] for neighbors in _lists(manifest).values())
+    _check_files(data_dir, manifest)
+
+    _add("m3", embedder, store, manifest)
+    assert _lists(manifest) == before
+    _check_files(data_dir, manifest)
+
+
+def test_asset_index_follows_the_swaps(setup, data_dir):
+    embedder, store, manifest = setup
+    index_path = data_dir / "asset_index.json"
+    assets.build(manifest, data_dir, index_path)
+    _add("novo", embedder, store, manifest)
+    remove_mark("m3", store, manifest)
+
+    index = json.loads(index_path.read_text(encoding="utf-8"))
+    live = {p for k in manifest.keys() for p in referenced_paths(manifest.get(k))}
+    assert set(index["files"]) == live and not index["missing"]
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""JobQueue + AnalysisPipeline end to end, with the stub embedder on a tmp data dir."""
+
+import io
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from inpi_heatmap import records
+from inpi_heatmap.config import APP_DIR
+from inpi_heatmap.embeddings import EmbeddingStore
+from inpi_heatmap.jobs import AnalysisPipeline, JobQueue, QueueFullError, StubEmbedder, make_embedder
+
+MARKS = ("circle", "square", "stripes")
+
+
+def _mark(kind: str, size: int = 96) -> Image.Image:
+    px = np.full((size, size, 3), 255, dtype=np.uint8)
+    yy, xx = np.mgrid[:size, :size]
+    if kind == "circle":
+        px[(yy - size / 2) ** 2 + (xx - size / 2) ** 2 < (size / 3) ** 2] = (200, 20, 20)
+    elif kind == "square":
+        px[size // 4:3 * size // 4, size // 4:3 * size // 4] = (20, 20, 200)
+    else:
+        px[(xx // 8) % 2 == 0] = (20, 160, 20)
+    return Image.fromarray(px)
+
+
+def _png(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _wait(job, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while job.active:
+        assert time.monotonic() < deadline, f"job {job.id} still {job.status}"
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(records, "DATA_DIR", tmp_path)
+    (tmp_path / "images").mkdir()
+    for kind in MARKS:
+        _mark(kind).save(tmp_path / "images" / f"{kind}.png")
+    return tmp_path
+
+
+@pytest.fixture
+def pipeline(data_dir):
+    embedder = StubEmbedder()
+    store = EmbeddingStore.create(data_dir / "embeddings.bin", dim=embedder.dim, n_patches=embedder.grid ** 2)
+    store.extend(list(MARKS), np.stack([embedder.embed(_mark(kind)) for kind in MARKS]))
+    return AnalysisPipeline(embedder, store=store, params={"cls_threshold": -1.0},
+                            out_dir=data_dir / "outputs" / "uploads")
+
+
+class _Blocked:
+    """Pipeline that holds every job until ``release`` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def __call__(self, job, data, progress):
+        self.release.wait(30)
+        return {}
+
+
+def test_result_matches_manifest_schema(data_dir, pipeline):
+    queue = JobQueue(pipeline)
+    job = _wait(queue.submit("Bola", _png(_mark("circle", 128)), owner="a"))
+    assert job.status == "done", job.error
+    assert (job.progress, job.stage) == (1.0, "Concluído")
+
+    reference = next(iter(json.loads((APP_DIR / "data" / "manifest.json").read_text(encoding="utf-8")).values()))
+    record = job.result
+    assert set(reference) <= set(record)
+    assert set(reference["params"]) <= set(record["params"])
+    for key in ("final_overlay", "fg_selected_patches", "final_scale"):
+        assert key in record["outputs"]
+    assert [nb["target"] for nb in record["neighbors"]][0] == "circle"
+    for nb in record["neighbors"]:
+        assert set(reference["neighbors"][0]) <= set(nb)
+        assert (data_dir / nb["target_image"]).is_file()
+    assert record["outputs"]["neighbor_heat_targets"] == [nb["target"] for nb in record["neighbors"]]
+    assert (data_dir / record["outputs"]["pyramid"] / "meta.json").is_file()
+    for key in ("final_overlay", "fg_heat_grid", "final_heat_grid", "neighbor_heat_grid"):
+        assert (data_dir / record["outputs"][key]).is_file()
+    assert (data_dir / record["image"]).is_file()
+
+
+def test_worker_error_is_reported_and_worker_survives(pipeline):
+    queue = JobQueue(pipeline)
+    bad = _wait(queue.submit("quebrada", b"not an image"))
+    assert bad.status == "error"
+    assert bad.error.startswith("UnidentifiedImageError")
+    good = _wait(queue.submit("quadrado", _png(_mark("square"))))
+    assert good.status == "done", good.error
+
+
+def test_queue_full():
+    blocked = _Blocked()
+    queue = JobQueue(blocked, workers=1, max_pending=1, max_per_owner=10)
+    try:
+        running = queue.submit("a", b"")
+        while running.status != "running":
+            time.sleep(0.01)
+        queue.submit("b", b"")
+        with pytest.raises(QueueFullError):
+            queue.submit("c", b"")
+        assert queue.pending() == 1
+    finally:
+        blocked.release.set()
+
+
+def test_per_owner_backpressure():
+    blocked = _Blocked()
+    queue = JobQueue(blocked, workers=1, max_pending=8, max_per_owner=2)
+    try:
+        first = queue.submit("a1", b"", owner="a")
+        queue.submit("a2", b"", owner="a")
+        with pytest.raises(QueueFullError):
+            queue.submit("a3", b"", owner="a")
+        queue.submit("b1", b"", owner="b")
+        assert [j.name for j in queue.jobs_for("a")] == ["a1", "a2"]
+    finally:
+        blocked.release.set()
+    # Once the owner's jobs finish, it may submit again.
+    _wait(first)
+    for job in queue.jobs_for("a"):
+        _wait(job)
+    assert _wait(queue.submit("a3", b"", owner="a")).status == "done"
+
+
+def test_make_embedder_falls_back_to_stub(monkeypatch):
+    monkeypatch.delenv("INPI_EMBEDDER", raising=False)
+    monkeypatch.setattr("inpi_heatmap.jobs.Dinov3Embedder", _missing_model)
+    embedder = make_embedder(allow_fallback=True)
+    assert isinstance(embedder, StubEmbedder) and "torch" in embedder.fallback
+    with pytest.raises(RuntimeError):
+        make_embedder()
+    with pytest.raises(RuntimeError):
+        make_embedder("dinov3", allow_fallback=True)
+    assert make_embedder("stub").fallback is None
+
+
+def _missing_model():
+    raise RuntimeError("DINOv3 requer torch e transformers instalados")
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Both manifest backends: search, count, put_many and cross-process invalidation."""
+
+import json
+
+import pytest
+
+from inpi_heatmap.manifest_store import JsonManifestStore, SqliteManifestStore
+
+RECORDS = {
+    "redbull": {"neighbors": [{"target": "audi"}]},
+    "audi": {"neighbors": [{"target": "redbull"}, {"target": "brooks"}]},
+    "brooks": {"neighbors": []},
+    "red_50": {"display_name": "Red 50%", "neighbors": [{"target": "audi"}]},
+    "redxx": {"display_name": "Redx", "neighbors": []},
+}
+
+
+def _open(kind: str, path, records=RECORDS):
+    if kind == "json":
+        path = path / "manifest.json"
+        path.write_text(json.dumps(records), encoding="utf-8")
+        return JsonManifestStore(path)
+    return SqliteManifestStore.create(path / "manifest.sqlite", records)
+
+
+def _reopen(kind: str, store):
+    return JsonManifestStore(store.path) if kind == "json" else SqliteManifestStore(store.path)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def kind(request):
+    return request.param
+
+
+def test_search_matches_prefixes(kind, tmp_path):
+    store = _open(kind, tmp_path)
+    assert sorted(store.search("RED")) == [("red_50", "Red 50%"), ("redbull", "Red Bull"), ("redxx", "Redx")]
+    assert store.search("bull") == []  # prefixes only, not substrings
+    assert [k for k, _ in store.search("red b")] == ["redbull"]
+    assert store.count("red") == 3 and store.count("  ") == len(RECORDS)
+    assert [k for k, _ in store.search("", limit=2)] == [k for k, _ in store.search("")][:2]
+
+
+def test_search_wildcards_are_literal(kind, tmp_path):
+    store = _open(kind, tmp_path)
+    assert [k for k, _ in store.search("red_")] == ["red_50"]
+    assert [k for k, _ in store.search("red 50%")] == ["red_50"]
+    assert store.search("%") == [] and store.count("_") == 0
+
+
+def test_put_many_and_delete(kind, tmp_path):
+    store = _open(kind, tmp_path)
+    store.put_many({"speedo": {"neighbors": [{"target": "audi"}]}}, delete=["brooks"])
+    assert "brooks" not in store and store.get("brooks") is None
+    assert store.get("speedo")["neighbors"] == [{"target": "audi"}]
+    assert sorted(store.referencing("audi")) == ["red_50", "redbull", "speedo"]
+    assert len(store) == len(RECORDS) and store.count("spe") == 1
+    assert sorted(_reopen(kind, store).keys()) == sorted(store.keys())
+
+
+def test_other_process_writes_invalidate_cached_records(kind, tmp_path):
+    reader = _open(kind, tmp_path)
+    assert reader.get("audi")["neighbors"][0] == {"target": "redbull"}
+    version = reader.version()
+    writer = _reopen(kind, reader)
+    writer.put_many({"audi": {"neighbors": [{"target": "brooks"}]}})
+    if kind == "json":
+        assert reader.refresh()
+    assert reader.version() != version
+    assert reader.get("audi")["neighbors"] == [{"target": "brooks"}]
+    assert not reader.refresh()
+
+
+def test_sqlite_search_uses_the_indexes(tmp_path):
+    store = _open("sqlite", tmp_path)
+    where, args = store._where("red")
+    plan = " ".join(row[-1] for row in store._conn.execute(f"EXPLAIN QUERY PLAN SELECT key FROM records{where}", args))
+    assert "records_key_nocase" in plan and "records_display_name" in plan and "SCAN" not in plan
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Headless views on the demo data."""
+
+import json
+
+import pytest
+
+from inpi_heatmap.config import DATA_DIR
+from inpi_heatmap.render import STRIP_COLUMNS, STRIP_HEIGHT, render_report, render_strip
+
+NEIGHBORS = [
+    nb for record in json.loads((DATA_DIR / "manifest.json").read_text(encoding="utf-8")).values()
+    for nb in record["neighbors"]
+]
+
+
+def _neighbors(n: int) -> list:
+    return [{**NEIGHBORS[i % len(NEIGHBORS)], "rank": i + 1} for i in range(n)]
+
+
+@pytest.mark.parametrize("n", [0, 1, STRIP_COLUMNS, STRIP_COLUMNS + 1, 120])
+def test_strip_wraps_long_neighbor_lists(n):
+    strip = render_strip(_neighbors(n))
+    assert strip.width == 1200
+    assert strip.height == STRIP_HEIGHT * max(1, -(-n // STRIP_COLUMNS))
+
+
+def test_report_holds_the_whole_strip():
+    strip, blend = render_strip(_neighbors(12)), render_strip([])
+    report = render_report("maestro", {"neighbors": _neighbors(12)}, blend, strip)
+    assert report.height == 80 + blend.height + 24 + strip.height
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""SimMatrix reload behaviour around rebuilds."""
+
+import numpy as np
+import pytest
+
+from inpi_heatmap.embeddings import EmbeddingStore
+from inpi_heatmap.simmatrix import SimMatrix, build
+
+
+def test_refresh_keeps_the_matrix_while_its_files_are_missing(tmp_path):
+    store = EmbeddingStore.create(tmp_path / "embeddings.bin", dim=8, n_patches=4)
+    store.extend([f"m{i}" for i in range(40)], np.random.default_rng(0).standard_normal((40, 5, 8)))
+    out_dir = tmp_path / "simmatrix"
+    build(store, out_dir, verbose=False)
+    matrix = SimMatrix(out_dir, store)
+    ids = list(matrix.ids)
+
+    meta = (out_dir / "meta.json").read_bytes()
+    (out_dir / "meta.json").unlink()
+    assert not matrix.refresh()
+    (out_dir / "meta.json").write_text("{", encoding="utf-8")
+    assert not matrix.refresh()
+    assert matrix.ids == ids and matrix.levels >= 1
+
+    (out_dir / "meta.json").write_bytes(meta)
+    assert matrix.refresh() and matrix.ids == ids
+
+    with pytest.raises(OSError):
+        SimMatrix(tmp_path / "missing", store)